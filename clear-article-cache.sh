@@ -0,0 +1,14 @@
+#/bin/bash
+# removes everything cached for an article: glencoe, iiif, cdn and reviewed-preprint responses, 'not found' responses
+# and the dimensions of its images.
+# only responses cached since they were tagged with the article's msid are removed, see `src/cache_requests.py`.
+function is_int() { return $(test "$@" -eq "$@" > /dev/null 2>&1); }
+source venv/bin/activate # contains unbound vars
+set -eu
+msid=$1
+if $(is_int "$msid"); then
+    PYTHONPATH=src python -c "import cache_requests, negative_cache, iiif_dimensions; print('removed', cache_requests.purge($msid), 'cached responses'); print('removed', negative_cache.bust($msid), 'not found responses'); print('removed', iiif_dimensions.forget($msid), 'image dimensions')"
+else
+    echo "msid must be an integer"
+    exit 1
+fi
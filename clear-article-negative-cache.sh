@@ -0,0 +1,12 @@
+#/bin/bash
+# forgets the 'not found' responses from glencoe, iiif, the cdn and reviewed-preprints remembered for an article
+function is_int() { return $(test "$@" -eq "$@" > /dev/null 2>&1); }
+source venv/bin/activate # contains unbound vars
+set -eu
+msid=$1
+if $(is_int "$msid"); then
+    PYTHONPATH=src python src/negative_cache.py "$msid"
+else
+    echo "msid must be an integer"
+    exit 1
+fi
@@ -1,10 +1,12 @@
 #!/bin/bash
-# removes all expired entries from the requests_cache db, shrinks db
+# removes entries from the requests_cache db that have been stale for too long, shrinks db
 set -e
 source venv/bin/activate
 
-# clear expired entries
-output_path=$(cd src && python -c 'import cache_requests; print(cache_requests.clear_expired())')
+# clear expired entries.
+# importing 'enrichment' installs the cache and registers the TTL of each service.
+output_path=$(cd src && python -c 'import enrichment, cache_requests; print(cache_requests.clear_expired())')
+(cd src && python -c 'import negative_cache; negative_cache.clear_expired()')
 
 # call VACUUM on the sqlite db to shrink it
 du -sh "$output_path"
@@ -1,10 +1,16 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
 from functools import partial, wraps
 import json
 import logging
 import os
 from os.path import join
+import queue
+import shutil
 import sys
+import tempfile
+import threading
 from time import time
 from requests_aws4auth import AWS4Auth
 import botocore.session
@@ -24,7 +30,7 @@ from conf import (
 
     PROJECT_DIR
 )
-import main as scraper, fs_adaptor, sqs_adaptor, utils
+import main as scraper, fs_adaptor, sqs_adaptor, utils, render_cache, lax_worker
 from utils import (
     subdict,
     renkeys,
@@ -87,6 +93,40 @@ def find_lax():
     ensure(os.path.exists(script), "could not find lax's manage.sh script")
     return script
 
+def run_lax(cmd, stdin=None):
+    "runs lax's `manage.sh` with the given `cmd`, writing `stdin` to it. returns what lax wrote to stdout."
+    if conf.LAX_WORKER:
+        # the same command, run by a long-lived lax process. see `lax_worker.py`
+        return lax_worker.worker(cmd[0]).call(cmd[2:], stdin)
+    rc, lax_stdout = utils.run_script(cmd, stdin)
+    return lax_stdout
+
+def lax_response(lax_resp, action, msid, token, force=False, dry_run=False):
+    "returns the given response from lax with the attributes of the request it was made for"
+    bot_lax_resp = {
+        "id": msid,
+        "status": None,
+        # not present in success responses
+        # added in error responses
+        # "message":
+        # "code":
+        # "comment":
+        "datetime": datetime.now(),
+
+        # additional attributes we'll be returning
+        "action": action,
+        "force": force,
+        "dry-run": dry_run,
+        "token": token,
+    }
+
+    # ensure everything that lax returns is preserved
+    # valid adaptor responses are handled in `mkresponse`
+    # valid api responses are handled in api.post_xml
+    bot_lax_resp.update(lax_resp)
+    bot_lax_resp['id'] = str(bot_lax_resp['id'])
+    return bot_lax_resp
+
 def call_lax(action, msid, version, token, article_json=None, force=False, dry_run=False):
     cmd = [
         find_lax(), # /srv/lax/manage.sh
@@ -103,38 +143,59 @@ def call_lax(action, msid, version, token, article_json=None, force=False, dry_r
         cmd += ["--force"]
     lax_stdout = None
     try:
-        rc, lax_stdout = utils.run_script(cmd, article_json)
+        lax_stdout = run_lax(cmd, article_json)
         lax_resp = json.loads(lax_stdout)
+        return lax_response(lax_resp, action, msid, token, force, dry_run)
 
-        bot_lax_resp = {
-            "id": msid,
-            "status": None,
-            # not present in success responses
-            # added in error responses
-            # "message":
-            # "code":
-            # "comment":
-            "datetime": datetime.now(),
-
-            # additional attributes we'll be returning
-            "action": action,
-            "force": force,
-            "dry-run": dry_run,
-            "token": token,
-        }
-
-        # ensure everything that lax returns is preserved
-        # valid adaptor responses are handled in `mkresponse`
-        # valid api responses are handled in api.post_xml
-        bot_lax_resp.update(lax_resp)
-        bot_lax_resp['id'] = str(bot_lax_resp['id'])
-        return bot_lax_resp
-
-    except ValueError as err:
+    except (ValueError, TypeError) as err:
         # could not parse lax response. this is a lax error
         raise RuntimeError("failed to parse response from lax, expecting json, got error %r from stdout %r" %
                            (str(err), lax_stdout))
 
+def call_lax_bulk(params_list, action=INGEST, force=False, dry_run=False):
+    """calls lax once for many articles, like `reload-article.sh` does.
+    `params_list` is a list of keyword arguments for `call_lax`, each for a different article.
+    lax's `ingest --serial --dir` writes a response per article to stdout, one per line, each just like the response
+    to `call_lax` for that article.
+    returns a list of responses from lax in the same order. an article lax didn't respond about has `None`."""
+    ensure(len(set(params['msid'] for params in params_list)) == len(params_list), "an article can only be sent to lax once per call")
+    tempdir = tempfile.mkdtemp()
+    lax_stdout = None
+    try:
+        for params in params_list:
+            # "elife-09560-v1.xml.json", lax takes the msid and version from the filename
+            fname = "elife-%s-v%s.xml.json" % (utils.pad_msid(params['msid']), params['version'])
+            with open(join(tempdir, fname), 'w') as fh:
+                fh.write(params['article_json'])
+        cmd = [
+            find_lax(), # /srv/lax/manage.sh
+            "--skip-install",
+            "ingest",
+            "--" + action, # "--ingest"
+            "--serial",
+            "--dir", tempdir,
+        ]
+        if dry_run:
+            cmd += ["--dry-run"]
+        if force:
+            cmd += ["--force"]
+        lax_stdout = run_lax(cmd)
+        lax_resp_list = [json.loads(line) for line in lax_stdout.splitlines() if line.strip()]
+        lax_resp_map = {str(int(lax_resp['id'])): lax_resp for lax_resp in lax_resp_list}
+
+    except (ValueError, TypeError, KeyError) as err:
+        # could not parse lax response. this is a lax error
+        raise RuntimeError("failed to parse response from lax, expecting a json response per line, got error %r from stdout %r" %
+                           (str(err), lax_stdout))
+    finally:
+        shutil.rmtree(tempdir)
+
+    results = []
+    for params in params_list:
+        lax_resp = lax_resp_map.get(str(int(params['msid'])))
+        results.append(lax_resp and lax_response(lax_resp, action, params['msid'], params['token'], force, dry_run))
+    return results
+
 def file_handler(path):
     ensure(path.startswith(PROJECT_DIR),
            "unsafe operation - refusing to read from a file location outside of project root. %r does not start with %r" % (path, PROJECT_DIR))
@@ -194,7 +255,7 @@ def mkresponse(status, message, request={}, **kwargs):
     packet = renkeys(packet, [
         ("action", "requested-action"),
         ("dry-run", "validate-only")
-    ])
+    ], inplace=True)
 
     # remove any keys not supported in the schema
     supported_keys = conf.RESPONSE_SCHEMA['properties'].keys()
@@ -221,74 +282,118 @@ def mkresponse(status, message, request={}, **kwargs):
 
     return packet
 
-@timeit
-def handler(json_request, outgoing):
-    response = partial(send_response, outgoing)
+class RequestError(RuntimeError):
+    "a request that can't be handled. `request` is what's known of the request, if anything"
+    def __init__(self, message, request=None):
+        super().__init__(message)
+        self.message = message
+        self.request = request or {}
 
+    def __reduce__(self):
+        # raised in worker processes, see `pipeline.py`
+        return (RequestError, (self.message, self.request))
+
+def parse_request(json_request):
+    "returns the given request, validated, and the keyword arguments to `call_lax` with"
     try:
         request = utils.validate(json_request, conf.REQUEST_SCHEMA)
     except ValueError:
         # bad data. who knows what it was. die
-        return response(mkresponse(ERROR, "request could not be parsed: %s" % json_request))
+        raise RequestError("request could not be parsed: %s" % json_request)
 
     except ValidationError as err:
         # data is readable, but it's in an unknown/invalid format. die
-        return response(mkresponse(ERROR, "request was incorrectly formed: %s" % str(err)))
+        raise RequestError("request was incorrectly formed: %s" % str(err))
 
     except Exception as err:
         # die
-        msg = "unhandled error attempting to handle request: %s" % str(err)
-        return response(mkresponse(ERROR, msg))
+        raise RequestError("unhandled error attempting to handle request: %s" % str(err))
 
     # we have a valid request :)
     LOG.info("valid request")
 
     params = subdict(request, ['action', 'id', 'token', 'version', 'force', 'validate-only'])
-    params = renkeys(params, [('validate-only', 'dry_run'), ('id', 'msid')])
+    params = renkeys(params, [('validate-only', 'dry_run'), ('id', 'msid')], inplace=True)
+    return request, params
 
-    # if we're to ingest/publish, then we expect a location to download article data
-    if params['action'] in [INGEST, INGEST_PUBLISH]:
-        try:
-            article_xml = download(request['location'])
-            if not article_xml:
-                raise ValueError("no article content available")
+def download_article_xml(request):
+    "returns the article-xml at the request's `location`"
+    try:
+        article_xml = download(request['location'])
+        if not article_xml:
+            raise ValueError("no article content available")
 
-        except AssertionError as err:
-            msg = "refusing to download article xml: %s" % str(err)
-            return response(mkresponse(ERROR, msg, request))
+    except AssertionError as err:
+        raise RequestError("refusing to download article xml: %s" % str(err), request)
 
-        except Exception as err:
-            msg = "failed to download article xml from %r: %s" % (request['location'], str(err))
-            return response(mkresponse(ERROR, msg, request))
+    except Exception as err:
+        raise RequestError("failed to download article xml from %r: %s" % (request['location'], str(err)), request)
 
-        LOG.info("got xml")
+    LOG.info("got xml")
+    return article_xml
 
-        try:
-            article_data = scraper.render_single(article_xml,
-                                                 version=params['version'],
-                                                 location=request['location'])
-            LOG.info("rendered article data ")
+def render_ctx(request):
+    return {'version': request['version'], 'location': request['location']}
 
-        except Exception as err:
-            error = str(err) if hasattr(err, 'message') else err
-            msg = "failed to render article-json from article-xml: %s" % error
-            LOG.exception(msg, extra=params)
-            return response(mkresponse(ERROR, msg, request))
+def render_article_xml(request, article_xml):
+    "returns the article data rendered from the given `article_xml`"
+    try:
+        article_data = scraper.render_single(article_xml, **render_ctx(request))
+        LOG.info("rendered article data ")
 
-        LOG.info("successful scrape")
+    except Exception as err:
+        error = str(err) if hasattr(err, 'message') else err
+        msg = "failed to render article-json from article-xml: %s" % error
+        LOG.exception(msg, extra={'msid': request['id'], 'version': request['version']})
+        raise RequestError(msg, request)
 
-        try:
-            article_json = utils.json_dumps(article_data)
-        except ValueError as err:
-            msg = "failed to serialize article data to article-json: %s" % str(err)
-            return response(mkresponse(ERROR, msg, request))
+    LOG.info("successful scrape")
+    return article_data
 
-        LOG.info("successfully serialized article-data to article-json")
+def serialise_article_data(request, article_data):
+    "returns the given `article_data` as article-json"
+    try:
+        article_json = utils.json_dumps(article_data)
+    except ValueError as err:
+        raise RequestError("failed to serialize article data to article-json: %s" % str(err), request)
 
-        # phew! gauntlet ran, we're now confident of passing this article-json to lax
-        # lax may still reject the data as invalid, but we'll proxy that back if necessary
-        params['article_json'] = article_json
+    LOG.info("successfully serialized article-data to article-json")
+    return article_json
 
+def prepare(json_request, outgoing):
+    """validates the given request and, if article data is to be ingested, downloads and renders its article-json.
+    returns a pair of the request and the keyword arguments to `call_lax` with.
+    if the request can't be handled an error response is sent and a pair of that response and `None` is returned."""
+    try:
+        request, params = parse_request(json_request)
+
+        # if we're to ingest/publish, then we expect a location to download article data
+        if params['action'] in [INGEST, INGEST_PUBLISH]:
+            article_xml = download_article_xml(request)
+
+            cache_key = render_cache.key(article_xml, render_ctx(request))
+            article_json = render_cache.get(cache_key)
+
+            if article_json is not None:
+                LOG.info("article-json found in render cache")
+
+            else:
+                article_data = render_article_xml(request, article_xml)
+                article_json = serialise_article_data(request, article_data)
+                render_cache.put(cache_key, article_json)
+
+            # phew! gauntlet ran, we're now confident of passing this article-json to lax
+            # lax may still reject the data as invalid, but we'll proxy that back if necessary
+            params['article_json'] = article_json
+
+    except RequestError as err:
+        return send_response(outgoing, mkresponse(ERROR, err.message, err.request)), None
+
+    return request, params
+
+def send_to_lax(request, params, outgoing):
+    "calls lax with the given `params` for the given `request` and sends its response"
+    response = partial(send_response, outgoing)
     try:
         LOG.info("calling lax")
 
@@ -305,6 +410,107 @@ def handler(json_request, outgoing):
         # when lax fails, we fail
         raise
 
+@timeit
+def handler(json_request, outgoing):
+    request, params = prepare(json_request, outgoing)
+    if params is None:
+        # request couldn't be handled, `request` is the error response sent
+        return request
+    return send_to_lax(request, params, outgoing)
+
+class Responses:
+    """an outgoing queue that keeps what's sent to it to be sent later.
+    a request handled by a worker process can't send its own responses, the process that read the request sends them."""
+
+    def __init__(self):
+        self.sent = []
+
+    def write(self, string):
+        self.sent.append(('write', string))
+
+    def error(self, string):
+        self.sent.append(('error', string))
+
+    def send(self, outgoing):
+        for channel, string in self.sent:
+            getattr(outgoing, channel)(string)
+
+def handle(json_request):
+    """handles the given request in a worker process, see `do_concurrent`.
+    returns its responses and the error that stopped the handler, if any."""
+    responses = Responses()
+    try:
+        handler(json_request, responses)
+    except Exception as err:
+        return responses, str(err)
+    return responses, None
+
+def request_msid(json_request):
+    "returns the id of the article the given request is about, `None` if it can't be read"
+    try:
+        request = json.loads(json_request) if isinstance(json_request, str) else json_request
+        return str(request['id'])
+    except Exception:
+        return None
+
+class IngestBatch:
+    """valid ingest requests waiting to be sent to lax together, see `call_lax_bulk`.
+    the batch is due to be sent once it has `size` requests or its oldest request has waited `wait` seconds.
+    requests in a batch must share the same `force` and `dry_run` flags and be for different articles."""
+
+    def __init__(self, outgoing, size, wait):
+        self.outgoing = outgoing
+        self.size = size
+        self.wait = wait
+        self.pending = []
+        self.started = None
+
+    def accepts(self, params):
+        "returns `True` if the request with the given `params` can join this batch"
+        if params['action'] != INGEST:
+            return False
+        if not self.pending:
+            return True
+        _, first = self.pending[0]
+        return (first['force'], first['dry_run']) == (params['force'], params['dry_run']) \
+            and params['msid'] not in [pending['msid'] for _, pending in self.pending]
+
+    def add(self, request, params):
+        if not self.pending:
+            self.started = time()
+        self.pending.append((request, params))
+
+    def full(self):
+        return len(self.pending) >= self.size
+
+    def remaining(self):
+        "returns the seconds until this batch is due to be sent, `None` if it's empty"
+        if not self.pending:
+            return None
+        return max(0, self.started + self.wait - time())
+
+    def flush(self):
+        "sends the pending requests to lax and a response for each request"
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        response = partial(send_response, self.outgoing)
+        _, first = pending[0]
+        LOG.info("calling lax with %s articles", len(pending), extra={'articles': len(pending)})
+        try:
+            lax_response_list = call_lax_bulk([params for _, params in pending], INGEST, first['force'], first['dry_run'])
+        except Exception as err:
+            msg = "lax failed attempting to handle our request: %s" % str(err)
+            for request, _ in pending:
+                response(mkresponse(ERROR, msg, request))
+            # when lax fails, we fail
+            raise
+        for (request, _), lax_resp in zip(pending, lax_response_list):
+            if lax_resp is None:
+                response(mkresponse(ERROR, "lax didn't respond about this article when ingesting many articles at once", request))
+            else:
+                response(mkresponse(**lax_resp))
+
 #
 #
 #
@@ -338,7 +544,21 @@ class Flag:
     def stop(self):
         self.should_stop = True
 
-def do(incoming, outgoing):
+def do(incoming, outgoing, processes=None):
+    """handles each request from `incoming`, sending responses to `outgoing`.
+    see `pipeline.py` and `do_concurrent` for handling many requests at once and `do_batched` for ingesting many
+    articles at once."""
+    if conf.PIPELINE:
+        # `pipeline` imports this module
+        import pipeline
+        return pipeline.do(incoming, outgoing)
+    processes = processes or conf.ADAPTOR_PROCESSES
+    if processes > 1:
+        if conf.LAX_BATCH_SIZE > 1:
+            LOG.warning("ingest requests aren't sent to lax in batches when handling requests concurrently")
+        return do_concurrent(incoming, outgoing, processes)
+    if conf.LAX_BATCH_SIZE > 1:
+        return do_batched(incoming, outgoing, conf.LAX_BATCH_SIZE, conf.LAX_BATCH_WAIT)
     # we'll see how far this abstraction gets us...
     try:
         for request in incoming:
@@ -350,6 +570,194 @@ def do(incoming, outgoing):
 
     LOG.info("graceful shutdown")
 
+# marks the end of the incoming requests
+_DONE = object()
+
+def read_all(incoming, request_queue, slots=None, stop=None):
+    """puts each request from `incoming` on the `request_queue`, followed by `_DONE` or the error that stopped it.
+    if given, a slot is taken from the `slots` semaphore before each request is read and no more requests are read
+    once the `stop` event is set.
+
+    an SQS message is deleted as the next one is read, so every request put on the queue must be responded to, even if
+    it's never handled, see `not_handled`. the request read when `stop` is set isn't deleted and will be read again."""
+    try:
+        incoming = iter(incoming)
+        while True:
+            if slots:
+                slots.acquire()
+            if stop and stop.is_set():
+                break
+            request = next(incoming, _DONE)
+            request_queue.put(request)
+            if request is _DONE:
+                break
+    except BaseException as err:
+        request_queue.put(err)
+
+def not_handled(outgoing, json_request, reason):
+    "sends an error response to a request that was read but won't be handled because of `reason`"
+    try:
+        request = json.loads(json_request) if isinstance(json_request, str) else json_request
+    except ValueError:
+        request = None
+    if not isinstance(request, dict):
+        request = {}
+    return send_response(outgoing, mkresponse(ERROR, "request not handled: %s" % reason, request))
+
+def drain(outgoing, request_queue, reason):
+    "sends an error response to each request left on the `request_queue` filled by `read_all`"
+    while True:
+        try:
+            request = request_queue.get_nowait()
+        except queue.Empty:
+            return
+        # the queue may also hold the end of the requests, the error that stopped them and, see `do_concurrent`,
+        # finished requests
+        if isinstance(request, (str, dict)):
+            not_handled(outgoing, request, reason)
+
+def do_batched(incoming, outgoing, size, wait):
+    """like `do`, but ingest requests are sent to lax in batches of up to `size` articles, see `IngestBatch`.
+    a batch is sent once it's full or its first request has waited `wait` seconds.
+    any other request first sends the waiting batch, so requests about an article reach lax in the order they were received."""
+    # requests are read by a thread of their own so a batch can be sent while waiting on the next request.
+    # no more than a batch of requests is read ahead.
+    request_queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    threading.Thread(target=read_all, args=(incoming, request_queue, None, stop), daemon=True).start()
+    batch = IngestBatch(outgoing, size, wait)
+    reason = "the adaptor was stopped"
+    try:
+        while True:
+            try:
+                request = request_queue.get(timeout=batch.remaining())
+            except queue.Empty:
+                batch.flush()
+                continue
+            if request is _DONE:
+                break
+            if isinstance(request, BaseException):
+                raise request
+            LOG.info("received request %s", request)
+            request, params = prepare(request, outgoing)
+            if params is None:
+                continue
+            if not batch.accepts(params):
+                batch.flush()
+            if batch.accepts(params):
+                batch.add(request, params)
+                if batch.full():
+                    batch.flush()
+            else:
+                send_to_lax(request, params, outgoing)
+        batch.flush()
+
+    except KeyboardInterrupt:
+        LOG.warning("stopping abruptly due to KeyboardInterrupt")
+
+    except Exception as err:
+        reason = "an earlier request failed: %s" % err
+        raise
+
+    finally:
+        # requests read ahead of the one that stopped us are responded to
+        stop.set()
+        for request, _ in batch.pending:
+            not_handled(outgoing, request, reason)
+        drain(outgoing, request_queue, reason)
+
+    LOG.info("graceful shutdown")
+
+def do_concurrent(incoming, outgoing, processes):
+    """like `do`, but requests are handled by a pool of `processes` worker processes, many at once.
+
+    requests about the same article are handled one at a time, in the order they were received: a request isn't
+    started until the request before it about the same article has been handled and its responses sent. requests
+    about different articles are handled independently and their responses are sent as each is handled, so responses
+    about different articles may be sent in a different order to their requests. the responses to a request are sent
+    together, by this process.
+
+    when lax fails the requests already being handled are finished and their responses sent before the error is raised.
+    no more requests are read and those read but not yet handled are sent an error response instead."""
+    # requests read and finished requests, in the order they happen
+    events = queue.Queue()
+    # at most two requests per process have been read and not yet handled
+    slots = threading.Semaphore(processes * 2)
+    stop = threading.Event()
+    threading.Thread(target=read_all, args=(incoming, events, slots, stop), daemon=True).start()
+
+    waiting = {} # msid => requests waiting on the request being handled about that article
+    running = {} # future => msid
+    reading = True
+    error = None
+    reason = "the adaptor was stopped"
+
+    def submit(executor, msid, request):
+        future = executor.submit(handle, request)
+        running[future] = msid
+        future.add_done_callback(events.put)
+
+    def drop_waiting():
+        for msid_waiting in waiting.values():
+            while msid_waiting:
+                not_handled(outgoing, msid_waiting.popleft(), reason)
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            while reading or running:
+                event = events.get()
+
+                if isinstance(event, Future):
+                    msid = running.pop(event)
+                    responses, err = event.result()
+                    responses.send(outgoing)
+                    if err and not error:
+                        LOG.error("lax failed, no further requests will be handled: %s", err)
+                        error, reading = err, False
+                        reason = "an earlier request failed: %s" % err
+                        stop.set()
+                        drop_waiting()
+                    if waiting[msid]:
+                        submit(executor, msid, waiting[msid].popleft())
+                    else:
+                        del waiting[msid]
+                    # the next request isn't read until any error is known
+                    slots.release()
+
+                elif event is _DONE:
+                    reading = False
+
+                elif isinstance(event, BaseException):
+                    raise event
+
+                elif not reading:
+                    not_handled(outgoing, event, reason)
+
+                else:
+                    LOG.info("received request %s", event)
+                    # requests that can't be read can't be about the same article as any other request
+                    msid = request_msid(event) or object()
+                    if msid in waiting:
+                        waiting[msid].append(event)
+                    else:
+                        waiting[msid] = deque()
+                        submit(executor, msid, event)
+
+    except KeyboardInterrupt:
+        LOG.warning("stopping abruptly due to KeyboardInterrupt")
+
+    finally:
+        # requests read but not handled are responded to
+        stop.set()
+        drop_waiting()
+        drain(outgoing, events, reason)
+
+    if error:
+        # when lax fails, we fail
+        raise RuntimeError(error)
+
+    LOG.info("graceful shutdown")
+
 def _setup_interrupt_flag():
     flag = Flag()
 
@@ -370,6 +778,7 @@ def main(*flgs):
     parser.add_argument('--force', action='store_true', default=False)
     parser.add_argument('--action', choices=[INGEST, PUBLISH, INGEST_PUBLISH])
     parser.add_argument('--validate-only', action='store_true', default=False)
+    parser.add_argument('--processes', type=int, default=conf.ADAPTOR_PROCESSES, help="handle this many requests at once")
 
     args = parser.parse_args(flgs or sys.argv[1:])
 
@@ -384,7 +793,7 @@ def main(*flgs):
 
     fn = adaptors[adaptor_type]
 
-    do(*fn())
+    do(*fn(), processes=args.processes)
 
 if __name__ == '__main__':
     main()
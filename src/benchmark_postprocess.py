@@ -0,0 +1,88 @@
+"""Compares the time and memory taken to post-process article data using a single walk (`main.postprocess`)
+against the previous approach of walking the article data once per post-processing step.
+The single walk is measured both copying the article data and modifying it in place.
+
+Each article is rendered once, then post-processed `--iterations` times with each approach.
+IIIF lookups are disabled (`FORCED_IIIF`) so the remote IIIF server doesn't dominate the results,
+other enrichment (glencoe, cdn, rpp) is served from the requests cache after the first iteration.
+
+usage:
+
+    python src/benchmark_postprocess.py src/tests/fixtures/elife-09560-v1.xml [--iterations 10]"""
+
+import os
+os.environ.setdefault('FORCED_IIIF', '1')
+
+import argparse
+import copy
+import gc
+import time
+import tracemalloc
+from functools import partial
+from et3.render import doall
+import main as scraper
+from utils import version_from_path
+
+def postprocess_per_step(data, ctx):
+    "post-processes the given article data the way `main.postprocess` used to, walking the data once per step"
+    msid = data['snippet']['id']
+    return doall(data, [
+        scraper.fix_extensions,
+        scraper.expand_videos,
+        partial(scraper.expand_uris, msid),
+        partial(scraper.expand_image, msid),
+        partial(scraper.expand_placeholder, msid),
+        scraper.format_isbns,
+        scraper.prune,
+        scraper.placeholders_for_validation,
+        partial(scraper.non_nil_image_dimensions, ctx),
+        partial(scraper.manual_overrides, ctx),
+    ])
+
+def measure(fn, data, ctx, iterations):
+    "calls `fn` on a fresh copy of `data` `iterations` times. returns the average time, peak memory and number of garbage collections"
+    fn(copy.deepcopy(data), ctx) # warm any caches
+    elapsed = 0
+    peak = 0
+    collections = 0
+    for _ in range(iterations):
+        data_copy = copy.deepcopy(data)
+        gc.collect()
+        collections_before = sum(stat['collections'] for stat in gc.get_stats())
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn(data_copy, ctx)
+        elapsed += time.perf_counter() - start
+        peak += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        collections += sum(stat['collections'] for stat in gc.get_stats()) - collections_before
+    return elapsed / iterations, peak / iterations, collections / iterations
+
+def render(path):
+    "renders the article at `path` without post-processing it"
+    _, version = version_from_path(path)
+    ctx = {'version': version, 'location': path, 'override': {}, 'fill-missing-image-dimensions': False}
+    soup = scraper.to_soup(path)
+    plan = scraper.mkplan(scraper.parseJATS.is_poa(soup))
+    return plan.render(soup, ctx), ctx
+
+def main(paths, iterations):
+    row = "%-25s %-10s %10s %12s %12s"
+    print(row % ("article", "approach", "time (ms)", "peak (KiB)", "gc runs"))
+    for path in paths:
+        data, ctx = render(path)
+        approaches = [
+            ('per-step', postprocess_per_step),
+            ('fused', partial(scraper.postprocess, inplace=False)),
+            ('in-place', scraper.postprocess),
+        ]
+        for label, fn in approaches:
+            elapsed, peak, collections = measure(fn, data, ctx, iterations)
+            print(row % (os.path.basename(path), label, "%.2f" % (elapsed * 1000), "%.1f" % (peak / 1024), "%.1f" % collections))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+    main(args.paths, args.iterations)
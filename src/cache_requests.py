@@ -1,12 +1,396 @@
+"""requests_cache installation and a sqlite backend for it that many processes can share.
+
+`generate_article_json` and `validate_article_json` render articles in as many processes as there are cores,
+all sharing the one requests cache database. the default requests_cache sqlite backend opens a new connection
+for every operation in the default rollback journal mode, where a write blocks every reader.
+
+the `sqlite-wal` backend puts the database in WAL mode and keeps a connection per thread and process.
+readers never wait on a writer in WAL mode. writers still wait on each other, for at most `conf.REQUESTS_CACHE_BUSY_TIMEOUT`
+seconds, and the time spent waiting is recorded in `STATS`.
+
+in front of the database is an in-memory tier holding the parsed payloads of successful responses, keyed by URL,
+see `PAYLOADS`. a payload already parsed by this process costs a dict lookup and a single indexed query instead of
+a query, an unpickle and a json parse. the query checks the response the payload was parsed from is still the one in
+the database, so a response removed or replaced by another process, by `clear-article-cache.sh` for example, is
+never served from memory.
+
+responses from each service are fresh for that service's TTL, see `[enrichment] <service>_ttl` in `app.cfg`.
+a stale response is returned immediately and refreshed in the background, see `RevalidatingSession`.
+a TTL of 0 means responses from that service never go stale.
+
+responses cached while `tagged` are tagged with the service and msid of the article they were requested for.
+`purge` removes every response tagged with an msid in one transaction, for example all of an article's IIIF lookups:
+
+    ./clear-article-cache.sh <msid>"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import copy
+from datetime import datetime, timedelta
+import logging
+import os
+import sqlite3
+import threading
+import time
+import requests
+from requests.hooks import dispatch_hook
 import requests_cache
+from requests_cache.backends.base import BaseCache
+from requests_cache.backends.sqlite import DbCache
+from requests_cache.backends.storage.dbdict import DbDict, DbPickleDict
 import conf
 
-def install_cache_requests():
-    requests_cache.install_cache(**conf.REQUESTS_CACHE_CONFIG)
+LOG = logging.getLogger(__name__)
+
+# operations, lock waits and the time spent waiting on locks by this process
+STATS = {'reads': 0, 'writes': 0, 'lock-waits': 0, 'lock-wait-seconds': 0.0}
+_STATS_LOCK = threading.Lock()
+
+def record(**kwargs):
+    with _STATS_LOCK:
+        for key, val in kwargs.items():
+            STATS[key] += val
+
+def is_locked(err):
+    "returns `True` if the given sqlite error was raised because another connection holds a conflicting lock"
+    return isinstance(err, sqlite3.OperationalError) and 'locked' in str(err)
+
+def retry_locked(fn, *args):
+    """calls `fn` with the given `args`, retrying while the database is locked.
+    gives up after `conf.REQUESTS_CACHE_BUSY_TIMEOUT` seconds, raising the last error."""
+    started = None
+    delay = 0.001
+    try:
+        while True:
+            try:
+                return fn(*args)
+            except sqlite3.OperationalError as err:
+                if not is_locked(err):
+                    raise
+                now = time.perf_counter()
+                started = started or now
+                remaining = conf.REQUESTS_CACHE_BUSY_TIMEOUT - (now - started)
+                if remaining <= 0:
+                    raise
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+    finally:
+        if started:
+            record(**{'lock-waits': 1, 'lock-wait-seconds': time.perf_counter() - started})
+
+class WALMixin:
+    """a `DbDict` with a connection per thread and process to a database in WAL mode.
+    reads and writes that find the database locked are retried, see `retry_locked`."""
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def _connection(self):
+        local = self._local
+        # a forked process must not use its parent's connection
+        if getattr(local, 'pid', None) != os.getpid():
+            con = sqlite3.connect(self.filename, timeout=0)
+            retry_locked(con.execute, "PRAGMA journal_mode = WAL;")
+            con.execute("PRAGMA synchronous = %s;" % (0 if self.fast_save else 'NORMAL'))
+            local.con, local.pid = con, os.getpid()
+        return local.con
+
+    @contextmanager
+    def connection(self, commit_on_success=False):
+        con = self._connection()
+        try:
+            yield con
+            if commit_on_success and self.can_commit:
+                con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+
+    def commit(self, force=False):
+        if force or self.can_commit:
+            self._connection().commit()
+
+    def __getitem__(self, key):
+        record(reads=1)
+        return retry_locked(super().__getitem__, key)
+
+    def __setitem__(self, key, item):
+        record(writes=1)
+        retry_locked(super().__setitem__, key, item)
+
+    def __delitem__(self, key):
+        record(writes=1)
+        retry_locked(super().__delitem__, key)
+
+    def clear(self):
+        retry_locked(super().clear)
+
+class WALDict(WALMixin, DbDict):
+    pass
+
+class WALPickleDict(WALMixin, DbPickleDict):
+    pass
+
+_tags = threading.local()
+
+@contextmanager
+def tagged(service, msid):
+    "responses cached by this thread within this scope are tagged with the given `service` and article `msid`, see `purge`"
+    previous = getattr(_tags, 'tags', None)
+    _tags.tags = (service, int(msid)) if msid else None
+    try:
+        yield
+    finally:
+        _tags.tags = previous
+
+class WALCache(DbCache):
+    "requests_cache sqlite backend using `WALDict` storage, with responses tagged by service and msid"
+
+    def __init__(self, location='cache', fast_save=False, extension='.sqlite', **options):
+        BaseCache.__init__(self, **options)
+        self.responses = WALPickleDict(location + extension, 'responses', fast_save=fast_save)
+        self.keys_map = WALDict(location + extension, 'urls')
+        with self.responses.connection(True) as con:
+            retry_locked(con.execute, "create table if not exists tags (key PRIMARY KEY, url, service, msid)")
+            retry_locked(con.execute, "create index if not exists tags_msid on tags (msid, service)")
+            retry_locked(con.execute, "create index if not exists urls_value on urls (value)")
+
+    def save_response(self, key, response):
+        super().save_response(key, response)
+        tags = getattr(_tags, 'tags', None)
+        if tags:
+            with self.responses.connection(True) as con:
+                retry_locked(con.execute, "insert or replace into tags (key, url, service, msid) values (?, ?, ?, ?)",
+                             (key, response.url) + tags)
+
+    def purge(self, msid, service=None):
+        """removes every response tagged with the given `msid`, and `service` if given, in one transaction.
+        returns the URLs of the removed responses."""
+        query = "select key, url from tags where msid = ?"
+        params = (int(msid),)
+        if service:
+            query += " and service = ?"
+            params += (service,)
+        con = self.responses._connection()
+
+        def purge_transaction():
+            with con:
+                con.execute("BEGIN IMMEDIATE")
+                rows = con.execute(query, params).fetchall()
+                for key, _ in rows:
+                    con.execute("delete from responses where key = ?", (key,))
+                    con.execute("delete from urls where value = ?", (key,))
+                    con.execute("delete from tags where key = ?", (key,))
+                return [url for _, url in rows]
+        return retry_locked(purge_transaction)
+
+class LRU:
+    """a thread-safe map of at most `maxsize` items, discarding the least recently used item first.
+    values are copied going in and coming out, callers may safely modify them."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        "returns a copy of the value for `key` or `None` if not present"
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+            val = self.items[key]
+        return copy.deepcopy(val)
+
+    def put(self, key, val):
+        if not self.maxsize:
+            return
+        val = copy.deepcopy(val)
+        with self.lock:
+            self.items[key] = val
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+# service => URL prefix, registered by each service as it installs the cache
+SERVICE_URLS = OrderedDict()
+
+def ttl(url):
+    "returns the number of seconds a response for `url` is fresh for. 0 if it never goes stale."
+    for service, url_prefix in SERVICE_URLS.items():
+        if url.startswith(url_prefix):
+            return conf.REQUESTS_CACHE_TTLS.get(service, 0)
+    return 0
+
+def is_stale(url, age):
+    "returns `True` if a response for `url` that is `age` seconds old is stale"
+    max_age = ttl(url)
+    return bool(max_age) and age > max_age
+
+# URL => (time stored, version, parsed payload) of a successful response, for this process. see `stored_version`.
+PAYLOADS = LRU(conf.REQUESTS_CACHE_MEMORY_SIZE)
+
+def stored_version(url, method='GET'):
+    """returns the version of the response for `url` held by the installed sqlite requests cache, `None` if there isn't one.
+    the version is the response's rowid, which changes whenever the response is replaced."""
+    if conf.REQUESTS_CACHE_CONFIG['backend'] == 'sqlite-wal':
+        cache = wal_cache()
+    else:
+        cache = getattr(requests_cache.core.requests.Session(), 'cache', None)
+    responses = getattr(cache, 'responses', None)
+    if not isinstance(responses, DbDict):
+        return None
+    cache_key = cache.create_key(requests.Request(method, url).prepare())
+    with responses.connection() as con:
+        row = retry_locked(con.execute, "select rowid from `%s` where key = ?" % responses.table_name, (cache_key,)).fetchone()
+    return row[0] if row else None
+
+def cached_payload(url, method='GET'):
+    """returns a copy of the parsed payload for `url` if held in memory, not stale and parsed from the response
+    still in the requests cache, otherwise `None`"""
+    if conf.REQUESTS_CACHING:
+        entry = PAYLOADS.get(url)
+        if not entry:
+            return None
+        stored, version, payload = entry
+        if not is_stale(url, time.time() - stored) and stored_version(url, method) == version:
+            return payload
+        PAYLOADS.delete(url)
+
+def cache_payload(url, payload, method='GET'):
+    """holds the parsed `payload` of a successful response for `url` in memory.
+    payloads can only be held for responses in the requests cache."""
+    if conf.REQUESTS_CACHING:
+        version = stored_version(url, method)
+        if version is not None:
+            PAYLOADS.put(url, (time.time(), version, payload))
+
+def forget_payload(url):
+    PAYLOADS.delete(url)
+
+# cache keys being refreshed by this process
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_refresher = None
+
+def refresher():
+    "returns the pool refreshing stale responses for this process"
+    global _refresher
+    if _refresher is None or _refresher[0] != os.getpid():
+        _refresher = (os.getpid(), ThreadPoolExecutor(max_workers=conf.REQUESTS_CACHE_REFRESH_WORKERS, thread_name_prefix='revalidate'))
+    return _refresher[1]
+
+def refresh(cache, cache_key, request, kwargs):
+    """requests `request` again without the cache, replacing the cached response if successful.
+    the cached response is removed if no longer found and kept if the request fails."""
+    context = {'url': request.url, 'cache-key': cache_key}
+    try:
+        response = requests_cache.core.OriginalSession().send(request, **kwargs)
+        context['status-code'] = response.status_code
+        if response.status_code == 200:
+            cache.save_response(cache_key, response)
+            LOG.debug("refreshed stale response", extra=context)
+        elif response.status_code == 404:
+            cache.delete(cache_key)
+            LOG.info("stale response no longer found, removed", extra=context)
+        else:
+            LOG.warning("failed to refresh stale response, keeping it", extra=context)
+            return
+        forget_payload(request.url)
+    except Exception as err:
+        LOG.warning("failed to refresh stale response, keeping it: %s", err, extra=context)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(cache_key)
+
+def revalidate(cache, cache_key, request, kwargs):
+    "refreshes the cached response for `request` in the background, unless already being refreshed"
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+    refresher().submit(refresh, cache, cache_key, request.copy(), kwargs)
+
+class RevalidatingSession(requests_cache.CachedSession):
+    """a `CachedSession` that returns a stale response immediately, refreshing it in the background.
+    responses go stale after the TTL of the service they came from, see `ttl`."""
+
+    def send(self, request, **kwargs):
+        if self._is_cache_disabled or request.method not in self._cache_allowable_methods:
+            return super().send(request, **kwargs)
+        cache_key = self.cache.create_key(request)
+        try:
+            response, timestamp = self.cache.get_response_and_time(cache_key)
+        except (ImportError, TypeError):
+            response = None
+        if response is None:
+            return super().send(request, **kwargs)
+        if is_stale(request.url, (datetime.utcnow() - timestamp).total_seconds()):
+            revalidate(self.cache, cache_key, request, kwargs)
+        response.from_cache = True
+        return dispatch_hook('response', request.hooks, response, **kwargs)
+
+_wal_cache = None
+
+def wal_cache():
+    "returns the `WALCache` for this process, created from `conf.REQUESTS_CACHE_CONFIG`"
+    global _wal_cache
+    if _wal_cache is None:
+        config = conf.REQUESTS_CACHE_CONFIG
+        _wal_cache = WALCache(config['cache_name'], fast_save=config['fast_save'], extension=config['extension'])
+    return _wal_cache
+
+def purge(msid, service=None):
+    """removes every cached response for the article `msid`, from just the given `service` if given.
+    only responses cached by the `sqlite-wal` backend are tagged. returns the number of responses removed."""
+    if conf.REQUESTS_CACHE_CONFIG['backend'] != 'sqlite-wal':
+        return 0
+    url_list = wal_cache().purge(msid, service)
+    for url in url_list:
+        forget_payload(url)
+    LOG.info("purged %s cached responses for %s", len(url_list), msid, extra={'msid': msid, 'service': service})
+    return len(url_list)
+
+def install_cache_requests(service=None, url_prefix=None):
+    """installs the requests cache. requests to URLs starting with `url_prefix` are cached for the TTL of
+    the given `service`, see `ttl`."""
+    if service:
+        SERVICE_URLS[service] = url_prefix
+    config = dict(conf.REQUESTS_CACHE_CONFIG)
+    if config['backend'] == 'sqlite-wal':
+        config['backend'] = wal_cache()
+    requests_cache.install_cache(session_factory=RevalidatingSession, **config)
 
 def clear_expired():
-    "removes expired entries from requests_cache if installed. returns path to database regardless of installation"
-    if hasattr(requests_cache.core.requests.Session(), 'remove_expired_responses'):
-        requests_cache.core.remove_expired_responses()
+    """removes entries from requests_cache, if installed, that have been stale for longer than `conf.REQUESTS_CACHE_MAX_STALE`
+    seconds. returns path to database regardless of installation"""
+    session = requests_cache.core.requests.Session()
+    if hasattr(session, 'cache'):
+        now = datetime.utcnow()
+        for cache_key in list(session.cache.responses):
+            try:
+                response, timestamp = session.cache.responses[cache_key]
+            except KeyError:
+                continue
+            max_age = ttl(response.url)
+            if max_age and now - timestamp > timedelta(seconds=max_age + conf.REQUESTS_CACHE_MAX_STALE):
+                session.cache.delete(cache_key)
     # path to database is used by 'clear-expired-requests-cache.sh' to then VACUUM db
     return conf.REQUESTS_CACHE_DB
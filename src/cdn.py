@@ -3,29 +3,38 @@ import logging
 import requests
 import requests_cache
 
-from cache_requests import install_cache_requests
-import conf
+from cache_requests import install_cache_requests, cached_payload, cache_payload, forget_payload, tagged
+import conf, utils, negative_cache
 
 LOG = logging.getLogger(__name__)
 
 if conf.REQUESTS_CACHING:
-    install_cache_requests()
+    install_cache_requests('cdn', conf.CDN.partition('%')[0])
 
 def clear_cache(url):
+    forget_payload(url)
+    negative_cache.forget(url)
     conf.REQUESTS_CACHING and requests_cache.core.get_cache().delete_url(url)
 
 def url_exists(url, msid=None):
+    if cached_payload(url, 'HEAD'):
+        return url
+    if negative_cache.is_not_found('cdn', url):
+        return None
+
     context = {'msid': msid, 'url': url}
 
     try:
-        resp = requests.head(url)
-    except requests.ConnectionError:
+        with tagged('cdn', msid):
+            resp = utils.requests_session().head(url, timeout=conf.ENRICHMENT_TIMEOUTS['cdn'])
+    except (requests.ConnectionError, requests.Timeout):
         LOG.debug("CDN request failed", extra=context)
         return None
 
     context['status-code'] = resp.status_code
 
     if resp.status_code == 200:
+        cache_payload(url, url, 'HEAD')
         return url
 
     # non-200 response
@@ -36,6 +45,7 @@ def url_exists(url, msid=None):
 
     if resp.status_code == 404:
         LOG.debug("CDN url not found", extra=context)
+        negative_cache.not_found('cdn', msid, url)
     else:
         msg = "unhandled status code from CDN"
         LOG.warning(msg, extra=context)
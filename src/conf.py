@@ -70,6 +70,31 @@ IIIF_LOG_PATH = join(LOG_DIR, 'iiif.log')
 #
 
 PATH_TO_LAX = cfg('lax.location')
+# send requests to a single long-lived lax process rather than a new one per request, see `lax_worker.py`
+LAX_WORKER = cfg('lax.worker', False)
+# seconds to wait for the lax worker to respond to a request
+LAX_WORKER_TIMEOUT = float(cfg('lax.worker_timeout', 0)) or None
+# ingest requests are sent to lax in batches of up to this many articles, see `adaptor.do_batched`. 1 to not batch.
+LAX_BATCH_SIZE = int(cfg('lax.batch_size', 1))
+# seconds the first request in a batch waits for others to join it
+LAX_BATCH_WAIT = int(cfg('lax.batch_wait_ms', 500)) / 1000
+
+# requests are handled by this many worker processes at once, see `adaptor.do_concurrent`. 1 to not.
+ADAPTOR_PROCESSES = int(cfg('adaptor.processes', 1))
+
+# requests are handled in stages, each working on many requests at once, see `pipeline.py`
+PIPELINE = cfg('pipeline.enabled', False)
+# threads downloading article-xml, processes rendering it, threads serialising article-json and threads calling lax
+PIPELINE_WORKERS = {
+    'download': int(cfg('pipeline.download_threads', 4)),
+    'render': int(cfg('pipeline.render_processes', 2)),
+    'serialise': int(cfg('pipeline.serialise_threads', 1)),
+    'lax': int(cfg('pipeline.lax_threads', 1)),
+}
+# requests waiting in front of each stage before the stages before it wait too
+PIPELINE_QUEUE_SIZE = int(cfg('pipeline.queue_size', 4))
+# seconds between logging each stage's queue depth and activity
+PIPELINE_METRICS_INTERVAL = int(cfg('pipeline.metrics_interval', 60))
 
 DEFAULT_CACHE_PATH = join(PROJECT_DIR, 'cache')
 CACHE_PATH = cfg('general.cache_path', DEFAULT_CACHE_PATH)
@@ -120,14 +145,62 @@ REQUESTS_CACHE_DB = REQUESTS_CACHE + '.sqlite3'
 # https://requests-cache.readthedocs.io/en/latest/api.html#backends-dbdict
 ASYNC_CACHE_WRITES = False
 
+# 'not found' responses from remote services are remembered for a short while, see `negative_cache.py`
+NEGATIVE_CACHE_DB = join(CACHE_PATH, 'negative_cache.sqlite3')
+# seconds a 'not found' response from each service is remembered for, 0 to disable
+NEGATIVE_CACHE_TTLS = {service: int(cfg('enrichment.%s_not_found_ttl' % service, 0)) for service in ['glencoe', 'iiif', 'cdn', 'rpp']}
+
+# widths and heights of images in IIIF, see `iiif_dimensions.py`
+IIIF_DIMENSIONS_DB = join(CACHE_PATH, 'iiif_dimensions.sqlite3')
+# directory of an article's images, read for their dimensions before IIIF is asked. see `iiif.local_dimensions`
+IIIF_IMAGE_ROOT = cfg('enrichment.image_root', None) or None
+
+# seconds a cached response from each service is fresh for, 0 for forever.
+# a stale response is used while it's refreshed in the background, see `cache_requests.py`
+REQUESTS_CACHE_TTLS = {service: int(cfg('enrichment.%s_ttl' % service, 0)) for service in ['glencoe', 'iiif', 'cdn', 'rpp']}
+# seconds a response may be stale for before it's removed by `clear-expired-requests-cache.sh`
+REQUESTS_CACHE_MAX_STALE = int(cfg('enrichment.max_stale', 2592000))
+# number of stale responses refreshed at once by each process
+REQUESTS_CACHE_REFRESH_WORKERS = 2
+
+# number of parsed responses held in memory in front of the requests cache, see `cache_requests.py`
+REQUESTS_CACHE_MEMORY_SIZE = 2048
+
+# seconds a write to the requests cache waits for another process's write to finish, see `cache_requests.py`
+REQUESTS_CACHE_BUSY_TIMEOUT = 30
+
 REQUESTS_CACHE_CONFIG = {
     'allowable_methods': ('GET', 'HEAD'),
     'cache_name': REQUESTS_CACHE,
-    'backend': 'sqlite',
+    'backend': 'sqlite-wal', # see `cache_requests.py`
     'fast_save': ASYNC_CACHE_WRITES,
     'extension': '.sqlite3'
 }
 
+# maximum number of concurrent lookups to remote services when enriching an article, see `enrichment.py`
+ENRICHMENT_MAX_WORKERS = int(cfg('enrichment.max_workers', 10))
+# maximum number of concurrent lookups to any one host, IIIF for example
+ENRICHMENT_MAX_PER_HOST = int(cfg('enrichment.max_per_host', 5))
+# seconds to wait for a response from each remote service, no timeout if not set
+ENRICHMENT_TIMEOUTS = {service: float(cfg('enrichment.%s_timeout' % service, 0)) or None for service in ['glencoe', 'iiif', 'cdn', 'rpp']}
+# seconds all of an article's lookups to remote services must be made within, no deadline if not set.
+# overridden by the 'enrichment-deadline' render context value.
+ENRICHMENT_DEADLINE = float(cfg('enrichment.deadline', 0)) or None
+# consecutive failed requests to a host before requests to it fail fast, and the seconds they fail fast for.
+# see `utils.CircuitBreaker`, which can't import this module.
+CIRCUIT_FAILURE_THRESHOLD = int(cfg('enrichment.circuit_failure_threshold', 5))
+CIRCUIT_RESET_TIMEOUT = int(cfg('enrichment.circuit_reset_timeout', 30))
+utils.CIRCUIT_FAILURE_THRESHOLD = CIRCUIT_FAILURE_THRESHOLD
+utils.CIRCUIT_RESET_TIMEOUT = CIRCUIT_RESET_TIMEOUT
+# lookups are resolved only from an imported snapshot and no requests are made, see `snapshot.py`
+ENRICHMENT_OFFLINE = cfg('enrichment.offline', False)
+ENRICHMENT_SNAPSHOT_DB = join(CACHE_PATH, 'enrichment_snapshot.sqlite3')
+
+# on-disk cache of rendered article-json, see `render_cache.py`
+RENDER_CACHE = cfg('render_cache.enabled', False)
+RENDER_CACHE_PATH = join(CACHE_PATH, 'render_cache')
+RENDER_CACHE_MAX_SIZE = int(cfg('render_cache.max_size_mb', 2048)) * 1024 * 1024 # bytes
+
 XML_REV = open(join(PROJECT_DIR, 'elife-article-xml.sha1'), 'r').read().strip()
 
 JOURNAL_INCEPTION = 2012 # used to calculate volumes
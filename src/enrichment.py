@@ -0,0 +1,285 @@
+"""enrichment of article data with data from remote services: glencoe, iiif, the cdn and reviewed-preprints.
+
+lookups are made with `lookup`. by default a lookup calls the remote service immediately.
+
+within a `deferred` scope, lookups are instead recorded in the session's manifest and a `Pending` placeholder
+is returned in their place. `Session.resolve` then makes every recorded lookup concurrently and replaces the
+placeholders in the article data with the results. an article with many figures makes its IIIF requests in
+one concurrent round instead of one after the other.
+
+lookups are made by a pool of at most `[enrichment] max_workers` threads, with at most `[enrichment] max_per_host`
+lookups to any one host at a time so a figure-heavy article doesn't swamp the IIIF server. a `max_workers` of 1
+makes every lookup serially, in the order they were deferred.
+
+see `call_all`. the service modules are synchronous and are called from the pool's threads. each service has its
+own timeout, see `[enrichment]` in `app.cfg`.
+
+a session may be given a deadline, `[enrichment] deadline` seconds after an article starts rendering. every lookup
+within the session, immediate or deferred, must be made before it. a lookup that can't be is either given the
+service's fallback value, see `Session`, or fails the article with `utils.DeadlineExceeded`.
+
+with `[enrichment] offline` set, lookups are resolved from an imported snapshot instead, see `snapshot.py`.
+
+results are kept for the lifetime of the session, a lookup already resolved within a session isn't made again."""
+
+from collections import OrderedDict
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+import conf, utils, glencoe, iiif, cdn, rpp, snapshot
+
+LOG = logging.getLogger(__name__)
+
+# service => (module, function name). the function is resolved when called.
+SERVICES = OrderedDict([
+    ('glencoe', (glencoe, 'metadata')),   # msid
+    ('iiif', (iiif, 'basic_info')),       # msid, filename
+    ('cdn', (cdn, 'url_exists')),         # url, msid
+    ('rpp', (rpp, 'snippet')),            # msid
+])
+
+# service => function returning the URL requested by a lookup, given the same arguments
+URLS = {
+    'glencoe': glencoe.glencoe_url,
+    'iiif': iiif.iiif_info_url,
+    'cdn': lambda url, msid: url,
+    'rpp': rpp.rpp_url,
+}
+
+class Pending:
+    """placeholder for the result of a deferred lookup.
+    `then` is applied to the result of the lookup when it's patched into the article data."""
+    __slots__ = ('key', 'then')
+
+    def __init__(self, key, then=None):
+        self.key = key
+        self.then = then
+
+    def __repr__(self):
+        return "Pending(%r)" % (self.key,)
+
+def call(key):
+    "makes the lookup described by the given `key`, a tuple of `(service, *args)`"
+    if conf.ENRICHMENT_OFFLINE:
+        return snapshot.lookup(key)
+    service, args = key[0], key[1:]
+    module, funcname = SERVICES[service]
+    return getattr(module, funcname)(*args)
+
+def host(key):
+    "returns the host the lookup described by the given `key` makes its request to"
+    service, args = key[0], key[1:]
+    return urlparse(URLS[service](*args)).netloc
+
+def interleave(key_list):
+    "returns the given lookups ordered so that consecutive lookups are to different hosts where possible"
+    by_host = OrderedDict()
+    for key in key_list:
+        by_host.setdefault(host(key), []).append(key)
+    rows = list(by_host.values())
+    return [row[i] for i in range(max(map(len, rows), default=0)) for row in rows if i < len(row)]
+
+def call_all(key_list, max_workers, max_per_host, fn=call):
+    """makes the lookups described by the given `key_list` using a pool of `max_workers` threads,
+    making no more than `max_per_host` lookups to the same host at once. each lookup is made with `fn`.
+    returns a list of results in the same order as `key_list`. a lookup that failed has the exception raised as its result."""
+    if not key_list:
+        return []
+    limits = {}
+    for key in key_list:
+        limits.setdefault(host(key), threading.BoundedSemaphore(max_per_host))
+
+    def limited(key):
+        with limits[host(key)]:
+            return fn(key)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(key_list))) as executor:
+        # lookups are started in an order that keeps a pool thread waiting on a busy host from holding up other hosts
+        futures = {key: executor.submit(limited, key) for key in interleave(list(OrderedDict.fromkeys(key_list)))}
+    results = []
+    for key in key_list:
+        try:
+            results.append(futures[key].result())
+        except Exception as err:
+            results.append(err)
+    return results
+
+def patch(data, resolved):
+    """replaces every `Pending` placeholder in `data` with its result from the `resolved` map, modifying `data` in place.
+    placeholders whose result is `None` are removed, like the `discard_if_none_or_empty` and `filter(None, ...)`
+    that would otherwise have followed a direct lookup."""
+    if isinstance(data, dict):
+        for key, val in list(data.items()):
+            val = patch(val, resolved)
+            if val is None and isinstance(data[key], Pending):
+                del data[key]
+            else:
+                data[key] = val
+    elif isinstance(data, list):
+        patched = [(row, patch(row, resolved)) for row in data]
+        data[:] = [val for row, val in patched if not (val is None and isinstance(row, Pending))]
+    elif isinstance(data, Pending):
+        return finish(resolved[data.key], data.then)
+    return data
+
+def finish(val, then=None):
+    "applies `then` to the result `val` of a lookup. results may be shared within a session so a copy is returned otherwise."
+    return then(val) if then else copy.deepcopy(val)
+
+class Session:
+    """the lookups made while rendering an article.
+    `resolved` maps a lookup key to its result, `manifest` holds the deferred lookups yet to be resolved.
+    `deadline` is the `time.monotonic` time every lookup must be made by, `None` for no deadline.
+    `fallbacks` maps a service to the result given to its lookups once the deadline has passed."""
+
+    def __init__(self, deadline=None, fallbacks=None):
+        self.resolved = OrderedDict()
+        self.manifest = OrderedDict()
+        self.deferring = frozenset()
+        self.deadline = deadline
+        self.fallbacks = fallbacks or {}
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def call(self, key):
+        """makes the lookup described by the given `key` within the session's deadline.
+        once the deadline has passed the service's fallback is returned, if it has one, otherwise `DeadlineExceeded` is raised."""
+        try:
+            if not self.expired():
+                with utils.deadline(self.deadline):
+                    val = call(key)
+                # services treat some timed out requests like failed connections, see `iiif.iiif_info`
+                if not self.expired():
+                    return val
+        except Exception as err:
+            if not self.expired():
+                raise
+            cause = err
+        else:
+            cause = None
+        service = key[0]
+        context = {'lookup': key, 'deadline-passed-by': round(time.monotonic() - self.deadline, 3)}
+        if service in self.fallbacks:
+            LOG.warning("enrichment deadline exceeded, using fallback for %s lookup", service, extra=context)
+            return self.fallbacks[service]
+        raise utils.DeadlineExceeded("enrichment deadline exceeded looking up %r" % (key,)) from cause
+
+    def lookup(self, key, then=None):
+        if key in self.resolved:
+            val = self.resolved[key]
+        elif key[0] in self.deferring:
+            self.manifest[key] = None
+            return Pending(key, then)
+        else:
+            val = self.resolved[key] = self.call(key)
+        return finish(val, then)
+
+    def pop_manifest(self, max_workers, max_per_host):
+        "returns and clears the deferred lookups yet to be resolved"
+        key_list = list(self.manifest.keys())
+        self.manifest.clear()
+        if key_list:
+            context = {'lookups': len(key_list), 'max-workers': max_workers, 'max-per-host': max_per_host}
+            LOG.info("resolving %s deferred lookups", len(key_list), extra=context)
+        return key_list
+
+    def resolve(self, data, max_workers=None, max_per_host=None):
+        """makes all deferred lookups concurrently and patches their results into the given `data`.
+        any exception raised by a lookup is re-raised, the first in the order the lookups were deferred."""
+        max_workers = max_workers or conf.ENRICHMENT_MAX_WORKERS
+        max_per_host = max_per_host or conf.ENRICHMENT_MAX_PER_HOST
+        key_list = self.pop_manifest(max_workers, max_per_host)
+        if not key_list:
+            return data
+        if max_workers == 1:
+            results = []
+            for key in key_list:
+                results.append(self.call(key))
+        else:
+            results = call_all(key_list, max_workers, max_per_host, self.call)
+        for key, result in zip(key_list, results):
+            if isinstance(result, BaseException):
+                raise result
+            self.resolved[key] = result
+        return patch(data, self.resolved)
+
+class Recorder(Session):
+    """a session that records every lookup made within it without making it, see `recording`.
+    lookups to the given `services` are still made. the rest are given a `Pending` placeholder that is never resolved."""
+
+    def __init__(self, services=(), **kwargs):
+        super().__init__(**kwargs)
+        self.making = frozenset(services)
+        self.recorded = OrderedDict()
+
+    def lookup(self, key, then=None):
+        self.recorded[key] = None
+        if key[0] not in self.making:
+            return Pending(key, then)
+        if key not in self.resolved:
+            self.resolved[key] = self.call(key)
+        return finish(self.resolved[key], then)
+
+    def resolve(self, data, max_workers=None, max_per_host=None):
+        return data
+
+_state = threading.local()
+
+def current_session():
+    return getattr(_state, 'session', None)
+
+@contextmanager
+def scope(sess):
+    "lookups within this scope are made by the given session"
+    previous = current_session()
+    _state.session = sess
+    try:
+        yield sess
+    finally:
+        _state.session = previous
+
+@contextmanager
+def session(**kwargs):
+    """lookups within this scope share a `Session`, lookups already resolved within it are not made again.
+    `kwargs` are passed to the `Session`, see `Session` for a deadline."""
+    with scope(Session(**kwargs)) as sess:
+        yield sess
+
+@contextmanager
+def recording(services=()):
+    """lookups within this scope are recorded by a `Recorder` instead of being made, except those to the given `services`.
+    deferred lookups are left unresolved."""
+    with scope(Recorder(services)) as sess:
+        yield sess
+
+@contextmanager
+def deferred(services=None):
+    """within this scope lookups to the given `services` (default all) are recorded and a `Pending` placeholder returned.
+    yields the current session, creating one for just this scope if necessary. see `Session.resolve`."""
+    if current_session() is None:
+        with session():
+            with deferred(services) as sess:
+                yield sess
+        return
+    sess = current_session()
+    previous = sess.deferring
+    sess.deferring = previous | frozenset(services or SERVICES.keys())
+    try:
+        yield sess
+    finally:
+        sess.deferring = previous
+
+def lookup(service, *args, then=None):
+    """looks up data for the given `args` from the given `service`, see `SERVICES`.
+    `then` is applied to the result, if given. returns a `Pending` placeholder if the lookup has been deferred."""
+    key = (service,) + args
+    sess = current_session()
+    if sess is None:
+        val = call(key)
+        return then(val) if then else val
+    return sess.lookup(key, then)
@@ -5,23 +5,31 @@ writing the results to the `./article-json/` directory.
 The number of article-xml files to process can be capped with `--num n`."""
 
 import argparse
+from functools import partial
 import json
 import os
 from os.path import join
 from io import StringIO
+import time
 from joblib import Parallel, delayed
-import conf, main as scraper
+import cache_requests, conf, main as scraper, render_cache
 from utils import ensure, lfilter, lmap
 import logging
 
 LOG = logging.getLogger(__name__)
 
 def render(path, json_output_dir):
+    "renders the article-json for the article at `path`. returns the seconds spent waiting on requests cache locks"
+    lock_wait = cache_requests.STATS['lock-wait-seconds']
     try:
         strbuffer = StringIO()
         fname = os.path.basename(path)
         strbuffer.write("%s -> %s => " % (fname, fname + '.json'))
-        json_result = scraper.main(path)
+        with open(path, 'rb') as fh:
+            xml = fh.read()
+        # `main` derives everything else it renders with from the path
+        ctx = {'location': scraper.expand_location(path), 'fname': fname}
+        json_result = render_cache.cached(xml, ctx, partial(scraper.main, path))
 
         # "backfill-run-1234567890/ajson/elife-09560-v1.xml.ajson"
         outfname = join(json_output_dir, fname + '.json')
@@ -33,6 +41,7 @@ def render(path, json_output_dir):
     finally:
         log = conf.multiprocess_log('generation.log', __name__)
         log.info(strbuffer.getvalue())
+    return cache_requests.STATS['lock-wait-seconds'] - lock_wait
 
 def pformat(d):
     return json.dumps(d, indent=4, default=str)
@@ -44,7 +53,9 @@ def main(xml_dir, json_output_dir, num=None):
     if num is not None and num > -1:
         paths = paths[:num] # only scrape first n articles
     num_processes = -1
-    Parallel(n_jobs=num_processes)(delayed(render)(path, json_output_dir) for path in paths)
+    start = time.time()
+    lock_waits = Parallel(n_jobs=num_processes)(delayed(render)(path, json_output_dir) for path in paths)
+    print('%s articles in %.1fs, %.3fs waiting on requests cache locks' % (len(paths), time.time() - start, sum(lock_waits)))
     print('see scrape.log for errors')
 
 if __name__ == '__main__':
@@ -1,14 +1,16 @@
 import logging
 import requests_cache
-from cache_requests import install_cache_requests
-import conf, utils
+from cache_requests import install_cache_requests, cached_payload, cache_payload, forget_payload, tagged
+import conf, utils, negative_cache
 from utils import ensure, lmap, lfilter, sortdict
 from collections import OrderedDict
 
 LOG = logging.getLogger(__name__)
 
+GLENCOE_URL = "https://movie-usa.glencoesoftware.com/metadata/"
+
 if conf.REQUESTS_CACHING:
-    install_cache_requests()
+    install_cache_requests('glencoe', GLENCOE_URL)
 
 '''
 glencoe_resp = {
@@ -43,7 +45,7 @@ SOURCES = OrderedDict([
 
 def glencoe_url(msid):
     doi = "10.7554/eLife." + utils.pad_msid(msid)
-    url = "https://movie-usa.glencoesoftware.com/metadata/" + doi
+    url = GLENCOE_URL + doi
     return url
 
 def validate_gc_data(gc_data):
@@ -62,18 +64,27 @@ def validate_gc_data(gc_data):
         ensure(len(available_sources) == len(known_sources), msg)
 
 def clear_cache(msid):
+    forget_payload(glencoe_url(msid))
+    negative_cache.forget(glencoe_url(msid))
     requests_cache.core.get_cache().delete_url(glencoe_url(msid))
 
 def metadata(msid):
     # 2018-10-19: it's now possible for glencoe to be queried about an article before media
     # has been deposited by elife-bot. only successful responses will be cached
     url = glencoe_url(msid)
+    caching = conf.REQUESTS_CACHING and conf.GLENCOE_REQUESTS_CACHING
+
+    gc_data = caching and cached_payload(url)
+    if gc_data:
+        return gc_data
+    if caching and negative_cache.is_not_found('glencoe', url):
+        return {}
 
-    if conf.REQUESTS_CACHING and conf.GLENCOE_REQUESTS_CACHING:
-        resp = utils.requests_get(url)
+    if caching:
+        with tagged('glencoe', msid):
+            resp = utils.requests_get(url, timeout=conf.ENRICHMENT_TIMEOUTS['glencoe'])
     else:
-        with requests_cache.disabled():
-            resp = utils.requests_get(url)
+        resp = utils.requests_get(url, timeout=conf.ENRICHMENT_TIMEOUTS['glencoe'], cached=False)
 
     context = {'msid': msid, 'glencoe-url': url, 'status-code': resp.status_code}
 
@@ -82,6 +93,8 @@ def metadata(msid):
 
         if resp.status_code == 404:
             LOG.debug("article has no videos", extra=context)
+            if caching:
+                negative_cache.not_found('glencoe', msid, url)
             return {}
 
         msg = "unhandled status code from Glencoe"
@@ -92,14 +105,18 @@ def metadata(msid):
     try:
         gc_data = sortdict(resp.json())
         validate_gc_data(gc_data)
+        if caching:
+            cache_payload(url, gc_data)
         return gc_data
     except AssertionError:
         # clear cache, we don't want bad data hanging around
         clear_cache(msid)
         raise
 
-def expand_videos(msid, video):
-    gc_data = metadata(msid) # cached on first hit
+def expand_videos(msid, video, gc_data=None):
+    "expands the given `video` using the glencoe `gc_data` for the given `msid`, looking it up if not given"
+    if gc_data is None:
+        gc_data = metadata(msid) # cached on first hit
     gc_id_str = ", ".join(gc_data.keys())
 
     v_id = video['id']
@@ -108,7 +125,7 @@ def expand_videos(msid, video):
 
     video_data = gc_data[v_id]
     video_data = utils.subdict(video_data, ['jpg_href', 'width', 'height'])
-    video_data = utils.renkeys(video_data, [('jpg_href', 'image')])
+    video_data = utils.renkeys(video_data, [('jpg_href', 'image')], inplace=True)
 
     func = lambda mtype: OrderedDict([
         ('mediaType', SOURCES[mtype]),
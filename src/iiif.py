@@ -1,13 +1,14 @@
 import os
+from os.path import join
 import requests
 import requests_cache
 from cache_requests import install_cache_requests
-import conf, utils
+import conf, utils, negative_cache, iiif_dimensions, image_headers
 
 LOG = conf.multiprocess_log(conf.IIIF_LOG_PATH, __name__)
 
 if conf.REQUESTS_CACHING:
-    install_cache_requests()
+    install_cache_requests('iiif', conf.IIIF.partition('%')[0])
 
 '''
 iiif_resp = {
@@ -38,20 +39,46 @@ def iiif_info_url(msid, filename):
 def basic_info(msid, filename):
     if 'FORCED_IIIF' in os.environ and int(os.environ['FORCED_IIIF']):
         return 1, 1
+    # dimensions already known are never asked for again, see `iiif_dimensions.py`.
+    # images found locally are read rather than asking IIIF.
+    dimensions = iiif_dimensions.get(msid, filename) or local_dimensions(msid, filename)
+    if dimensions:
+        return dimensions
     info_data = iiif_info(msid, filename)
-    return info_data.get("width"), info_data.get("height")
+    width, height = info_data.get("width"), info_data.get("height")
+    if width and height:
+        iiif_dimensions.put(msid, filename, width, height)
+    return width, height
+
+def local_dimensions(msid, filename):
+    """returns the `(width, height)` of the image `filename` for the article `msid` read from the image itself,
+    if it can be found in `conf.IIIF_IMAGE_ROOT`. returns `None` otherwise."""
+    if not conf.IIIF_IMAGE_ROOT:
+        return None
+    for path in [join(conf.IIIF_IMAGE_ROOT, utils.pad_msid(msid), filename), join(conf.IIIF_IMAGE_ROOT, filename)]:
+        if not os.path.isfile(path):
+            continue
+        dimensions = image_headers.dimensions(path)
+        if dimensions and all(dimensions):
+            return tuple(dimensions)
+        LOG.warning("failed to read image dimensions", extra={'msid': msid, 'iiif_filename': filename, 'path': path})
+    return None
 
 def iiif_info(msid, filename):
+    url = iiif_info_url(msid, filename)
+    if negative_cache.is_not_found('iiif', url):
+        return {}
+
     context = {
         'msid': msid,
         'iiif_filename': filename,
-        'iiif_info_url': iiif_info_url(msid, filename)
+        'iiif_info_url': url
     }
     try:
-        url = iiif_info_url(msid, filename)
         LOG.info("Loading IIIF info URL: %s", url)
-        resp = utils.requests_get(url)
-    except requests.ConnectionError:
+        # just the image's dimensions are kept, not the whole response
+        resp = utils.requests_get(url, timeout=conf.ENRICHMENT_TIMEOUTS['iiif'], cached=False)
+    except (requests.ConnectionError, requests.Timeout):
         LOG.debug("IIIF request failed", extra=context)
         return {}
 
@@ -59,6 +86,7 @@ def iiif_info(msid, filename):
 
     if resp.status_code == 404:
         LOG.debug("IIIF image not found", extra=context)
+        negative_cache.not_found('iiif', msid, url)
         return {}
 
     elif resp.status_code != 200:
@@ -67,12 +95,13 @@ def iiif_info(msid, filename):
         raise ValueError(msg + ": %s" % resp.status_code)
 
     try:
-        info_data = utils.sortdict(resp.json())
-        return info_data
+        return utils.sortdict(resp.json())
     except BaseException:
         # clear cache, we don't want bad data hanging around
         clear_cache(msid, filename)
         raise
 
 def clear_cache(msid, filename):
+    iiif_dimensions.forget(msid, filename)
+    negative_cache.forget(iiif_info_url(msid, filename))
     requests_cache.core.get_cache().delete_url(iiif_info_url(msid, filename))
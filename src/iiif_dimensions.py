@@ -0,0 +1,62 @@
+"""a compact store of the width and height of images in IIIF.
+
+`iiif.basic_info` only needs an image's width and height but IIIF responds with a full info.json. rather than cache
+every response, the width and height are kept in their own small database keyed by the padded msid and filename and
+are checked before IIIF is asked. responses from IIIF are no longer kept in the requests cache.
+
+an image's dimensions are assumed never to change. to forget what's known about an article's images:
+
+    python src/iiif_dimensions.py <msid>"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import conf, utils
+from cache_requests import retry_locked
+
+# hits, misses and stores by this process
+STATS = {'hits': 0, 'misses': 0, 'stores': 0}
+
+_local = threading.local()
+
+def connection():
+    "returns a connection to the dimensions database for the current thread and process, creating the database if necessary"
+    if getattr(_local, 'key', None) != (os.getpid(), conf.IIIF_DIMENSIONS_DB):
+        con = sqlite3.connect(conf.IIIF_DIMENSIONS_DB, timeout=0, isolation_level=None)
+        retry_locked(con.execute, "PRAGMA journal_mode = WAL;")
+        retry_locked(con.execute, "create table if not exists dimensions (msid, filename, width, height, fetched, PRIMARY KEY (msid, filename))")
+        _local.con, _local.key = con, (os.getpid(), conf.IIIF_DIMENSIONS_DB)
+    return _local.con
+
+def get(msid, filename):
+    "returns the `(width, height)` of the image `filename` for the article `msid`, `None` if not known"
+    if not conf.REQUESTS_CACHING:
+        return None
+    row = retry_locked(connection().execute, "select width, height from dimensions where msid = ? and filename = ?",
+                       (utils.pad_msid(msid), filename)).fetchone()
+    STATS['hits' if row else 'misses'] += 1
+    return tuple(row) if row else None
+
+def put(msid, filename, width, height):
+    "stores the `width` and `height` of the image `filename` for the article `msid`"
+    if not conf.REQUESTS_CACHING:
+        return
+    retry_locked(connection().execute, "insert or replace into dimensions (msid, filename, width, height, fetched) values (?, ?, ?, ?, ?)",
+                 (utils.pad_msid(msid), filename, int(width), int(height), int(time.time())))
+    STATS['stores'] += 1
+
+def forget(msid, filename=None):
+    "forgets the dimensions of the image `filename`, or every image if not given, for the article `msid`. returns the number of images forgotten."
+    if not os.path.exists(conf.IIIF_DIMENSIONS_DB):
+        return 0
+    if filename:
+        return retry_locked(connection().execute, "delete from dimensions where msid = ? and filename = ?", (utils.pad_msid(msid), filename)).rowcount
+    return retry_locked(connection().execute, "delete from dimensions where msid = ?", (utils.pad_msid(msid),)).rowcount
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="forgets the dimensions of an article's images")
+    parser.add_argument('msid', type=int)
+    args = parser.parse_args()
+    print("removed %s images" % forget(args.msid))
@@ -0,0 +1,95 @@
+"""reads the width and height of PNG, JPEG, TIFF and GIF images from their headers, without decoding any pixels.
+
+    python src/image_headers.py /path/to/elife-09560-fig1.tif"""
+
+import argparse
+import struct
+
+# JPEG 'start of frame' markers, the frame header has the image's dimensions
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# JPEG markers that aren't followed by a segment length
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}
+
+TIFF_WIDTH, TIFF_HEIGHT = 256, 257
+TIFF_SHORT, TIFF_LONG = 3, 4
+
+def png_dimensions(fh):
+    fh.seek(16)
+    return struct.unpack('>II', fh.read(8))
+
+def gif_dimensions(fh):
+    fh.seek(6)
+    return struct.unpack('<HH', fh.read(4))
+
+def jpeg_dimensions(fh):
+    fh.seek(2)
+    while True:
+        byte = fh.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = fh.read(1)
+        while marker == b'\xff': # padding
+            marker = fh.read(1)
+        if not marker:
+            return None
+        marker = ord(marker)
+        if marker in JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        length = struct.unpack('>H', fh.read(2))[0]
+        if marker in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', fh.read(5))
+            return width, height
+        fh.seek(length - 2, 1)
+
+def tiff_dimensions(fh):
+    "dimensions of the first image in a TIFF. BigTIFF isn't supported."
+    fh.seek(0)
+    order = '<' if fh.read(2) == b'II' else '>'
+    magic, offset = struct.unpack(order + 'HI', fh.read(6))
+    if magic != 42:
+        return None
+    fh.seek(offset)
+    num_entries = struct.unpack(order + 'H', fh.read(2))[0]
+    found = {}
+    for _ in range(num_entries):
+        tag, field_type, _, value = struct.unpack(order + 'HHI4s', fh.read(12))
+        if tag in (TIFF_WIDTH, TIFF_HEIGHT):
+            if field_type == TIFF_SHORT:
+                found[tag] = struct.unpack(order + 'H', value[:2])[0]
+            elif field_type == TIFF_LONG:
+                found[tag] = struct.unpack(order + 'I', value)[0]
+    if TIFF_WIDTH in found and TIFF_HEIGHT in found:
+        return found[TIFF_WIDTH], found[TIFF_HEIGHT]
+    return None
+
+# leading bytes => reader
+READERS = [
+    (b'\x89PNG\r\n\x1a\n', png_dimensions),
+    (b'GIF87a', gif_dimensions),
+    (b'GIF89a', gif_dimensions),
+    (b'\xff\xd8', jpeg_dimensions),
+    (b'II*\x00', tiff_dimensions),
+    (b'MM\x00*', tiff_dimensions),
+]
+
+def dimensions(path):
+    "returns the `(width, height)` of the image at `path`, `None` if the image isn't a supported type or can't be read"
+    with open(path, 'rb') as fh:
+        head = fh.read(8)
+        for signature, reader in READERS:
+            if head.startswith(signature):
+                try:
+                    return reader(fh)
+                except struct.error:
+                    # truncated
+                    return None
+    return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="prints the width and height of an image")
+    parser.add_argument('path')
+    args = parser.parse_args()
+    print(dimensions(args.path))
@@ -0,0 +1,131 @@
+"""a long-lived lax process that handles many ingest requests, instead of a new lax process per request.
+
+starting lax pays for Django, its imports and a database connection before any article-json is read. with
+`[lax] worker` set, `adaptor.call_lax` instead starts a single `manage.sh --skip-install worker` process and talks
+to it over its stdin and stdout, one json object per line:
+
+    > {"id": "1", "args": ["ingest", "--ingest", "--serial", "--id", "9560", "--version", "1"], "stdin": "{...article-json...}"}
+    < {"id": "1", "stdout": "{...lax's response...}"}
+
+`args` are the arguments the management command would otherwise have been called with and `stdin` what would have
+been written to its stdin. `stdout` is what the command would have written to its stdout. a response whose `id`
+doesn't match the request is from a request that timed out and is discarded.
+
+the worker is started when first needed and started again if it exits. a request that isn't answered within
+`[lax] worker_timeout` seconds fails and the worker is killed, the next request starts a new one."""
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+import conf
+
+LOG = logging.getLogger(__name__)
+
+# arguments to lax's `manage.sh` that start the worker
+COMMAND = ['--skip-install', 'worker']
+
+class LaxWorkerError(RuntimeError):
+    pass
+
+class LaxWorker:
+    """a lax process started with `cmd`, handling one request at a time.
+    requests not answered within `timeout` seconds fail."""
+
+    def __init__(self, cmd, timeout=None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.starts = 0
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=1, text=True, encoding='utf-8')
+        self.starts += 1
+        # stdout is read by a thread of its own so waiting on a response can time out
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read, args=(self.process.stdout, self.lines), daemon=True).start()
+        LOG.info("started lax worker", extra={'pid': self.process.pid, 'starts': self.starts})
+
+    @staticmethod
+    def read(stdout, lines):
+        for line in stdout:
+            lines.put(line)
+        # end of output, the worker has exited
+        lines.put(None)
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+        LOG.info("stopped lax worker", extra={'pid': self.process.pid, 'returncode': self.process.returncode})
+        self.process = None
+
+    def call(self, args, stdin=None):
+        """has the worker run lax's management command with the given `args`, writing `stdin` to it.
+        returns what the command wrote to stdout."""
+        with self.lock:
+            if not self.alive():
+                if self.process is not None:
+                    LOG.warning("lax worker exited, restarting", extra={'returncode': self.process.returncode})
+                    self.stop()
+                self.start()
+            request_id = str(next(self.ids))
+            try:
+                self.process.stdin.write(json.dumps({'id': request_id, 'args': args, 'stdin': stdin}) + "\n")
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError) as err:
+                self.stop()
+                raise LaxWorkerError("lax worker exited before request %s could be sent: %s" % (request_id, err))
+            return self.wait(request_id)
+
+    def wait(self, request_id):
+        "returns the stdout of the response to the request `request_id`"
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.stop()
+                raise LaxWorkerError("lax worker didn't respond to request %s within %ss" % (request_id, self.timeout))
+            if line is None:
+                self.stop()
+                raise LaxWorkerError("lax worker exited while handling request %s" % request_id)
+            try:
+                response = json.loads(line)
+            except ValueError:
+                LOG.warning("discarding unparseable line from lax worker: %r", line)
+                continue
+            if response.get('id') != request_id:
+                LOG.warning("discarding response to request %s from lax worker", response.get('id'))
+                continue
+            return response.get('stdout')
+
+# pid => worker
+_workers = {}
+_workers_lock = threading.Lock()
+
+def worker(script):
+    "returns the lax worker for this process, running lax's `manage.sh` at `script`"
+    with _workers_lock:
+        if os.getpid() not in _workers:
+            _workers[os.getpid()] = LaxWorker([script] + COMMAND, timeout=conf.LAX_WORKER_TIMEOUT)
+        return _workers[os.getpid()]
+
+@atexit.register
+def stop_all():
+    for pid, lax_worker in list(_workers.items()):
+        if pid == os.getpid():
+            lax_worker.stop()
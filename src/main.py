@@ -1,6 +1,7 @@
 import calendar
 import copy
 from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from functools import partial, wraps
 import logging
@@ -8,14 +9,16 @@ import json
 from os.path import join
 import os
 import re
+import threading
+import time
 from elifetools import parseJATS
 from et3.extract import lookup as p
-from et3.render import render, doall, EXCLUDE_ME
+from et3.render import doall, EXCLUDE_ME
 from et3.utils import requires_context
 from isbnlib import mask, to_isbn13
 from slugify import slugify
 
-import conf, utils, glencoe, iiif, cdn, rpp
+import conf, utils, glencoe, rpp, enrichment, negative_cache
 from utils import ensure, is_file, lmap, first
 
 LOG = logging.getLogger(__name__)
@@ -67,9 +70,45 @@ def jats(funcname, *args, **kwargs):
 
     @wraps(actual_func)
     def fn(soup):
-        return utils.sortdict(actual_func(soup, *args, **kwargs))
+        return utils.sortdict(memoised_call(actual_func, soup, *args, **kwargs))
     return fn
 
+# per-thread memo scope used by `jats`, see `jats_memo`
+_JATS_MEMO = threading.local()
+
+def memoised_call(func, soup, *args, **kwargs):
+    """calls `func` with the given `soup` and arguments, returning a previously stored result if
+    the same call has already been made within the current `jats_memo` scope.
+    the stored result is never handed out directly, callers are expected to copy it (`utils.sortdict`)."""
+    scope = getattr(_JATS_MEMO, 'scope', None)
+    if scope is None:
+        return func(soup, *args, **kwargs)
+    try:
+        key = (id(soup), func, args, tuple(sorted(kwargs.items())))
+        hash(key)
+    except TypeError:
+        # unhashable arguments, can't be memoised
+        return func(soup, *args, **kwargs)
+    scope['calls'] += 1
+    if key in scope['results']:
+        scope['hits'] += 1
+        return scope['results'][key]
+    result = func(soup, *args, **kwargs)
+    scope['results'][key] = result
+    return result
+
+@contextmanager
+def jats_memo():
+    """within this scope each `parseJATS` extractor called via `jats` is called just once per soup for a given set of arguments.
+    yields a map of statistics: the number of extractor `calls` made and the number of those `hits` that were memoised."""
+    previous = getattr(_JATS_MEMO, 'scope', None)
+    scope = {'results': {}, 'calls': 0, 'hits': 0}
+    _JATS_MEMO.scope = scope
+    try:
+        yield scope
+    finally:
+        _JATS_MEMO.scope = previous
+
 #
 #
 #
@@ -129,7 +168,7 @@ def related_article_to_reviewed_preprint(soup):
     [previously as at April 2025 is used to do:]
     detection involves inspecting article references for 'RP' prefixed manuscript ids.
     """
-    pub_date = parseJATS.pub_date(soup)
+    pub_date = jats('pub_date')(soup)
     pub_date = to_datetime(pub_date)
     if not pub_date:
         return []
@@ -138,12 +177,12 @@ def related_article_to_reviewed_preprint(soup):
         return []
 
     def fetch(msid):
-        return rpp.snippet(msid)
+        return enrichment.lookup('rpp', msid)
 
     def msid_from_relation(struct):
         return utils.msid_from_elife_doi(struct.get('xlink_href'))
 
-    related_article_list = parseJATS.related_article(soup)
+    related_article_list = jats('related_article')(soup)
     msid_list = list(map(msid_from_relation, related_article_list))
 
     # brute force approach. check API for every related MSID.
@@ -250,7 +289,7 @@ def figures_pdf_uri(triple):
                 and filename_match in graphic.get('xlink_href'), graphics)):
         filename = "elife-%s-figures-v%s.pdf" % (utils.pad_msid(msid), version) # "elife-09560-figures-v1.pdf"
         figures_pdf_cdnlink = cdnlink(msid, filename)
-        return cdn.url_exists(figures_pdf_cdnlink, msid)
+        return enrichment.lookup('cdn', figures_pdf_cdnlink, msid)
     else:
         return None
 
@@ -341,6 +380,9 @@ def fail_if_none(label):
     return wrap
 
 def discard_if_none_or_empty(v):
+    if isinstance(v, enrichment.Pending):
+        # the result of a deferred lookup isn't known yet, it's discarded when resolved if it's `None`
+        return v
     if not v:
         return EXCLUDE_ME
     elif len(v) <= 0:
@@ -410,8 +452,10 @@ def modify_preprint_event_description(struct):
 # post processing
 #
 
-def visit(data, pred, fn, coll=None):
-    "visits every value in the given data and applies `fn` when `pred` is true "
+def visit(data, pred, fn, coll=None, inplace=False):
+    """visits every value in the given data and applies `fn` when `pred` is true.
+    a copy of every dict and list is returned unless `inplace` is true, in which case they are modified in place.
+    only modify in place data that isn't shared, like freshly rendered article data."""
     if pred(data):
         if coll is not None:
             data = fn(data, coll)
@@ -420,6 +464,14 @@ def visit(data, pred, fn, coll=None):
         # why don't we return here after matching?
         # the match may contain matches within child elements (lists, dicts)
         # we want to visit them, too
+    if inplace:
+        if isinstance(data, dict):
+            for key, val in data.items():
+                data[key] = visit(val, pred, fn, coll, inplace)
+        elif isinstance(data, list):
+            for idx, row in enumerate(data):
+                data[idx] = visit(row, pred, fn, coll, inplace)
+        return data
     if isinstance(data, OrderedDict):
         results = OrderedDict()
         for key, val in data.items():
@@ -432,20 +484,59 @@ def visit(data, pred, fn, coll=None):
     # unsupported type/no further matches
     return data
 
+def visit_all(data, steps, inplace=False):
+    """like `visit`, but applies each `(pred, fn)` pair in `steps` to every value in the given data in a single walk.
+    steps are applied to a value in the order given, before any of the value's children are visited."""
+    for pred, fn in steps:
+        if pred(data):
+            data = fn(data)
+    if inplace:
+        if isinstance(data, dict):
+            for key, val in data.items():
+                data[key] = visit_all(val, steps, inplace)
+        elif isinstance(data, list):
+            for idx, row in enumerate(data):
+                data[idx] = visit_all(row, steps, inplace)
+        return data
+    if isinstance(data, OrderedDict):
+        results = OrderedDict()
+        for key, val in data.items():
+            results[key] = visit_all(val, steps)
+        return results
+    elif isinstance(data, dict):
+        return OrderedDict([(key, visit_all(val, steps)) for key, val in data.items()])
+    elif isinstance(data, list):
+        return [visit_all(row, steps) for row in data]
+    # unsupported type/no further matches
+    return data
 
-def expand_videos(data):
-    msid = data['snippet']['id']
+
+def expand_videos_step(msid):
 
     def pred(element):
         return isinstance(element, dict) and element.get("type") == "video"
 
     def fn(element):
         new_msid = utils.video_msid_2(msid, element.get('uri'))
-        return glencoe.expand_videos(new_msid, element)
+        return glencoe.expand_videos(new_msid, element, enrichment.lookup('glencoe', new_msid))
 
-    return visit(data, pred, fn)
+    return pred, fn
 
-def expand_placeholder(msid, data):
+def video_lookups_step(msid):
+    "looks up the glencoe data for each video without expanding it. see `render_single`."
+    pred, _ = expand_videos_step(msid)
+
+    def fn(element):
+        enrichment.lookup('glencoe', utils.video_msid_2(msid, element.get('uri')))
+        return element
+
+    return pred, fn
+
+def expand_videos(data):
+    msid = data['snippet']['id']
+    return visit(data, *expand_videos_step(msid))
+
+def expand_placeholder_step(msid):
 
     def pred(element):
         # dictionary with 'uri' key exists that hasn't been expanded yet
@@ -457,10 +548,13 @@ def expand_placeholder(msid, data):
         if isinstance(element.get("placeholder"), dict) and element.get("placeholder").get("uri"):
             expand_iiif_uri(msid, element, "placeholder")
         return element
-    return visit(data, pred, fn)
 
+    return pred, fn
 
-def expand_image(msid, data):
+def expand_placeholder(msid, data):
+    return visit(data, *expand_placeholder_step(msid))
+
+def expand_image_step(msid):
     "image load from IIIF server"
 
     def pred(element):
@@ -475,18 +569,26 @@ def expand_image(msid, data):
             if isinstance(element.get("image"), dict) and element.get("image").get("uri"):
                 element = expand_iiif_uri(msid, element, "image")
         return element
-    return visit(data, pred, fn)
+
+    return pred, fn
+
+def expand_image(msid, data):
+    "image load from IIIF server"
+    return visit(data, *expand_image_step(msid))
+
+def iiif_size(dimensions):
+    width, height = dimensions
+    return OrderedDict([("width", width), ("height", height)])
 
 def expand_iiif_uri(msid, element, element_type):
     element[element_type]["uri"] = iiiflink(msid, element[element_type]["uri"].split('/')[-1])
 
-    (width, height) = iiif.basic_info(msid, element[element_type]["uri"].split('%2F')[-1])
-    element[element_type]["size"] = OrderedDict([("width", width), ("height", height)])
+    element[element_type]["size"] = enrichment.lookup('iiif', msid, element[element_type]["uri"].split('%2F')[-1], then=iiif_size)
     element[element_type]["source"] = iiifsource(msid, element[element_type]["uri"].split('%2F')[-1])
 
     return element
 
-def expand_uris(msid, data):
+def expand_uris_step(msid):
     "any 'uri' element is given a proper cdn link"
 
     protocol_matcher = re.compile(r'(http|ftp)s?:\/\/.*')
@@ -516,10 +618,16 @@ def expand_uris(msid, data):
         # normal case: cdn link
         element["uri"] = cdnlink(msid, element["uri"])
         return element
-    return visit(data, pred, fn)
 
-def fix_extensions(data):
-    "in some older articles there are uris with no file extensions. call before expand_uris"
+    return pred, fn
+
+def expand_uris(msid, data):
+    "any 'uri' element is given a proper cdn link"
+    return visit(data, *expand_uris_step(msid))
+
+def fix_extensions_step(missing):
+    """in some older articles there are uris with no file extensions. apply before `expand_uris_step`.
+    images with missing extensions are appended to the given `missing` list."""
 
     # 15852
     def pred(element):
@@ -529,25 +637,31 @@ def fix_extensions(data):
             and isinstance(element["image"], dict) \
             and not os.path.splitext(element["image"]["uri"])[1] # ext in pair of (fname, ext) is empty
 
-    def fn(element, missing):
+    def fn(element):
         missing.append(utils.subdict(element, ['type', 'id', 'uri']))
         element["image"]["uri"] += ".tif"
         return element
 
-    missing = []
-    data = visit(data, pred, fn, missing)
+    return pred, fn
 
-    if missing and 'snippet' in data: # test cases rarely have a 'snippet' in them
+def log_missing_extensions(msid, version, missing):
+    if missing:
         context = {
-            'msid': data['snippet']['id'],
-            'version': data['snippet']['version'],
+            'msid': msid,
+            'version': version,
             'missing': missing
         }
         LOG.info("encountered article with %s images with missing file extensions. assuming .tif", len(missing), extra=context)
 
+def fix_extensions(data):
+    "in some older articles there are uris with no file extensions. call before expand_uris"
+    missing = []
+    data = visit(data, *fix_extensions_step(missing))
+    if 'snippet' in data: # test cases rarely have a 'snippet' in them
+        log_missing_extensions(data['snippet']['id'], data['snippet']['version'], missing)
     return data
 
-def prune(data):
+def prune_step(inplace=False):
     prune_if_none = [
         "pdf", "relatedArticles", "digest", "abstract", "titlePrefix",
         "acknowledgements",
@@ -566,12 +680,16 @@ def prune(data):
         return isinstance(element, dict) and utils.contains_any(element, prune_if_none + prune_if_empty)
 
     def fn(element):
-        element = utils.rmkeys(element, prune_if_none, lambda val: val is None)
-        element = utils.rmkeys(element, prune_if_empty, lambda val: val in empty)
+        element = utils.rmkeys(element, prune_if_none, lambda val: val is None, inplace)
+        element = utils.rmkeys(element, prune_if_empty, lambda val: val in empty, inplace)
         return element
-    return visit(data, pred, fn)
 
-def format_isbns(data):
+    return pred, fn
+
+def prune(data):
+    return visit(data, *prune_step())
+
+def format_isbns_step():
     def pred(element):
         return isinstance(element, dict) and 'isbn' in element
 
@@ -579,14 +697,15 @@ def format_isbns(data):
         element['isbn'] = handle_isbn(element['isbn'])
         return element
 
-    return visit(data, pred, fn)
+    return pred, fn
 
-def non_nil_image_dimensions(ctx, data):
+def format_isbns(data):
+    return visit(data, *format_isbns_step())
+
+def non_nil_image_dimensions_step():
     """articles not yet in iiif will have their dimensions populated with None.
     a width or height of None will fail validation with a standard obscure jsonschema dump.
     used by the API for pre-production articles."""
-    if not ctx.get('fill-missing-image-dimensions'):
-        return data
 
     def pred(element):
         return isinstance(element, dict) \
@@ -599,7 +718,15 @@ def non_nil_image_dimensions(ctx, data):
             element['image']['size']['width'] = 1
         return element
 
-    return visit(data, pred, fix)
+    return pred, fix
+
+def non_nil_image_dimensions(ctx, data):
+    """articles not yet in iiif will have their dimensions populated with None.
+    a width or height of None will fail validation with a standard obscure jsonschema dump.
+    used by the API for pre-production articles."""
+    if not ctx.get('fill-missing-image-dimensions'):
+        return data
+    return visit(data, *non_nil_image_dimensions_step())
 
 
 def history_date_fallback_to_pub_history(pair, event_type):
@@ -670,20 +797,40 @@ def manual_overrides(ctx, data):
     return data
 
 
-def postprocess(data, ctx):
-    msid = data['snippet']['id']
-    data = doall(data, [
+def postprocess(data, ctx, inplace=True, msid=None, complete=True):
+    """post-processes the given rendered article `data`, expanding uris, images, videos, etc.
+    `data` is modified in place unless `inplace` is false.
+    `msid` is taken from the article's snippet if not given.
+    if `complete` is false, only parts of the article were rendered and it won't be patched for validation or overridden."""
+    msid = msid or data['snippet']['id']
+    missing = []
+    # applied to each value in order in a single walk of the article data.
+    # order matters, for example `fix_extensions_step` must come before `expand_uris_step`.
+    steps = [
         # check_authors,
-        fix_extensions,
-        expand_videos,
-        partial(expand_uris, msid),
-        partial(expand_image, msid),
-        partial(expand_placeholder, msid),
-        format_isbns,
-        prune,
-        placeholders_for_validation,
+        fix_extensions_step(missing),
+        expand_videos_step(msid),
+        expand_uris_step(msid),
+        expand_image_step(msid),
+        expand_placeholder_step(msid),
+        format_isbns_step(),
+        prune_step(inplace),
+    ]
+
+    # image sizes are looked up from IIIF concurrently once all images are known. see `enrichment.py`.
+    with enrichment.deferred(['iiif']) as session:
+        data = visit_all(data, steps, inplace)
+    data = session.resolve(data)
+    log_missing_extensions(msid, ctx.get('version'), missing)
 
-        partial(non_nil_image_dimensions, ctx),
+    if ctx.get('fill-missing-image-dimensions'):
+        data = visit(data, *non_nil_image_dimensions_step(), inplace=inplace)
+
+    if not complete:
+        return data
+
+    data = doall(data, [
+        placeholders_for_validation,
 
         # do this last. anything that comes after this can't be altered by user-provided values
         partial(manual_overrides, ctx),
@@ -787,6 +934,114 @@ def mkdescription(poa=True):
         ('article', POA if poa else VOR),
     ])
 
+#
+# render plans
+#
+
+def compile_segment(segment):
+    "returns a function accepting an item and a context that does what `et3.render.do` would do for the given pipeline `segment`"
+    if isinstance(segment, tuple):
+        subsegments = lmap(compile_segment, segment)
+        return lambda item, ctx: tuple([subsegment(item, ctx) for subsegment in subsegments])
+    if callable(segment):
+        if hasattr(segment, 'requires_context'):
+            return lambda item, ctx: segment(ctx if isinstance(ctx, dict) else {}, item)
+        return lambda item, ctx: segment(item)
+    return lambda item, ctx: segment
+
+def segment_key(segment):
+    "returns a key identifying the given pipeline `segment` by the identity of the functions and values within it"
+    if isinstance(segment, tuple):
+        return tuple(map(segment_key, segment))
+    return id(segment)
+
+# compiled pipelines, shared by all render plans
+_COMPILED_PIPELINES = {}
+
+def compile_pipeline(pipeline):
+    """returns a function accepting an item and a context that does what `et3.render.doall` would do for the given `pipeline`.
+    identical pipelines, like those shared by snippets and articles, are compiled just once."""
+    key = tuple(map(segment_key, pipeline))
+    if key not in _COMPILED_PIPELINES:
+        segments = lmap(compile_segment, pipeline)
+
+        def fn(item, ctx):
+            for segment in segments:
+                item = segment(item, ctx)
+            return item
+        # keep a reference to the pipeline so the ids in `key` can't be reused
+        _COMPILED_PIPELINES[key] = (fn, pipeline)
+    return _COMPILED_PIPELINES[key][0]
+
+class RenderPlan:
+    """a description compiled into a flat list of `(path, pipeline)` steps.
+    rendering a plan gives the same results as `et3.render.render_item` on the description, without
+    re-interpreting the description for each item. a step with a pipeline of `None` creates a nested map."""
+
+    def __init__(self, description):
+        self.steps = []
+        self._compile(description, ())
+
+    def _compile(self, description, path):
+        for key, pipeline in description.items():
+            key_path = path + (key,)
+            if isinstance(pipeline, dict):
+                self.steps.append((key_path, None))
+                self._compile(pipeline, key_path)
+            elif isinstance(pipeline, list):
+                self.steps.append((key_path, compile_pipeline(pipeline)))
+            elif callable(pipeline):
+                self.steps.append((key_path, lambda item, ctx, pipeline=pipeline: pipeline(doall, item)))
+            else:
+                raise AssertionError("render pipeline for item is an unhandled type: %r" % type(pipeline))
+
+    def select(self, sections):
+        """returns a new plan that renders just the given `sections` of this plan.
+        sections are dotted paths like 'snippet' or 'article.title'. maps containing a section are always rendered."""
+        known_paths = [path for path, _ in self.steps]
+        paths = []
+        for section in sections:
+            path = tuple(section.split('.'))
+            ensure(path in known_paths, "unknown section %r" % section, ValueError)
+            paths.append(path)
+
+        def selected(path):
+            # the path is within a selected section or is a map containing a selected section
+            return any(path[:len(section_path)] == section_path or section_path[:len(path)] == path for section_path in paths)
+
+        plan = copy.copy(self)
+        plan.steps = [(path, pipeline) for path, pipeline in self.steps if selected(path)]
+        return plan
+
+    def render(self, item, ctx=None, timings=None):
+        """renders the given `item` using this plan.
+        if a `timings` map is given, it's populated with the seconds taken to render each field, keyed by dotted path."""
+        result = OrderedDict()
+        maps = {(): result}
+        for path, pipeline in self.steps:
+            parent = maps[path[:-1]]
+            if pipeline is None:
+                parent[path[-1]] = maps[path] = OrderedDict()
+                continue
+            if timings is None:
+                rendered = pipeline(item, ctx)
+            else:
+                start = time.perf_counter()
+                rendered = pipeline(item, ctx)
+                timings['.'.join(path)] = time.perf_counter() - start
+            if rendered == EXCLUDE_ME:
+                # pipeline has indicated this key should be discarded from the results
+                continue
+            parent[path[-1]] = rendered
+        return result
+
+POA_PLAN = RenderPlan(mkdescription(poa=True))
+VOR_PLAN = RenderPlan(mkdescription(poa=False))
+
+def mkplan(poa=True):
+    "returns the compiled render plan to scrape based on the article type"
+    return POA_PLAN if poa else VOR_PLAN
+
 #
 # bootstrap
 #
@@ -816,19 +1071,56 @@ def expand_location(path):
     LOG.warning("scraping article content in a non-repeatable way. path %r not found in article-xml dir. please don't send the results to lax", path)
     return path
 
-def render_single(doc, **ctx):
+def render_single(doc, sections=None, **ctx):
+    """renders the given article `doc` to article-json data.
+    if a list of `sections` is given, just those parts of the article are rendered and post-processed,
+    for example `['snippet', 'article.title']`. see `RenderPlan.select`."""
     try:
         # passing a 'location' value will override pulling the value from the doc
         ctx['location'] = expand_location(ctx.get('location', doc))
         soup = to_soup(doc)
-        description = mkdescription(parseJATS.is_poa(soup))
-        article_data = postprocess(list(render(description, [soup], ctx))[0], ctx)
+        # all of the article's lookups to remote services share a single deadline.
+        # once it has passed, image dimensions are filled if allowed, otherwise the article fails.
+        budget = ctx.get('enrichment-deadline', conf.ENRICHMENT_DEADLINE)
+        deadline = time.monotonic() + budget if budget else None
+        fallbacks = {'iiif': (None, None)} if ctx.get('fill-missing-image-dimensions') else {}
+        with enrichment.session(deadline=deadline, fallbacks=fallbacks):
+            # the article is rendered without waiting on remote services.
+            # lookups to the cdn, reviewed-preprints and glencoe are made concurrently afterwards.
+            with jats_memo() as memo, enrichment.deferred() as session:
+                plan = mkplan(jats('is_poa')(soup))
+                if sections:
+                    plan = plan.select(sections)
+                article_data = plan.render(soup, ctx)
+                msid = jats('publisher_id')(soup)
+                article_data = visit(article_data, *video_lookups_step(msid), inplace=True)
+            LOG.debug("parseJATS extractor calls: %s, saved by memoisation: %s", memo['calls'], memo['hits'],
+                      extra={'location': ctx['location'], 'jats-calls': memo['calls'], 'jats-calls-saved': memo['hits']})
+            article_data = session.resolve(article_data)
+            # glencoe data is now available for expanding videos, IIIF lookups are deferred until all images are known.
+            article_data = postprocess(article_data, ctx, msid=msid, complete=not sections)
+        stats = utils.requests_pool_stats()
+        LOG.debug("requests made by this process: %s, made over a reused connection: %s, saved by the negative cache: %s",
+                  stats['requests'], stats['reused'], negative_cache.STATS['hits'],
+                  extra={'location': ctx['location'], 'requests': stats, 'negative-cache': negative_cache.STATS,
+                         'circuits': utils.circuit_breaker_stats()})
         return article_data
 
     except Exception as err:
         LOG.error("failed to render doc %r with error: %s", ctx.get('location', '[no location]'), err)
         raise
 
+def enrichment_lookups(doc, **ctx):
+    """returns the lookups to remote services rendering the given article `doc` would make, without making them.
+    glencoe is still called for articles with videos, the placeholder images of videos are only known from its data."""
+    ctx['location'] = expand_location(ctx.get('location', doc))
+    soup = to_soup(doc)
+    with enrichment.recording(['glencoe']) as recorder:
+        plan = mkplan(jats('is_poa')(soup))
+        article_data = plan.render(soup, ctx)
+        postprocess(article_data, ctx, msid=jats('publisher_id')(soup), complete=False)
+    return list(recorder.recorded.keys())
+
 def serialize_overrides(override_map):
     def serialize(pair):
         key, val = pair
@@ -851,7 +1143,8 @@ def deserialize_overrides(override_list):
     pairs = lmap(splitter, override_list)
     return OrderedDict([(key, utils.json_loads(val)) for key, val in pairs])
 
-def main(doc, args=None):
+def main(doc, args=None, sections=None):
+    "renders the given article `doc` to a string of article-json. see `render_single` for `sections`."
     args = args or {}
     msid, version = utils.version_from_path(getattr(doc, 'name', doc))
     ctx = {
@@ -861,7 +1154,7 @@ def main(doc, args=None):
     }
     ctx.update(args)
     try:
-        article_json = render_single(doc, **ctx)
+        article_json = render_single(doc, sections, **ctx)
         return json.dumps(article_json, indent=4)
 
     except AssertionError:
@@ -893,7 +1186,9 @@ if __name__ == '__main__':
     parser.add_argument('infile', type=argparse.FileType('r'))
     parser.add_argument('--verbose', action="store_true", default=False)
     parser.add_argument('--override', nargs=2, action="append")
+    parser.add_argument('--only', action="append", help="render just this section of the article, like 'snippet' or 'article.title'. may be repeated.")
     args = vars(parser.parse_args())
     doc = args.pop('infile')
+    sections = args.pop('only')
     args['override'] = deserialize_overrides(args['override'] or [])
-    print(main(doc, args))
+    print(main(doc, args, sections))
@@ -0,0 +1,80 @@
+"""remembers 'not found' responses from glencoe, iiif, the cdn and reviewed-preprints for a short while.
+
+the requests cache only stores successful responses. an article without videos or reviewed-preprints, or with images
+not yet in IIIF, would otherwise ask each service again every time it's scraped.
+
+entries expire after the service's TTL, see `[enrichment] <service>_not_found_ttl` in `app.cfg`. a TTL of 0 disables
+the negative cache for that service. entries are kept in their own database, separate from the requests cache.
+
+media may be deposited with glencoe after an article was first scraped. to forget what's remembered about an article:
+
+    python src/negative_cache.py <msid>"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import conf
+from cache_requests import retry_locked
+
+# hits, misses and stores by this process
+STATS = {'hits': 0, 'misses': 0, 'stores': 0}
+
+_local = threading.local()
+
+def connection():
+    "returns a connection to the negative cache database for the current thread and process, creating the database if necessary"
+    if getattr(_local, 'key', None) != (os.getpid(), conf.NEGATIVE_CACHE_DB):
+        con = sqlite3.connect(conf.NEGATIVE_CACHE_DB, timeout=0, isolation_level=None)
+        retry_locked(con.execute, "PRAGMA journal_mode = WAL;")
+        retry_locked(con.execute, "create table if not exists not_found (url PRIMARY KEY, service, msid, expires)")
+        retry_locked(con.execute, "create index if not exists not_found_msid on not_found (msid)")
+        _local.con, _local.key = con, (os.getpid(), conf.NEGATIVE_CACHE_DB)
+    return _local.con
+
+def ttl(service):
+    "returns the number of seconds a 'not found' response from the given `service` is remembered for"
+    if not conf.REQUESTS_CACHING:
+        return 0
+    return conf.NEGATIVE_CACHE_TTLS.get(service, 0)
+
+def is_not_found(service, url):
+    "returns `True` if `url` was recently found not to exist"
+    if not ttl(service):
+        return False
+    row = retry_locked(connection().execute, "select expires from not_found where url = ?", (url,)).fetchone()
+    hit = bool(row and row[0] > time.time())
+    STATS['hits' if hit else 'misses'] += 1
+    return hit
+
+def not_found(service, msid, url):
+    "remembers that `url`, a request to `service` about the article `msid`, wasn't found"
+    if not ttl(service):
+        return
+    retry_locked(connection().execute, "insert or replace into not_found (url, service, msid, expires) values (?, ?, ?, ?)",
+                 (url, service, int(msid) if msid else None, time.time() + ttl(service)))
+    STATS['stores'] += 1
+
+def forget(url):
+    "forgets that `url` wasn't found"
+    if os.path.exists(conf.NEGATIVE_CACHE_DB):
+        retry_locked(connection().execute, "delete from not_found where url = ?", (url,))
+
+def bust(msid):
+    "forgets everything that wasn't found about the article `msid`. returns the number of entries removed."
+    if not os.path.exists(conf.NEGATIVE_CACHE_DB):
+        return 0
+    return retry_locked(connection().execute, "delete from not_found where msid = ?", (int(msid),)).rowcount
+
+def clear_expired():
+    "removes expired entries. returns the number of entries removed."
+    if not os.path.exists(conf.NEGATIVE_CACHE_DB):
+        return 0
+    return retry_locked(connection().execute, "delete from not_found where expires <= ?", (time.time(),)).rowcount
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="forgets the 'not found' responses remembered for an article")
+    parser.add_argument('msid', type=int)
+    args = parser.parse_args()
+    print("removed %s entries" % bust(args.msid))
@@ -0,0 +1,350 @@
+"""handles requests to the adaptor in stages, each stage working on many requests at once.
+
+    read -> download -> render -> serialise -> lax
+
+requests are read and validated by the listening process. ingest requests then pass through each stage in turn:
+their article-xml is downloaded by a pool of threads, rendered by a pool of processes, serialised to article-json and
+sent to lax. publish requests go straight to lax.
+
+stages are joined by bounded queues. when a stage falls behind, the queue in front of it fills and the stages before
+it wait to hand on their requests, so no more requests are read than can be worked on. the number of workers in each
+stage and the size of the queues are set in `[pipeline]` in `app.cfg`.
+
+requests about the same article are handled one at a time, in the order they were received: a request isn't started
+until the request before it about the same article has been handled and its responses sent. responses about different
+articles may be sent in a different order to their requests.
+
+when lax fails the requests already being worked on are finished and their responses sent before the error is
+raised. no more requests are read and those read but not yet worked on are sent an error response instead.
+
+every `metrics_interval` seconds each stage's queue depth, the number of requests being worked on and the time spent
+working and waiting on the next stage are logged. the stage with the fullest queue in front of it is the one limiting
+throughput."""
+
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import queue
+import threading
+from time import time
+import conf, adaptor, render_cache
+from conf import ERROR, INGEST, INGEST_PUBLISH
+
+LOG = logging.getLogger(__name__)
+
+# stages in the order requests pass through them
+STAGES = ['download', 'render', 'serialise', 'lax']
+
+# seconds an idle stage's workers wait for a job before checking if the stage has been stopped
+_POLL_INTERVAL = 0.1
+
+class Job:
+    "a request passing through the pipeline"
+
+    def __init__(self, request, params):
+        self.request = request
+        self.params = params
+        self.msid = str(params['msid'])
+        self.article_xml = None
+        self.article_data = None
+        self.article_json = None
+        self.cache_key = None
+
+class LockedOutgoing:
+    "an outgoing queue that can be sent to from many threads"
+
+    def __init__(self, outgoing):
+        self.outgoing = outgoing
+        self.lock = threading.Lock()
+
+    def write(self, string):
+        with self.lock:
+            self.outgoing.write(string)
+
+    def error(self, string):
+        with self.lock:
+            self.outgoing.error(string)
+
+class Stage:
+    """`workers` threads each taking a job from the stage's queue, calling `fn` with it and handing it on to the `next`
+    stage, or to `done` after the last stage. a job `fn` raises an `adaptor.RequestError` for is sent an error response
+    and is done. any other error is passed to `failed` with the job.
+    once `cancelled` returns a reason, jobs are sent an error response with it and are done without calling `fn`."""
+
+    def __init__(self, name, fn, workers, queue_size, done, failed, cancelled):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next = None
+        self.done = done
+        self.failed = failed
+        self.cancelled = cancelled
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {'handled': 0, 'busy': 0, 'max-depth': 0, 'working': 0.0, 'blocked': 0.0}
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self.work, name='%s-%s' % (self.name, i), daemon=True).start()
+
+    def stop(self):
+        "the stage's workers stop once they've finished the job they're working on, if any"
+        self.stopped.set()
+
+    def drain(self):
+        "returns the jobs left on the stage's queue"
+        jobs = []
+        while True:
+            try:
+                jobs.append(self.queue.get_nowait())
+            except queue.Empty:
+                return jobs
+
+    def put(self, job):
+        "adds the job to the stage's queue, waiting for space if the queue is full"
+        self.queue.put(job)
+        with self.lock:
+            self.stats['max-depth'] = max(self.stats['max-depth'], self.queue.qsize())
+
+    def count(self, key, value):
+        with self.lock:
+            self.stats[key] += value
+
+    def work(self):
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            reason = self.cancelled()
+            if reason:
+                self.done(job, adaptor.mkresponse(ERROR, "request not handled: %s" % reason, job.request))
+                continue
+            self.count('busy', 1)
+            start = time()
+            try:
+                self.fn(job)
+            except adaptor.RequestError as err:
+                self.done(job, adaptor.mkresponse(ERROR, err.message, err.request))
+                continue
+            except Exception as err:
+                self.failed(job, err)
+                continue
+            finally:
+                self.count('busy', -1)
+                self.count('handled', 1)
+                self.count('working', time() - start)
+            if self.next:
+                start = time()
+                self.next.put(job)
+                self.count('blocked', time() - start)
+            else:
+                self.done(job)
+
+    def metrics(self):
+        "returns the stage's queue depth and activity"
+        with self.lock:
+            stats = dict(self.stats)
+        return OrderedDict([
+            ('depth', self.queue.qsize()),
+            ('max-depth', stats['max-depth']),
+            ('busy', stats['busy']),
+            ('workers', self.workers),
+            ('handled', stats['handled']),
+            # seconds spent working on jobs and waiting for space in the next stage's queue
+            ('working', round(stats['working'], 3)),
+            ('blocked', round(stats['blocked'], 3)),
+        ])
+
+def render(request, article_xml):
+    "renders the given article-xml in a worker process"
+    return adaptor.render_article_xml(request, article_xml)
+
+class Pipeline:
+    """handles requests in stages, see module docstring.
+    `workers` is a map of stage to the number of workers in it and `queue_size` the size of the queue in front of each stage."""
+
+    def __init__(self, outgoing, workers=None, queue_size=None, metrics_interval=None):
+        self.outgoing = LockedOutgoing(outgoing)
+        workers = workers or conf.PIPELINE_WORKERS
+        queue_size = queue_size or conf.PIPELINE_QUEUE_SIZE
+        self.metrics_interval = metrics_interval or conf.PIPELINE_METRICS_INTERVAL
+        self.stages = OrderedDict((name, Stage(name, getattr(self, name), workers[name], queue_size,
+                                               self.done, self.failed, self.cancelled))
+                                  for name in STAGES)
+        for stage, next_stage in zip(STAGES, STAGES[1:]):
+            self.stages[stage].next = self.stages[next_stage]
+        self.executor = None
+        # finished jobs and requests read, in the order they happen
+        self.events = queue.Queue()
+        self.error = None
+        # why requests read aren't being handled, once they aren't
+        self.reason = None
+        # no more requests are read once set
+        self.stop_reading = threading.Event()
+
+    # stages
+
+    def download(self, job):
+        job.article_xml = adaptor.download_article_xml(job.request)
+        job.cache_key = render_cache.key(job.article_xml, adaptor.render_ctx(job.request))
+        job.article_json = render_cache.get(job.cache_key)
+        if job.article_json is not None:
+            LOG.info("article-json found in render cache")
+
+    def render(self, job):
+        if job.article_json is None:
+            job.article_data = self.executor.submit(render, job.request, job.article_xml).result()
+        job.article_xml = None
+
+    def serialise(self, job):
+        if job.article_json is None:
+            job.article_json = adaptor.serialise_article_data(job.request, job.article_data)
+            render_cache.put(job.cache_key, job.article_json)
+        job.article_data = None
+        job.params['article_json'] = job.article_json
+
+    def lax(self, job):
+        # sends lax's response, or an error response when lax fails before raising the error
+        adaptor.send_to_lax(job.request, job.params, self.outgoing)
+
+    #
+
+    def done(self, job, response=None):
+        "the job is finished, sends its `response` if it hasn't been sent"
+        if response:
+            adaptor.send_response(self.outgoing, response)
+        self.events.put(job)
+
+    def failed(self, job, err):
+        "the job failed in a way that stops the pipeline"
+        if not self.error:
+            LOG.error("failed to handle request, no further requests will be handled: %s", err)
+            self.error = err
+            self.cancel("an earlier request failed: %s" % err)
+        self.events.put(job)
+
+    def cancel(self, reason):
+        "no more requests are read and those read are sent an error response with the given `reason` instead of being handled"
+        if not self.reason:
+            self.reason = reason
+        self.stop_reading.set()
+
+    def cancelled(self):
+        "returns why requests aren't being handled, if they aren't"
+        return self.reason
+
+    def not_handled(self, job):
+        adaptor.send_response(self.outgoing, adaptor.mkresponse(ERROR, "request not handled: %s" % self.reason, job.request))
+
+    def metrics(self):
+        "returns the queue depth and activity of each stage"
+        return OrderedDict((name, stage.metrics()) for name, stage in self.stages.items())
+
+    def log_metrics(self):
+        LOG.info("pipeline metrics: %s", " ".join(
+            "%s=%s/%s" % (name, metrics['depth'], metrics['busy']) for name, metrics in self.metrics().items()
+        ), extra={'pipeline': self.metrics()})
+
+    def start(self, job):
+        if job.params['action'] in [INGEST, INGEST_PUBLISH]:
+            self.stages['download'].put(job)
+        else:
+            self.stages['lax'].put(job)
+
+    def run(self, incoming):
+        "handles each request from `incoming`, returning once they've all been handled"
+        # at most as many requests are read and not yet handled as the pipeline can hold
+        capacity = sum(stage.workers + stage.queue.maxsize for stage in self.stages.values())
+        slots = threading.Semaphore(capacity)
+        threading.Thread(target=adaptor.read_all, args=(incoming, self.events, slots, self.stop_reading), daemon=True).start()
+
+        waiting = {} # msid => jobs waiting on the job being handled about that article
+        running = 0 # jobs being handled or waiting to be
+        reading = True
+        last_logged = time()
+
+        def drop_waiting():
+            nonlocal running
+            for jobs in waiting.values():
+                while jobs:
+                    self.not_handled(jobs.popleft())
+                    running -= 1
+
+        self.executor = ProcessPoolExecutor(max_workers=self.stages['render'].workers)
+        for stage in self.stages.values():
+            stage.start()
+        try:
+            while reading or running:
+                try:
+                    event = self.events.get(timeout=self.metrics_interval)
+                except queue.Empty:
+                    event = None
+
+                if time() - last_logged >= self.metrics_interval:
+                    self.log_metrics()
+                    last_logged = time()
+
+                if event is None:
+                    continue
+
+                if isinstance(event, Job):
+                    running -= 1
+                    if self.reason:
+                        reading = False
+                        drop_waiting()
+                    if waiting[event.msid]:
+                        self.start(waiting[event.msid].popleft())
+                    else:
+                        del waiting[event.msid]
+                    slots.release()
+
+                elif event is adaptor._DONE:
+                    reading = False
+
+                elif isinstance(event, BaseException):
+                    raise event
+
+                elif not reading:
+                    adaptor.not_handled(self.outgoing, event, self.reason)
+
+                else:
+                    LOG.info("received request %s", event)
+                    try:
+                        job = Job(*adaptor.parse_request(event))
+                    except adaptor.RequestError as err:
+                        adaptor.send_response(self.outgoing, adaptor.mkresponse(ERROR, err.message, err.request))
+                        slots.release()
+                        continue
+                    running += 1
+                    if job.msid in waiting:
+                        waiting[job.msid].append(job)
+                    else:
+                        waiting[job.msid] = deque()
+                        self.start(job)
+
+        except KeyboardInterrupt:
+            LOG.warning("stopping abruptly due to KeyboardInterrupt")
+
+        finally:
+            self.cancel("the adaptor was stopped")
+            self.log_metrics()
+            for stage in self.stages.values():
+                stage.stop()
+            self.executor.shutdown(cancel_futures=True)
+            # requests read but not handled are responded to
+            drop_waiting()
+            for stage in self.stages.values():
+                for job in stage.drain():
+                    self.not_handled(job)
+            adaptor.drain(self.outgoing, self.events, self.reason)
+
+        if self.error:
+            # when lax fails, we fail
+            raise self.error
+
+def do(incoming, outgoing):
+    "handles each request from `incoming` in stages, sending responses to `outgoing`"
+    Pipeline(outgoing).run(incoming)
+    LOG.info("graceful shutdown")
@@ -0,0 +1,89 @@
+"""warms the requests cache before generating article-json.
+
+scans a directory of article-xml for every lookup to glencoe, iiif, the cdn and reviewed-preprints the renderer
+would make, see `main.enrichment_lookups`, and makes each distinct lookup once. the lookups are made concurrently
+with the same limits as rendering, at most `--max-workers` at once and `--max-per-host` to any one host, see
+`[enrichment]` in `app.cfg`.
+
+`generate_article_json.py` can then be run against a warm cache:
+
+    python src/prefetch.py ./article-xml/articles
+    python src/generate_article_json.py ./article-xml/articles ./article-json
+
+with `--export <path>` the results are also written to a snapshot for generating article-json offline, see `snapshot.py`."""
+
+import argparse
+from collections import Counter, OrderedDict
+import json
+import os
+from os.path import join
+import time
+from joblib import Parallel, delayed
+import conf, enrichment, main as scraper, snapshot
+from utils import ensure, lfilter, lmap, version_from_path
+import logging
+
+LOG = logging.getLogger(__name__)
+
+def lookups(path):
+    "returns the lookups rendering the article at `path` would make. an article that can't be rendered has none."
+    try:
+        _, version = version_from_path(path)
+        ctx = {'version': version, 'override': {}, 'fill-missing-image-dimensions': False}
+        return scraper.enrichment_lookups(path, **ctx)
+    except BaseException as err:
+        LOG.error("failed to find lookups for article %r: %s", path, err, extra={'path': path})
+        return []
+
+def distinct(key_lists):
+    "returns the distinct lookups in the given lists of lookups, in the order they're first found"
+    return list(OrderedDict((key, None) for key_list in key_lists for key in key_list).keys())
+
+def prefetch(key_list, max_workers=None, max_per_host=None, export=None):
+    """makes the lookups described by the given `key_list`, storing their responses in the requests cache.
+    the results of successful lookups are written to a snapshot at `export`, if given.
+    returns a map of service to the number of lookups made and the number that failed."""
+    max_workers = max_workers or conf.ENRICHMENT_MAX_WORKERS
+    max_per_host = max_per_host or conf.ENRICHMENT_MAX_PER_HOST
+    stats = OrderedDict((service, Counter(made=0, failed=0)) for service in enrichment.SERVICES)
+    results = enrichment.call_all(key_list, max_workers, max_per_host)
+    for key, result in zip(key_list, results):
+        stats[key[0]]['made'] += 1
+        if isinstance(result, BaseException):
+            stats[key[0]]['failed'] += 1
+            LOG.error("failed to prefetch %r: %s", key, result, extra={'lookup': key})
+    if export:
+        snapshot.write(export, [(key, result) for key, result in zip(key_list, results) if not isinstance(result, BaseException)])
+    return stats
+
+def main(xml_dir, num=None, max_workers=None, max_per_host=None, export=None):
+    paths = lmap(lambda fname: join(xml_dir, fname), os.listdir(xml_dir))
+    paths = lfilter(lambda path: path.lower().endswith('.xml'), paths)
+    paths = sorted(paths, reverse=True)
+    if num is not None and num > -1:
+        paths = paths[:num] # only scan first n articles
+    start = time.time()
+    key_list = distinct(Parallel(n_jobs=-1)(delayed(lookups)(path) for path in paths))
+    print('%s distinct lookups found in %s articles in %.1fs' % (len(key_list), len(paths), time.time() - start))
+    start = time.time()
+    stats = prefetch(key_list, max_workers, max_per_host, export)
+    for service, counts in stats.items():
+        print('%s: %s lookups, %s failed' % (service, counts['made'], counts['failed']))
+    print('prefetched in %.1fs, see scrape.log for errors' % (time.time() - start))
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="warms the requests cache with the lookups needed to render a directory of article-xml")
+    parser.add_argument('xml-dir', nargs='?', default=conf.XML_DIR)
+    parser.add_argument('--num', type=int, nargs='?')
+    parser.add_argument('--max-workers', type=int, default=conf.ENRICHMENT_MAX_WORKERS)
+    parser.add_argument('--max-per-host', type=int, default=conf.ENRICHMENT_MAX_PER_HOST)
+    parser.add_argument('--export', help="also write the results to a snapshot at this path, see `snapshot.py`")
+
+    args = vars(parser.parse_args())
+    indir = os.path.abspath(args['xml-dir'])
+    ensure(os.path.exists(indir), "the path %r doesn't exist" % indir)
+
+    LOG.info("command line arguments: %s", json.dumps(args, indent=4))
+
+    main(indir, args['num'], args['max_workers'], args['max_per_host'], args['export'])
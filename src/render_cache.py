@@ -0,0 +1,167 @@
+"""an on-disk cache of rendered article-json.
+
+entries are keyed by a hash of the article xml, the scraper code, the render context and the enrichment configuration.
+a change to any of these results in a different key and the article is rendered again.
+
+enrichment data (glencoe, iiif, cdn, rpp) may change without any of the above changing, so the cache is disabled by default.
+see `[render_cache]` in `app.cfg`."""
+
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+from os.path import join
+import conf
+
+LOG = logging.getLogger(__name__)
+
+# directories under `conf.SRC_DIR` whose code doesn't affect the rendered article-json
+EXCLUDED_DIRS = ['tests']
+
+# libraries whose version affects the rendered article-json
+CODE_LIBRARIES = ['elifetools', 'et3']
+
+# hit, miss and eviction counts for this process
+STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# size of the cache in bytes as last known to this process, see `evict`.
+_size = None
+
+_code_version = None
+
+def code_modules():
+    "returns the paths, relative to `conf.SRC_DIR`, of every python module that may affect the rendered article-json"
+    modules = []
+    for dirpath, dirnames, filenames in os.walk(conf.SRC_DIR):
+        dirnames[:] = [dirname for dirname in dirnames if dirname not in EXCLUDED_DIRS]
+        modules.extend(os.path.relpath(join(dirpath, filename), conf.SRC_DIR) for filename in filenames if filename.endswith('.py'))
+    return sorted(modules)
+
+def code_version():
+    "returns a hash of the scraper code and the versions of the libraries it depends on"
+    global _code_version
+    if not _code_version:
+        digest = hashlib.sha256()
+        for module in code_modules():
+            digest.update(module.encode('utf-8'))
+            with open(join(conf.SRC_DIR, module), 'rb') as fh:
+                digest.update(fh.read())
+        for library in CODE_LIBRARIES:
+            digest.update(importlib.metadata.version(library).encode('utf-8'))
+        _code_version = digest.hexdigest()
+    return _code_version
+
+def enrichment_config():
+    "returns the configuration that affects how article-json is enriched with data from remote services"
+    config = {
+        'cdn': conf.CDN,
+        'cdn-iiif': conf.CDN_IIIF,
+        'iiif': conf.IIIF,
+        'api-url': conf.API_URL,
+        'forced-iiif': os.environ.get('FORCED_IIIF'),
+        # image dimensions read from local image files may differ from IIIF's
+        'iiif-image-root': conf.IIIF_IMAGE_ROOT,
+    }
+    if conf.ENRICHMENT_OFFLINE:
+        # rendered from an enrichment snapshot rather than the remote services
+        config['offline'] = True
+    return config
+
+def key(xml, ctx):
+    """returns the cache key for the given article `xml` and render `ctx`.
+    `ctx` must be json serialisable and include everything the caller passes to the renderer.
+    returns `None` for file-like objects, their contents can't be read without consuming them."""
+    if hasattr(xml, 'read'):
+        return None
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(xml).digest())
+    digest.update(code_version().encode('utf-8'))
+    digest.update(json.dumps(ctx, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(json.dumps(enrichment_config(), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def path(cache_key):
+    "returns the path to the cache entry for the given `cache_key`"
+    return join(conf.RENDER_CACHE_PATH, cache_key[:2], cache_key + '.json')
+
+def get(cache_key):
+    "returns the cached article-json for the given `cache_key` or `None` if not found or the cache is disabled."
+    if not conf.RENDER_CACHE or not cache_key:
+        return None
+    entry = path(cache_key)
+    try:
+        with open(entry, 'r') as fh:
+            article_json = fh.read()
+    except FileNotFoundError:
+        STATS['misses'] += 1
+        LOG.debug("render cache miss", extra={'cache-key': cache_key, 'stats': STATS})
+        return None
+    # entries are evicted least-recently-used first
+    os.utime(entry)
+    STATS['hits'] += 1
+    LOG.debug("render cache hit", extra={'cache-key': cache_key, 'stats': STATS})
+    return article_json
+
+def put(cache_key, article_json):
+    "stores the given `article_json` under the given `cache_key`, if the cache is enabled."
+    global _size
+    if not conf.RENDER_CACHE or not cache_key:
+        return
+    entry = path(cache_key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    # write to a temporary file first so concurrent readers never see a partial entry
+    partial_entry = "%s.%s.tmp" % (entry, os.getpid())
+    with open(partial_entry, 'w') as fh:
+        fh.write(article_json)
+    os.replace(partial_entry, entry)
+    if _size is not None:
+        _size += os.path.getsize(entry)
+    if _size is None or _size > conf.RENDER_CACHE_MAX_SIZE:
+        evict(conf.RENDER_CACHE_MAX_SIZE)
+
+def entries():
+    "returns a list of `(path, size, last-used)` triples for every entry in the cache"
+    results = []
+    if not os.path.exists(conf.RENDER_CACHE_PATH):
+        return results
+    for dirpath, _, filenames in os.walk(conf.RENDER_CACHE_PATH):
+        for filename in filenames:
+            if not filename.endswith('.json'):
+                continue
+            entry = join(dirpath, filename)
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+            results.append((entry, stat.st_size, stat.st_mtime))
+    return results
+
+def evict(max_size):
+    "removes the least-recently-used entries from the cache until it's no larger than `max_size` bytes"
+    global _size
+    entry_list = sorted(entries(), key=lambda triple: triple[2])
+    _size = sum(size for _, size, _ in entry_list)
+    for entry, size, _ in entry_list:
+        if _size <= max_size:
+            break
+        try:
+            os.unlink(entry)
+            STATS['evictions'] += 1
+        except FileNotFoundError:
+            pass
+        _size -= size
+    return _size
+
+def cached(xml, ctx, fn):
+    """returns the article-json for the given article `xml` and render `ctx` from the cache,
+    calling `fn` to render the article-json and storing the result if not found."""
+    cache_key = key(xml, ctx)
+    article_json = get(cache_key)
+    if article_json is None:
+        article_json = fn()
+        put(cache_key, article_json)
+    return article_json
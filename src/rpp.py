@@ -1,14 +1,14 @@
 from datetime import datetime
 import requests
 import requests_cache
-from cache_requests import install_cache_requests
-import conf, utils
+from cache_requests import install_cache_requests, cached_payload, cache_payload, forget_payload, tagged
+import conf, utils, negative_cache
 import logging
 
 LOG = logging.getLogger(__name__)
 
 if conf.REQUESTS_CACHING:
-    install_cache_requests()
+    install_cache_requests('rpp', conf.API_URL + '/reviewed-preprints/')
 
 def before_inception(pubdate):
     "returns `True` if given `pubdate` is before the inception of reviewed-preprints."
@@ -20,6 +20,8 @@ def rpp_url(msid):
 
 def clear_cache(msid):
     "removes a /reviewed-preprint from the requests cache, if requests caching is turned on."
+    forget_payload(rpp_url(msid))
+    negative_cache.forget(rpp_url(msid))
     if conf.REQUESTS_CACHING:
         requests_cache.core.get_cache().delete_url(rpp_url(msid))
 
@@ -27,13 +29,20 @@ def snippet(msid):
     if not msid:
         return
     url = rpp_url(msid)
+    rpp_data = cached_payload(url)
+    if rpp_data is not None:
+        return rpp_data
+    if negative_cache.is_not_found('rpp', url):
+        return
+
     context = {
         'msid': msid,
         'url': url,
     }
     try:
         LOG.debug("Loading URL: %s", url, extra=context)
-        resp = utils.requests_get(url)
+        with tagged('rpp', msid):
+            resp = utils.requests_get(url, timeout=conf.ENRICHMENT_TIMEOUTS['rpp'])
     except requests.RequestException as re:
         LOG.debug("request failed fetching RPP", extra=context, exc_info=re)
         return
@@ -42,6 +51,7 @@ def snippet(msid):
 
     if resp.status_code == 404:
         LOG.debug("RPP not found", extra=context)
+        negative_cache.not_found('rpp', msid, url)
         return
 
     if resp.status_code != 200:
@@ -57,6 +67,7 @@ def snippet(msid):
 
         rpp_data['type'] = 'reviewed-preprint'
 
+        cache_payload(url, rpp_data)
         return rpp_data
     except BaseException:
         # clear cache, we don't want bad data hanging around
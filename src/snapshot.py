@@ -0,0 +1,124 @@
+"""a portable snapshot of the data looked up from glencoe, iiif, the cdn and reviewed-preprints.
+
+a snapshot is a file of json, one lookup per line, holding just what the scraper uses from each service:
+
+    {"lookup": ["iiif", "24271", "elife-24271-fig1.tif"], "result": [1500, 800]}
+    {"lookup": ["cdn", "https://cdn.elifesciences.org/articles/24271/elife-24271-figures-v1.pdf", "24271"], "result": true}
+    {"lookup": ["glencoe", "24271"], "result": {"media1": {"jpg_href": "...", "mp4_href": "...", ...}}}
+    {"lookup": ["rpp", "85380"], "result": {"id": "85380", ...}}
+
+lookups are sorted, the same lookups always produce the same file. snapshots are written by `prefetch.py --export`.
+
+a snapshot is imported into a local database before use:
+
+    python src/snapshot.py import snapshot.jsonl
+
+with `[enrichment] offline` set, lookups are resolved only from the imported snapshot, no requests are made and a
+lookup missing from the snapshot fails the article. articles can then be generated on any number of machines without
+network access, each rendering exactly the same article-json."""
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+import conf, utils
+from glencoe import SOURCES, validate_gc_data
+
+class SnapshotMissError(LookupError):
+    pass
+
+# fields kept for each video in the glencoe data, see `glencoe.expand_videos`
+GLENCOE_FIELDS = ['jpg_href', 'width', 'height'] + [mtype + '_href' for mtype in SOURCES]
+
+def encode(key, result):
+    "returns the snapshot record for the given lookup `key` and its `result`"
+    service = key[0]
+    if service == 'iiif':
+        result = list(result)
+    elif service == 'cdn':
+        result = bool(result)
+    elif service == 'glencoe':
+        result = OrderedDict((v_id, utils.subdict(v_data, GLENCOE_FIELDS)) for v_id, v_data in result.items())
+    return OrderedDict([('lookup', list(key)), ('result', result)])
+
+def decode(record):
+    "returns the lookup key and result for the given snapshot `record`"
+    key = tuple(record['lookup'])
+    service, result = key[0], record['result']
+    utils.ensure(service in conf.ENRICHMENT_TIMEOUTS, "unknown service in snapshot: %r" % (service,))
+    if service == 'iiif':
+        utils.ensure(isinstance(result, list) and len(result) == 2, "iiif result must be a width and height: %r" % (key,))
+        result = tuple(result)
+    elif service == 'cdn':
+        result = key[1] if result else None
+    elif service == 'glencoe' and result:
+        validate_gc_data(result)
+    return key, result
+
+def write(path, pairs):
+    "writes a snapshot of the given `(key, result)` pairs to `path`. returns the number of lookups written."
+    records = sorted((encode(key, result) for key, result in pairs), key=lambda record: json.dumps(record['lookup']))
+    partial_path = "%s.%s.tmp" % (path, os.getpid())
+    with open(partial_path, 'w') as fh:
+        for record in records:
+            fh.write(json.dumps(record) + "\n")
+    os.replace(partial_path, path)
+    return len(records)
+
+def read(path):
+    "yields the `(key, result)` pairs in the snapshot at `path`"
+    with open(path, 'r') as fh:
+        for line in fh:
+            if line.strip():
+                yield decode(json.loads(line, object_pairs_hook=OrderedDict))
+
+_local = threading.local()
+
+def connection():
+    "returns a connection to the imported snapshot for the current thread and process, creating the database if necessary"
+    if getattr(_local, 'key', None) != (os.getpid(), conf.ENRICHMENT_SNAPSHOT_DB):
+        con = sqlite3.connect(conf.ENRICHMENT_SNAPSHOT_DB, isolation_level=None)
+        con.execute("create table if not exists lookups (lookup PRIMARY KEY, result)")
+        _local.con, _local.key = con, (os.getpid(), conf.ENRICHMENT_SNAPSHOT_DB)
+    return _local.con
+
+def import_snapshot(path):
+    """imports the snapshot at `path`, replacing any lookups already imported.
+    the whole snapshot is read before anything is imported, a snapshot with an invalid line isn't imported at all."""
+    rows = [(json.dumps(record['lookup']), json.dumps(record['result']))
+            for record in (encode(key, result) for key, result in read(path))]
+    con = connection()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute("delete from lookups")
+        con.executemany("insert or replace into lookups (lookup, result) values (?, ?)", rows)
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return len(rows)
+
+def export_snapshot(path):
+    "writes the imported snapshot to `path`. returns the number of lookups written."
+    rows = connection().execute("select lookup, result from lookups").fetchall()
+    return write(path, [decode({'lookup': json.loads(lookup), 'result': json.loads(result, object_pairs_hook=OrderedDict)})
+                        for lookup, result in rows])
+
+def lookup(key):
+    "returns the result of the lookup described by the given `key` from the imported snapshot"
+    row = connection().execute("select result from lookups where lookup = ?", (json.dumps(list(key)),)).fetchone()
+    if not row:
+        raise SnapshotMissError("lookup %r not found in the enrichment snapshot" % (key,))
+    return decode({'lookup': list(key), 'result': json.loads(row[0], object_pairs_hook=OrderedDict)})[1]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="imports and exports snapshots of the data looked up from remote services")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('path')
+    args = parser.parse_args()
+    if args.action == 'import':
+        print("imported %s lookups" % import_snapshot(args.path))
+    else:
+        print("exported %s lookups" % export_snapshot(args.path))
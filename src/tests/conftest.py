@@ -0,0 +1,35 @@
+from unittest import mock
+import pytest
+import cache_requests, utils
+
+@pytest.fixture(autouse=True)
+def empty_payload_cache():
+    "responses are mocked differently from test to test, payloads held in memory by one test mustn't leak into another"
+    cache_requests.PAYLOADS.clear()
+    yield
+    cache_requests.PAYLOADS.clear()
+
+@pytest.fixture(autouse=True)
+def no_negative_cache():
+    "'not found' responses are only remembered by tests of the negative cache"
+    with mock.patch('conf.NEGATIVE_CACHE_TTLS', {}):
+        yield
+
+@pytest.fixture(autouse=True)
+def no_stale_responses():
+    "cached responses only go stale in tests of revalidation"
+    with mock.patch('conf.REQUESTS_CACHE_TTLS', {}):
+        yield
+
+@pytest.fixture(autouse=True)
+def empty_iiif_dimensions(tmp_path):
+    "image dimensions stored by one test mustn't leak into another"
+    with mock.patch('conf.IIIF_DIMENSIONS_DB', str(tmp_path / 'iiif_dimensions.sqlite3')):
+        yield
+
+@pytest.fixture(autouse=True)
+def closed_circuits():
+    "hosts failing in one test mustn't fail requests made by another"
+    utils._CIRCUIT_BREAKERS.clear()
+    yield
+    utils._CIRCUIT_BREAKERS.clear()
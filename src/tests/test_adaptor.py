@@ -1,5 +1,11 @@
+import json
+import os
 import re
 from os.path import join
+import shutil
+import sys
+import tempfile
+import time
 import unittest
 from unittest.mock import patch
 from jsonschema import ValidationError
@@ -175,3 +181,194 @@ class AdaptorResponse(base.BaseCase):
 
         resp['message'] = 'p' * (available_bytes + 1)
         self.assertRaises(ValidationError, adaptor.validate_response, resp)
+
+FAKE_LAX = '''#!%s
+import json, os, sys
+args = sys.argv[1:]
+dirname = args[args.index('--dir') + 1]
+for fname in sorted(os.listdir(dirname)):
+    msid = fname.split('-')[1]
+    if msid != '00003':
+        article_json = json.load(open(os.path.join(dirname, fname)))
+        print(json.dumps({'id': int(msid), 'status': 'ingested', 'title': article_json['title'], 'args': args}))
+'''
+
+def prepared(request, outgoing):
+    "a valid request without downloading or rendering anything"
+    params = {'action': request['action'], 'msid': request['id'], 'token': request['token'], 'version': request['version'],
+              'force': request['force'], 'dry_run': request['validate-only']}
+    if request['action'] != conf.PUBLISH:
+        params['article_json'] = '{}'
+    return request, params
+
+def bulk_response(params_list, action=conf.INGEST, force=False, dry_run=False):
+    return [adaptor.lax_response({'status': conf.INGESTED, 'message': None}, action, params['msid'], params['token'], force, dry_run)
+            for params in params_list]
+
+class Batching(base.BaseCase):
+    def setUp(self):
+        self.out = fs_adaptor.OutgoingQueue()
+        self.calls = []
+
+    def request(self, msid, action=conf.INGEST, **overrides):
+        path = join(self.fixtures_dir, 'elife-%s-v1.xml' % msid)
+        return fs_adaptor.mkreq(path, action=action, **overrides)
+
+    def call_lax_bulk(self, params_list, *args):
+        self.calls.append(('bulk', [params['msid'] for params in params_list]))
+        return bulk_response(params_list, *args)
+
+    def call_lax(self, **params):
+        self.calls.append((params['action'], params['msid']))
+        return adaptor.lax_response({'status': conf.PUBLISHED, 'message': None}, params['action'], params['msid'], params['token'])
+
+    def do_batched(self, requests, size=2, wait=60):
+        with patch('src.adaptor.prepare', prepared), \
+             patch('src.adaptor.call_lax_bulk', self.call_lax_bulk), patch('src.adaptor.call_lax', self.call_lax):
+            adaptor.do_batched(requests, self.out, size, wait)
+
+    def test_batches(self):
+        "ingest requests are sent to lax in batches, with a response for each request"
+        self.do_batched([self.request(msid) for msid in ['00001', '00002', '00003', '00004', '00005']])
+        self.assertEqual(self.calls, [('bulk', ['00001', '00002']), ('bulk', ['00003', '00004']), ('bulk', ['00005'])])
+        self.assertEqual([resp['id'] for resp in self.out.valids], ['00001', '00002', '00003', '00004', '00005'])
+
+    def test_batches__ordering(self):
+        "requests about an article reach lax in the order they were received"
+        requests = [
+            self.request('00001'),
+            self.request('00001'),
+            self.request('00002'),
+            self.request('00002', action=conf.PUBLISH),
+            self.request('00003'),
+            self.request('00004', force=False),
+        ]
+        self.do_batched(requests, size=10)
+        self.assertEqual(self.calls, [
+            ('bulk', ['00001']),
+            ('bulk', ['00001', '00002']),
+            ('publish', '00002'),
+            ('bulk', ['00003']),
+            ('bulk', ['00004']),
+        ])
+
+    def test_batches__wait(self):
+        "a batch is sent once its first request has waited long enough"
+        def requests():
+            yield self.request('00001')
+            # the first batch is sent while waiting on the next request
+            time.sleep(0.5)
+            self.assertEqual(self.calls, [('bulk', ['00001'])])
+            yield self.request('00002')
+        self.do_batched(requests(), size=10, wait=0.05)
+        self.assertEqual(self.calls, [('bulk', ['00001']), ('bulk', ['00002'])])
+
+    def test_batches__lax_fails(self):
+        "when lax fails every request read is responded to, including those read ahead of the failed batch"
+        def call_lax_bulk(params_list, *args):
+            # requests are read ahead while lax is called
+            time.sleep(0.2)
+            raise RuntimeError("lax broke")
+        requests = [self.request(msid) for msid in ['00001', '00002', '00003', '00004']]
+        with self.assertRaisesRegex(RuntimeError, "lax broke"), patch.object(self, 'call_lax_bulk', call_lax_bulk):
+            self.do_batched(requests)
+        self.assertEqual([resp['id'] for resp in self.out.errors], ['00001', '00002', '00003', '00004'])
+        messages = [resp['message'] for resp in self.out.errors]
+        self.assertTrue(all(message.startswith("lax failed attempting to handle our request") for message in messages[:2]))
+        self.assertTrue(all(message.startswith("request not handled: an earlier request failed") for message in messages[2:]))
+
+    def test_call_lax_bulk(self):
+        "lax is called once with a directory of article-json and its responses returned in order"
+        tempdir = tempfile.mkdtemp()
+        script = join(tempdir, 'manage.sh')
+        with open(script, 'w') as fh:
+            fh.write(FAKE_LAX % sys.executable)
+        os.chmod(script, 0o755)
+        params_list = [dict(msid=msid, version=1, token='token-' + msid, article_json=json.dumps({'title': msid}))
+                       for msid in ['9560', '00003', '1234']]
+        try:
+            with patch('src.adaptor.find_lax', return_value=script):
+                results = adaptor.call_lax_bulk(params_list, conf.INGEST, force=True)
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertEqual([result and result['title'] for result in results], ['9560', None, '1234'])
+        self.assertEqual(results[0]['token'], 'token-9560')
+        self.assertEqual(results[0]['id'], '9560')
+        self.assertEqual(results[0]['args'][:5], ['--skip-install', 'ingest', '--ingest', '--serial', '--dir'])
+        self.assertIn('--force', results[0]['args'])
+
+def slow_handler(request, outgoing):
+    "handles a request after its `delay`, noting when it started and finished in its `log`"
+    with open(request['log'], 'a') as fh:
+        fh.write('start %s\n' % request['token'])
+    time.sleep(request['delay'])
+    if request.get('fail'):
+        raise RuntimeError("lax failed")
+    with open(request['log'], 'a') as fh:
+        fh.write('end %s\n' % request['token'])
+    outgoing.write(json.dumps({'id': request['id'], 'token': request['token'], 'status': conf.INGESTED}))
+
+class Concurrent(base.BaseCase):
+    def setUp(self):
+        self.out = fs_adaptor.OutgoingQueue()
+        self.tempdir = tempfile.mkdtemp()
+        self.log = join(self.tempdir, 'log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def request(self, msid, token, delay=0, **kwargs):
+        return dict(id=msid, token=token, delay=delay, log=self.log, **kwargs)
+
+    def do_concurrent(self, requests, processes=2):
+        with patch('src.adaptor.handler', slow_handler):
+            adaptor.do_concurrent(requests, self.out, processes)
+        with open(self.log) as fh:
+            return fh.read().splitlines()
+
+    def tokens(self):
+        return [response['token'] for response in self.out.valids]
+
+    def test_do_concurrent(self):
+        "requests about different articles are handled at once and responses sent as each is handled"
+        requests = [self.request('1', 'a', delay=0.5), self.request('2', 'b')]
+        self.do_concurrent(requests)
+        self.assertEqual(self.tokens(), ['b', 'a'])
+
+    def test_do_concurrent__ordering(self):
+        "requests about the same article are handled one at a time, in the order they were received"
+        requests = [
+            self.request('1', 'a1', delay=0.5),
+            self.request('2', 'b1'),
+            self.request('1', 'a2'),
+            self.request('1', 'a3'),
+        ]
+        log = self.do_concurrent(requests, processes=3)
+        self.assertEqual(self.tokens(), ['b1', 'a1', 'a2', 'a3'])
+        article_log = [line for line in log if line.split()[1].startswith('a')]
+        self.assertEqual(article_log, ['start a1', 'end a1', 'start a2', 'end a2', 'start a3', 'end a3'])
+
+    def test_do_concurrent__unreadable_requests(self):
+        "requests that can't be read are still handled"
+        with patch('src.adaptor.handler', adaptor.handler):
+            adaptor.do_concurrent(['foo-bar', '{"foo-bar": "baz"}'], self.out, 2)
+        self.assertEqual(len(self.out.errors), 2)
+
+    def test_do_concurrent__lax_fails(self):
+        """requests being handled when lax fails are finished before the error is raised.
+        requests waiting on them and requests read after the error aren't handled and are sent an error response."""
+        def requests():
+            yield self.request('1', 'a1', delay=0.2, fail=True)
+            yield self.request('2', 'b1', delay=0.5)
+            yield self.request('1', 'a2')
+            # 'a1' fails while the next request is being read
+            time.sleep(0.4)
+            yield self.request('3', 'c1')
+            yield self.request('4', 'd1')
+        with self.assertRaisesRegex(RuntimeError, "lax failed"):
+            self.do_concurrent(requests())
+        self.assertEqual(self.tokens(), ['b1'])
+        # 'a2' was waiting on 'a1', 'c1' was read after 'a1' failed and 'd1' isn't read
+        self.assertEqual(sorted(response['token'] for response in self.out.errors), ['a2', 'c1'])
+        for response in self.out.errors:
+            self.assertEqual(response['message'], "request not handled: an earlier request failed: lax failed")
@@ -0,0 +1,260 @@
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sqlite3
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+import pytest
+import requests
+import cache_requests, glencoe, rpp
+
+@pytest.fixture
+def db():
+    path = tempfile.mkdtemp()
+    yield os.path.join(path, 'cache.sqlite3')
+    shutil.rmtree(path)
+
+@pytest.fixture
+def stats():
+    with mock.patch.dict(cache_requests.STATS, {'reads': 0, 'writes': 0, 'lock-waits': 0, 'lock-wait-seconds': 0.0}):
+        yield cache_requests.STATS
+
+def lock(path):
+    "returns a connection to the database at `path` holding its write lock"
+    con = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    con.execute("BEGIN IMMEDIATE")
+    return con
+
+def test_wal_dict(db):
+    "the database is in WAL mode and values can be written, read and deleted"
+    dbdict = cache_requests.WALPickleDict(db, 'responses')
+    dbdict['foo'] = {'bar': 1}
+    assert dbdict['foo'] == {'bar': 1}
+    assert list(dbdict) == ['foo']
+    del dbdict['foo']
+    assert len(dbdict) == 0
+    assert sqlite3.connect(db).execute("PRAGMA journal_mode").fetchone() == ('wal',)
+
+def test_wal_dict__threads(db):
+    "each thread has its own connection"
+    dbdict = cache_requests.WALDict(db, 'urls')
+    threads = [threading.Thread(target=dbdict.__setitem__, args=(str(i), i)) for i in range(5)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert sorted(dbdict.items()) == [(str(i), i) for i in range(5)]
+
+def test_read__never_waits(db, stats):
+    "reads are not blocked by another process writing"
+    dbdict = cache_requests.WALDict(db, 'urls')
+    dbdict['foo'] = 'bar'
+    writer = lock(db)
+    writer.execute("INSERT OR REPLACE INTO urls (key, value) VALUES ('foo', 'baz')")
+    assert dbdict['foo'] == 'bar'
+    writer.execute("COMMIT")
+    assert dbdict['foo'] == 'baz'
+    assert stats['lock-waits'] == 0
+
+def test_write__waits(db, stats):
+    "writes wait for another process's write to finish and the time spent waiting is recorded"
+    dbdict = cache_requests.WALDict(db, 'urls')
+    writer = lock(db)
+    threading.Timer(0.1, writer.execute, args=("COMMIT",)).start()
+    dbdict['foo'] = 'bar'
+    assert dbdict['foo'] == 'bar'
+    assert stats['writes'] == 1
+    assert stats['lock-waits'] == 1
+    assert stats['lock-wait-seconds'] >= 0.05
+
+def test_write__busy_timeout(db, stats):
+    "writes give up once they've waited longer than the busy timeout"
+    dbdict = cache_requests.WALDict(db, 'urls')
+    writer = lock(db)
+    with mock.patch('conf.REQUESTS_CACHE_BUSY_TIMEOUT', 0.05):
+        start = time.perf_counter()
+        with pytest.raises(sqlite3.OperationalError):
+            dbdict['foo'] = 'bar'
+        assert time.perf_counter() - start < 1
+    writer.execute("ROLLBACK")
+    # the failed write was rolled back
+    dbdict['foo'] = 'baz'
+    assert dbdict['foo'] == 'baz'
+
+def test_lru():
+    "the least recently used item is discarded first and values are copied going in and coming out"
+    lru = cache_requests.LRU(2)
+    val = {'foo': 'bar'}
+    lru.put('a', val)
+    lru.put('b', {})
+    val['foo'] = 'baz'
+    assert lru.get('a') == {'foo': 'bar'}
+    lru.get('a')['foo'] = 'baz'
+    assert lru.get('a') == {'foo': 'bar'}
+    lru.put('c', {})
+    assert lru.get('b') is None
+    assert len(lru) == 2
+
+def test_payloads():
+    "successful responses are parsed once and held in memory until the cache for that url is cleared"
+    gc_data = {'media1': {'jpg_href': 'https://example.org/1.jpg', 'mp4_href': 'https://example.org/1.mp4',
+                          'webm_href': 'https://example.org/1.webm', 'ogv_href': 'https://example.org/1.ogv',
+                          'width': 1, 'height': 2}}
+    resp = mock.Mock(status_code=200, json=lambda: gc_data)
+    # the response is in the requests cache
+    with mock.patch('cache_requests.stored_version', return_value=1):
+        with mock.patch('utils.requests_get', return_value=resp) as mock_get:
+            assert glencoe.metadata('1234') == gc_data
+            assert glencoe.metadata('1234') == gc_data
+            assert mock_get.call_count == 1
+            with mock.patch('requests_cache.core.get_cache'):
+                glencoe.clear_cache('1234')
+            glencoe.metadata('1234')
+            assert mock_get.call_count == 2
+
+def test_payloads__not_found():
+    "unsuccessful responses are not held in memory"
+    resp = mock.Mock(status_code=404)
+    with mock.patch('cache_requests.stored_version', return_value=1):
+        with mock.patch('utils.requests_get', return_value=resp) as mock_get:
+            assert rpp.snippet('1234') is None
+            assert rpp.snippet('1234') is None
+    assert mock_get.call_count == 2
+
+def test_payloads__uncached():
+    "payloads of responses that aren't in the requests cache aren't held in memory"
+    resp = mock.Mock(status_code=200, json=lambda: {'foo': 'bar'})
+    with mock.patch('cache_requests.stored_version', return_value=None):
+        with mock.patch('utils.requests_get', return_value=resp) as mock_get:
+            rpp_data = {'foo': 'bar', 'type': 'reviewed-preprint'}
+            assert rpp.snippet('1234') == rpp.snippet('1234') == rpp_data
+    assert mock_get.call_count == 2
+
+class CountingHandler(BaseHTTPRequestHandler):
+    "responds with the number of requests it has handled"
+    protocol_version = 'HTTP/1.1'
+    count = 0
+
+    def do_GET(self):
+        CountingHandler.count += 1
+        body = str(CountingHandler.count).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    CountingHandler.count = 0
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%s/' % httpd.server_port
+    with mock.patch.dict(cache_requests.SERVICE_URLS, {'test': url}), \
+         mock.patch('conf.REQUESTS_CACHE_TTLS', {'test': 60}):
+        yield url
+    httpd.shutdown()
+    httpd.server_close()
+
+def wait_for_refresh():
+    for _ in range(100):
+        if not cache_requests._refreshing:
+            return
+        time.sleep(0.02)
+
+def test_ttl(server):
+    "responses go stale after the TTL of the service they came from"
+    assert cache_requests.ttl(server + 'foo') == 60
+    assert cache_requests.ttl('https://example.org/foo') == 0
+    assert cache_requests.is_stale(server + 'foo', 61)
+    assert not cache_requests.is_stale(server + 'foo', 59)
+    assert not cache_requests.is_stale('https://example.org/foo', 10 ** 9)
+
+def test_stale_while_revalidate(server):
+    "stale responses are returned immediately and refreshed in the background"
+    session = cache_requests.RevalidatingSession(backend='memory')
+    assert session.get(server).text == '1'
+    assert session.get(server).text == '1'
+    assert CountingHandler.count == 1
+
+    later = datetime.utcnow() + timedelta(seconds=61)
+    with mock.patch('cache_requests.datetime') as mock_datetime:
+        mock_datetime.utcnow.return_value = later
+        resp = session.get(server)
+    assert resp.from_cache
+    assert resp.text == '1'
+    wait_for_refresh()
+    assert CountingHandler.count == 2
+    assert session.get(server).text == '2'
+
+@pytest.fixture
+def wal(db):
+    "the sqlite-wal requests cache, in a database of its own"
+    cache = cache_requests.WALCache(db[:-len('.sqlite3')], extension='.sqlite3')
+    with mock.patch('cache_requests._wal_cache', cache):
+        yield cache
+
+def test_payloads__stale(server, wal):
+    "parsed payloads held in memory go stale with their responses"
+    cache_requests.RevalidatingSession(backend=wal).get(server)
+    cache_requests.cache_payload(server, {'foo': 'bar'})
+    assert cache_requests.cached_payload(server) == {'foo': 'bar'}
+    with mock.patch('time.time', return_value=time.time() + 61):
+        assert cache_requests.cached_payload(server) is None
+
+def test_payloads__cleared_elsewhere(server, wal, db):
+    "a response removed from the requests cache by another process is no longer served from memory"
+    cache_requests.RevalidatingSession(backend=wal).get(server)
+    cache_requests.cache_payload(server, {'foo': 'bar'})
+    assert cache_requests.cached_payload(server) == {'foo': 'bar'}
+    con = sqlite3.connect(db)
+    with con:
+        con.execute("delete from responses")
+    assert cache_requests.cached_payload(server) is None
+
+def test_payloads__replaced_elsewhere(server, wal, db):
+    "a response replaced in the requests cache by another process is no longer served from memory"
+    cache_requests.RevalidatingSession(backend=wal).get(server)
+    cache_requests.cache_payload(server, {'foo': 'bar'})
+    other = cache_requests.WALCache(db[:-len('.sqlite3')], extension='.sqlite3')
+    key = other.create_key(requests.Request('GET', server).prepare())
+    other.save_response(key, requests.get(server))
+    assert cache_requests.cached_payload(server) is None
+
+def test_clear_expired(server):
+    "responses stale for longer than the maximum are removed"
+    session = cache_requests.RevalidatingSession(backend='memory')
+    session.get(server)
+    with mock.patch('requests.Session', return_value=session), mock.patch('conf.REQUESTS_CACHE_MAX_STALE', 60):
+        cache_requests.clear_expired()
+        assert len(session.cache.responses) == 1
+        later = datetime.utcnow() + timedelta(seconds=121)
+        with mock.patch('cache_requests.datetime') as mock_datetime:
+            mock_datetime.utcnow.return_value = later
+            cache_requests.clear_expired()
+    assert len(session.cache.responses) == 0
+
+def test_purge(server, db):
+    "every response tagged with an article's msid is removed at once"
+    cache = cache_requests.WALCache(db[:-len('.sqlite3')], extension='.sqlite3')
+    session = cache_requests.RevalidatingSession(backend=cache)
+    with cache_requests.tagged('iiif', '1234'):
+        session.get(server + 'a')
+        session.get(server + 'b')
+    with cache_requests.tagged('glencoe', 1234):
+        session.get(server + 'c')
+    with cache_requests.tagged('iiif', '5678'):
+        session.get(server + 'd')
+    session.get(server + 'e')
+    assert len(cache.responses) == 5
+
+    assert sorted(cache.purge(1234, 'iiif')) == [server + 'a', server + 'b']
+    assert cache.purge('01234') == [server + 'c']
+    assert len(cache.responses) == 2
+    # untagged and other article's responses are kept
+    session.get(server + 'd')
+    session.get(server + 'e')
+    assert CountingHandler.count == 5
@@ -0,0 +1,232 @@
+from collections import OrderedDict
+import threading
+import time
+from unittest import mock
+import pytest
+import requests
+import requests_cache
+import enrichment, iiif, utils
+
+def test_lookup():
+    "lookups outside of a session are made immediately"
+    with mock.patch('rpp.snippet', return_value={'id': '1234'}) as mock_fn:
+        assert enrichment.lookup('rpp', '1234') == {'id': '1234'}
+        assert enrichment.lookup('rpp', '1234', then=lambda v: v['id']) == '1234'
+    assert mock_fn.call_count == 2
+
+def test_lookup__session():
+    "lookups within a session are made once"
+    with mock.patch('rpp.snippet', return_value={'id': '1234'}) as mock_fn:
+        with enrichment.session():
+            first = enrichment.lookup('rpp', '1234')
+            second = enrichment.lookup('rpp', '1234')
+    assert mock_fn.call_count == 1
+    assert first == second
+    # results are copied, callers may safely modify them
+    assert first is not second
+
+def test_deferred():
+    "deferred lookups are recorded and a placeholder returned"
+    with mock.patch('rpp.snippet') as mock_fn:
+        with enrichment.deferred() as session:
+            result = enrichment.lookup('rpp', '1234')
+    assert not mock_fn.called
+    assert isinstance(result, enrichment.Pending)
+    assert list(session.manifest.keys()) == [('rpp', '1234')]
+
+def test_deferred__services():
+    "only lookups to the given services are deferred"
+    with mock.patch('rpp.snippet', return_value=None) as mock_fn:
+        with enrichment.deferred(['iiif']) as session:
+            assert enrichment.lookup('rpp', '1234') is None
+            assert isinstance(enrichment.lookup('iiif', '1234', 'foo.tif'), enrichment.Pending)
+    assert mock_fn.called
+    assert list(session.manifest.keys()) == [('iiif', '1234', 'foo.tif')]
+
+def test_resolve():
+    "deferred lookups are made and their results patched into the data"
+    sizes = {'a.tif': (1, 2), 'b.tif': (3, 4)}
+    with mock.patch('iiif.basic_info', side_effect=lambda msid, fname: sizes[fname]) as mock_fn:
+        with enrichment.deferred() as session:
+            data = {
+                'a': enrichment.lookup('iiif', '1234', 'a.tif', then=list),
+                'b': [enrichment.lookup('iiif', '1234', 'b.tif'), enrichment.lookup('iiif', '1234', 'a.tif')],
+            }
+        actual = session.resolve(data)
+    assert actual == {'a': [1, 2], 'b': [(3, 4), (1, 2)]}
+    # lookups are deduplicated
+    assert mock_fn.call_count == 2
+    assert not session.manifest
+
+def test_resolve__none_removed():
+    "placeholders whose result is `None` are removed from the data"
+    with mock.patch('rpp.snippet', side_effect=lambda msid: {'id': msid} if msid == '1' else None):
+        with mock.patch('cdn.url_exists', return_value=None):
+            with enrichment.deferred() as session:
+                data = OrderedDict([
+                    ('figuresPdf', enrichment.lookup('cdn', 'https://example.org/foo.pdf', '1234')),
+                    ('related', [enrichment.lookup('rpp', '1'), enrichment.lookup('rpp', '2')]),
+                    ('foo', None),
+                ])
+            actual = session.resolve(data)
+    assert actual == OrderedDict([('related', [{'id': '1'}]), ('foo', None)])
+
+def test_resolve__concurrent():
+    "deferred lookups are made concurrently"
+    barrier = threading.Barrier(3, timeout=5)
+
+    def basic_info(msid, fname):
+        # blocks until all three lookups are being made at once
+        barrier.wait()
+        return (1, 1)
+
+    with mock.patch('iiif.basic_info', side_effect=basic_info):
+        with enrichment.deferred() as session:
+            data = [enrichment.lookup('iiif', '1234', fname) for fname in ['a', 'b', 'c']]
+        assert session.resolve(data, max_workers=3) == [(1, 1), (1, 1), (1, 1)]
+
+def test_resolve__error():
+    "errors raised by a deferred lookup are re-raised"
+    with mock.patch('iiif.basic_info', side_effect=ValueError("unhandled status code from IIIF")):
+        with enrichment.deferred() as session:
+            data = [enrichment.lookup('iiif', '1234', 'a.tif')]
+        with pytest.raises(ValueError):
+            session.resolve(data)
+
+def test_resolve__per_host():
+    "no more than `max_per_host` lookups are made to the same host at once"
+    lock = threading.Lock()
+    current = {'iiif': 0, 'rpp': 0}
+    peak = {'iiif': 0, 'rpp': 0}
+
+    def counted(service, val):
+        def fn(*args):
+            with lock:
+                current[service] += 1
+                peak[service] = max(peak[service], current[service])
+            time.sleep(0.01)
+            with lock:
+                current[service] -= 1
+            return val
+        return fn
+
+    with mock.patch('iiif.basic_info', side_effect=counted('iiif', (1, 1))), \
+         mock.patch('rpp.snippet', side_effect=counted('rpp', {})):
+        with enrichment.deferred() as session:
+            data = [enrichment.lookup('iiif', '1234', str(i)) for i in range(10)]
+            data += [enrichment.lookup('rpp', str(i)) for i in range(10)]
+        session.resolve(data, max_workers=10, max_per_host=2)
+    assert peak == {'iiif': 2, 'rpp': 2}
+
+def test_resolve__serial():
+    "lookups are made one after the other, in the order they were deferred, when `max_workers` is 1"
+    calls = []
+    with mock.patch('iiif.basic_info', side_effect=lambda msid, fname: calls.append((fname, threading.get_ident())) or (1, 1)):
+        with enrichment.deferred() as session:
+            data = [enrichment.lookup('iiif', '1234', fname) for fname in ['c', 'a', 'b']]
+        session.resolve(data, max_workers=1)
+    assert calls == [('c', threading.get_ident()), ('a', threading.get_ident()), ('b', threading.get_ident())]
+
+def test_call_all():
+    "results are returned in the order of the lookups given, failed lookups have their exception as their result"
+    err = ValueError("bad")
+
+    def fn(key):
+        if key[2] == 'bad':
+            raise err
+        return key[2]
+    key_list = [('iiif', '1234', 'a'), ('rpp', '1234'), ('iiif', '1234', 'bad'), ('iiif', '1234', 'a')]
+    assert enrichment.call_all(key_list, 4, 1, fn=lambda key: key[1] if key[0] == 'rpp' else fn(key)) == ['a', '1234', err, 'a']
+
+def test_interleave():
+    "lookups to different hosts are interleaved"
+    key_list = [('iiif', '1234', 'a'), ('iiif', '1234', 'b'), ('iiif', '1234', 'c'), ('rpp', '1'), ('rpp', '2')]
+    assert enrichment.interleave(key_list) == [
+        ('iiif', '1234', 'a'), ('rpp', '1'), ('iiif', '1234', 'b'), ('rpp', '2'), ('iiif', '1234', 'c')
+    ]
+
+def test_timeouts():
+    "each service is called with its own timeout"
+    timeouts = {'glencoe': 30.0, 'iiif': 10.0, 'cdn': 5.0, 'rpp': None}
+    resp = mock.Mock(status_code=404)
+    with mock.patch('conf.ENRICHMENT_TIMEOUTS', timeouts):
+        with mock.patch('utils.requests_get', return_value=resp) as mock_get:
+            enrichment.lookup('iiif', '1234', 'a.tif')
+            assert mock_get.call_args.kwargs['timeout'] == 10.0
+            enrichment.lookup('rpp', '1234')
+            assert mock_get.call_args.kwargs['timeout'] is None
+        with mock.patch('utils.requests_session') as mock_session:
+            mock_head = mock_session.return_value.head
+            mock_head.return_value = resp
+            enrichment.lookup('cdn', 'https://example.org/foo.pdf', '1234')
+            assert mock_head.call_args.kwargs['timeout'] == 5.0
+
+def test_timeouts__iiif():
+    "a timed out request to IIIF is treated like a failed connection"
+    with mock.patch('utils.requests_get', side_effect=requests.ReadTimeout()):
+        assert iiif.iiif_info('1234', 'a.tif') == {}
+
+def test_deadline():
+    "lookups made once the session's deadline has passed fail the article with a clear error"
+    with mock.patch('rpp.snippet', return_value={'id': '1234'}) as mock_fn:
+        with enrichment.session(deadline=time.monotonic() - 1):
+            with pytest.raises(utils.DeadlineExceeded) as err:
+                enrichment.lookup('rpp', '1234')
+    assert not mock_fn.called
+    assert "enrichment deadline exceeded" in str(err.value)
+
+def test_deadline__fallback():
+    "lookups to services with a fallback are given the fallback once the deadline has passed"
+    with mock.patch('iiif.basic_info', return_value=(1, 2)) as mock_fn:
+        with enrichment.deferred() as session:
+            session.deadline = time.monotonic() - 1
+            session.fallbacks = {'iiif': (None, None)}
+            data = [enrichment.lookup('iiif', '1234', 'a.tif', then=list)]
+        assert session.resolve(data) == [[None, None]]
+    assert not mock_fn.called
+
+def test_deadline__passed_during_lookup():
+    "a lookup that completes after the deadline has passed is treated as having missed it"
+    def slow(msid):
+        time.sleep(0.05)
+        return {'id': msid}
+    with mock.patch('rpp.snippet', side_effect=slow):
+        with enrichment.session(deadline=time.monotonic() + 0.01):
+            with pytest.raises(utils.DeadlineExceeded):
+                enrichment.lookup('rpp', '1234')
+
+def test_deadline__threads():
+    "deferred lookups made by the pool's threads are made within the session's deadline"
+    remaining = []
+    with mock.patch('iiif.basic_info', side_effect=lambda msid, fname: remaining.append(utils.remaining()) or (1, 1)):
+        with enrichment.deferred() as session:
+            session.deadline = time.monotonic() + 60
+            data = [enrichment.lookup('iiif', '1234', fname) for fname in ['a', 'b', 'c']]
+        session.resolve(data, max_workers=3)
+    assert len(remaining) == 3
+    assert all(0 < time_left <= 60 for time_left in remaining)
+
+def open_circuit(unreachable):
+    breaker = utils.CircuitBreaker('example.org')
+    for _ in range(utils.CIRCUIT_FAILURE_THRESHOLD):
+        breaker.failure(unreachable)
+    assert breaker.state == breaker.OPEN
+    return breaker
+
+def test_open_circuit():
+    "services fail the article when their host's circuit was opened by 5xx responses, just as the responses would have"
+    breaker = open_circuit(unreachable=False)
+    with mock.patch('utils.circuit_breaker', return_value=breaker), requests_cache.disabled():
+        with pytest.raises(utils.CircuitOpenError):
+            enrichment.lookup('rpp', '1234')
+        with pytest.raises(utils.CircuitOpenError):
+            iiif.iiif_info('1234', 'a.tif')
+    assert breaker.rejected == 2
+
+def test_open_circuit__unreachable():
+    "services carry on without data when their host's circuit was opened by failures to connect, just as they would have"
+    breaker = open_circuit(unreachable=True)
+    with mock.patch('utils.circuit_breaker', return_value=breaker), requests_cache.disabled():
+        assert enrichment.lookup('rpp', '1234') is None
+        assert iiif.iiif_info('1234', 'a.tif') == {}
+    assert breaker.rejected == 2
@@ -21,3 +21,12 @@ class Cmd(base.BaseCase):
                 mock.return_value.status_code = 418
                 self.assertRaises(ValueError, glencoe.metadata, 1)
                 self.assertTrue(mock_logger.error.called)
+
+    def test_metadata_uncached(self):
+        "responses aren't cached when glencoe caching is off, without uninstalling the cache for other threads"
+        with patch('conf.GLENCOE_REQUESTS_CACHING', False), patch('requests_cache.disabled') as disabled:
+            with patch('utils.requests_get') as mock:
+                mock.return_value.status_code = 404
+                self.assertEqual({}, glencoe.metadata(1))
+        self.assertEqual(mock.call_args[1]['cached'], False)
+        self.assertFalse(disabled.called)
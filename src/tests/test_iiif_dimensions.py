@@ -0,0 +1,32 @@
+from unittest import mock
+import iiif, iiif_dimensions
+
+def test_basic_info():
+    "an image's dimensions are asked of IIIF once and stored, the response itself isn't cached"
+    resp = mock.Mock(status_code=200, json=lambda: {'width': 1, 'height': 2, 'profile': [], 'sizes': []})
+    with mock.patch('utils.requests_get', return_value=resp) as mock_get:
+        assert iiif.basic_info('1234', 'a.tif') == (1, 2)
+        assert iiif.basic_info('01234', 'a.tif') == (1, 2)
+    assert mock_get.call_count == 1
+    assert mock_get.call_args.kwargs['cached'] is False
+    assert iiif_dimensions.get(1234, 'a.tif') == (1, 2)
+
+def test_basic_info__not_found():
+    "images not found in IIIF have no dimensions stored"
+    with mock.patch('utils.requests_get', return_value=mock.Mock(status_code=404)) as mock_get:
+        assert iiif.basic_info('1234', 'a.tif') == (None, None)
+        assert iiif.basic_info('1234', 'a.tif') == (None, None)
+    assert mock_get.call_count == 2
+    assert iiif_dimensions.get('1234', 'a.tif') is None
+
+def test_forget():
+    "the dimensions of one or all of an article's images can be forgotten"
+    iiif_dimensions.put('1234', 'a.tif', 1, 2)
+    iiif_dimensions.put('1234', 'b.tif', 3, 4)
+    iiif_dimensions.put('5678', 'a.tif', 5, 6)
+    with mock.patch('requests_cache.core.get_cache'):
+        iiif.clear_cache('1234', 'a.tif')
+    assert iiif_dimensions.get('1234', 'a.tif') is None
+    assert iiif_dimensions.get('1234', 'b.tif') == (3, 4)
+    assert iiif_dimensions.forget('1234') == 1
+    assert iiif_dimensions.get('5678', 'a.tif') == (5, 6)
@@ -0,0 +1,55 @@
+import os
+import struct
+from unittest import mock
+import pytest
+import iiif, image_headers
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+
+def gif(width, height):
+    return b'GIF89a' + struct.pack('<HH', width, height) + b'\x00\x00\x00'
+
+def jpeg(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    dht = b'\xff\xc4' + struct.pack('>H', 4) + b'\x00\x00'
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + app0 + dht + b'\xff' + sof + b'\xff\xd9'
+
+def tiff(width, height, order='<'):
+    header = (b'II' if order == '<' else b'MM') + struct.pack(order + 'HI', 42, 8)
+    entries = [
+        struct.pack(order + 'HHI', 254, 4, 1) + struct.pack(order + 'I', 0),
+        struct.pack(order + 'HHI', 256, 3, 1) + struct.pack(order + 'HH', width, 0),
+        struct.pack(order + 'HHI', 257, 4, 1) + struct.pack(order + 'I', height),
+    ]
+    return header + struct.pack(order + 'H', len(entries)) + b''.join(entries) + struct.pack(order + 'I', 0)
+
+@pytest.mark.parametrize('image', [
+    png(640, 480), gif(640, 480), jpeg(640, 480), tiff(640, 480), tiff(640, 480, order='>'),
+])
+def test_dimensions(tmp_path, image):
+    "dimensions are read from the image's header"
+    path = tmp_path / 'image'
+    path.write_bytes(image)
+    assert tuple(image_headers.dimensions(str(path))) == (640, 480)
+
+@pytest.mark.parametrize('image', [b'', b'not an image', png(640, 480)[:20], jpeg(640, 480)[:30]])
+def test_dimensions__unsupported(tmp_path, image):
+    "images that aren't supported or are truncated have no dimensions"
+    path = tmp_path / 'image'
+    path.write_bytes(image)
+    assert image_headers.dimensions(str(path)) is None
+
+def test_basic_info__local(tmp_path):
+    "images found locally are read rather than asking IIIF, which is asked for images that aren't"
+    os.makedirs(tmp_path / '01234')
+    (tmp_path / '01234' / 'elife-01234-fig1.tif').write_bytes(tiff(640, 480))
+    (tmp_path / 'elife-01234-fig2.jpg').write_bytes(jpeg(320, 240))
+    resp = mock.Mock(status_code=200, json=lambda: {'width': 1, 'height': 2})
+    with mock.patch('conf.IIIF_IMAGE_ROOT', str(tmp_path)), mock.patch('utils.requests_get', return_value=resp) as mock_get:
+        assert iiif.basic_info('1234', 'elife-01234-fig1.tif') == (640, 480)
+        assert iiif.basic_info('1234', 'elife-01234-fig2.jpg') == (320, 240)
+        assert not mock_get.called
+        assert iiif.basic_info('1234', 'elife-01234-fig3.tif') == (1, 2)
+        assert mock_get.called
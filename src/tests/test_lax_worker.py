@@ -0,0 +1,69 @@
+import json
+import sys
+import textwrap
+from unittest import mock
+import pytest
+import adaptor, lax_worker
+
+FAKE_WORKER = textwrap.dedent('''
+    import json, os, sys, time
+    for line in sys.stdin:
+        request = json.loads(line)
+        command = request['args'][0]
+        if command == 'crash':
+            sys.exit(1)
+        if command == 'hang':
+            time.sleep(60)
+        if command == 'stale':
+            print(json.dumps({'id': 'foo', 'stdout': 'stale'}), flush=True)
+        stdout = {'args': request['args'], 'stdin': request['stdin'], 'pid': os.getpid()}
+        print(json.dumps({'id': request['id'], 'stdout': json.dumps(stdout)}), flush=True)
+''')
+
+@pytest.fixture
+def worker(tmp_path):
+    script = tmp_path / 'worker.py'
+    script.write_text(FAKE_WORKER)
+    lax = lax_worker.LaxWorker([sys.executable, str(script)], timeout=5)
+    yield lax
+    lax.stop()
+
+def test_call(worker):
+    "requests are handled by the same process"
+    first = json.loads(worker.call(['ingest', '--id', '1'], 'foo'))
+    second = json.loads(worker.call(['ingest', '--id', '2']))
+    assert first['args'] == ['ingest', '--id', '1']
+    assert first['stdin'] == 'foo'
+    assert second['stdin'] is None
+    assert first['pid'] == second['pid']
+    assert worker.starts == 1
+
+def test_call__crash(worker):
+    "a worker that exits fails the request it was handling and is started again for the next request"
+    pid = json.loads(worker.call(['ingest']))['pid']
+    with pytest.raises(lax_worker.LaxWorkerError):
+        worker.call(['crash'])
+    assert json.loads(worker.call(['ingest']))['pid'] != pid
+    assert worker.starts == 2
+
+def test_call__timeout(worker):
+    "a request that isn't answered in time fails and the worker is killed"
+    worker.timeout = 0.5
+    with pytest.raises(lax_worker.LaxWorkerError):
+        worker.call(['hang'])
+    assert not worker.alive()
+    assert json.loads(worker.call(['ingest']))['args'] == ['ingest']
+
+def test_call__stale(worker):
+    "responses to other requests are discarded"
+    assert json.loads(worker.call(['stale']))['args'] == ['stale']
+
+def test_call_lax(worker):
+    "lax is called with the same arguments whether it's a worker or not"
+    with mock.patch('conf.LAX_WORKER', True), mock.patch('adaptor.find_lax', return_value='/srv/lax/manage.sh'), \
+         mock.patch('lax_worker.worker', return_value=worker) as mock_worker:
+        resp = adaptor.call_lax('ingest', '1234', 1, 'token', article_json='{}', force=True)
+    mock_worker.assert_called_once_with('/srv/lax/manage.sh')
+    assert resp['args'] == ['ingest', '--ingest', '--serial', '--id', '1234', '--version', '1', '--force']
+    assert resp['stdin'] == '{}'
+    assert resp['token'] == 'token'
@@ -8,6 +8,7 @@ import os
 import json
 from os.path import join
 from tests import base
+import cache_requests, iiif_dimensions
 from src import main, utils, conf
 
 class Cmd(base.BaseCase):
@@ -314,6 +315,41 @@ def test_expand_placeholder():
     actual = main.expand_placeholder(msid, given)
     assert expected == actual
 
+def test_visit_all():
+    "each step is applied to each value in order in a single walk"
+    given = {"a": [{"uri": "foo"}, {"isbn": "9780198526636", "uri": "bar"}], "b": {"uri": "http://baz"}}
+    expected = main.format_isbns(main.expand_uris(1234, given))
+    steps = [main.expand_uris_step(1234), main.format_isbns_step()]
+    actual = main.visit_all(given, steps)
+    assert expected == actual
+
+def test_visit_all__order():
+    "steps are applied to a value in the order given"
+    steps = [
+        (lambda v: v == 1, lambda v: 2),
+        (lambda v: v == 2, lambda v: 3),
+    ]
+    assert main.visit_all([1, 2], steps) == [3, 3]
+    assert main.visit_all([1, 2], list(reversed(steps))) == [2, 3]
+
+def test_visit__inplace():
+    "data is modified in place and not copied"
+    row = {"uri": "foo"}
+    given = {"a": [row]}
+    actual = main.visit(given, *main.expand_uris_step(1234), inplace=True)
+    assert actual is given
+    assert actual["a"][0] is row
+    assert row == {"uri": main.cdnlink(1234, "foo")}
+
+def test_visit_all__inplace():
+    "same results as copying the data"
+    given = {"a": [{"uri": "foo", "references": []}, {"isbn": "9780198526636"}]}
+    steps = [main.expand_uris_step(1234), main.format_isbns_step(), main.prune_step(inplace=True)]
+    expected = main.visit_all(json.loads(json.dumps(given)), steps)
+    actual = main.visit_all(given, steps, inplace=True)
+    assert actual is given
+    assert expected == actual
+
 def test_isbn():
     cases = [
         (None, None),
@@ -542,7 +578,7 @@ def test_elife_assessment():
           'title': 'eLife assessment'}}]
     soup = parseJATS.parse_xml(base.read_fixture("xml-snippets/elife-1234567890-v2.elife-assessment.xml"))
     description = {'elifeAssessment': main.VOR['elifeAssessment']}
-    actual = list(main.render(description, [soup]))
+    actual = list(et3.render.render(description, [soup]))
     assert expected == actual
 
 def test_recommendations_for_authors():
@@ -555,14 +591,14 @@ def test_recommendations_for_authors():
           'title': 'Recommendations for authors'}}]
     soup = parseJATS.parse_xml(base.read_fixture("xml-snippets/elife-1234567890-v2.recommendations-for-authors.xml"))
     description = {'recommendationsForAuthors': main.VOR['recommendationsForAuthors']}
-    actual = list(main.render(description, [soup]))
+    actual = list(et3.render.render(description, [soup]))
     assert expected == actual
 
 def test_public_reviews():
     expected = json.loads(base.read_fixture("xml-snippets/elife-1234567890-v2.public-reviews.json"))
     soup = parseJATS.parse_xml(base.read_fixture("xml-snippets/elife-1234567890-v2.public-reviews.xml"))
     description = {'publicReviews': main.VOR['publicReviews']}
-    actual = list(main.render(description, [soup]))
+    actual = list(et3.render.render(description, [soup]))
     assert expected == actual
 
 def test_doi_version():
@@ -580,7 +616,7 @@ def test_doi_version():
     soup = main.to_soup(xml)
     expected = {'doiVersion': '10.7554/eLife.1234567890.4'}
     description = utils.subdict(main.SNIPPET, ['doiVersion'])
-    actual = next(main.render(description, [soup]))
+    actual = next(et3.render.render(description, [soup]))
     assert expected == actual
 
 def test_doi_version__missing():
@@ -588,7 +624,7 @@ def test_doi_version__missing():
     soup = main.to_soup("")
     description = utils.subdict(main.SNIPPET, ['doiVersion'])
     expected = {}
-    actual = next(main.render(description, [soup]))
+    actual = next(et3.render.render(description, [soup]))
     assert expected == actual
 
 def test_related_article_to_reviewed_preprint():
@@ -735,3 +771,171 @@ def test_accepted_date():
             expected,
             actual,
         )
+
+
+def test_jats_memo():
+    "extractors are called once per soup within a `jats_memo` scope"
+    soup = main.to_soup(join(base.FIXTURES_DIR, 'elife-16695-v1.xml'))
+    with mock.patch('elifetools.parseJATS.pub_history', wraps=parseJATS.pub_history) as mock_fn:
+        with main.jats_memo() as memo:
+            first = main.jats('pub_history')(soup)
+            second = main.jats('pub_history')(soup)
+    assert mock_fn.call_count == 1
+    assert memo == {'results': mock.ANY, 'calls': 2, 'hits': 1}
+    assert first == second
+    # results are copied, callers may safely modify them
+    assert first is not second
+
+def test_jats_memo__scoped():
+    "extractors are not memoised outside of a `jats_memo` scope"
+    soup = main.to_soup(join(base.FIXTURES_DIR, 'elife-16695-v1.xml'))
+    with mock.patch('elifetools.parseJATS.pub_history', wraps=parseJATS.pub_history) as mock_fn:
+        with main.jats_memo():
+            main.jats('pub_history')(soup)
+        main.jats('pub_history')(soup)
+        main.jats('pub_history')(soup)
+    assert mock_fn.call_count == 3
+
+def test_jats_memo__arguments():
+    "extractors called with different arguments are memoised separately"
+    soup = main.to_soup(join(base.FIXTURES_DIR, 'elife-16695-v1.xml'))
+    with main.jats_memo() as memo:
+        main.jats('history_date', date_type='received')(soup)
+        main.jats('history_date', date_type='accepted')(soup)
+        main.jats('history_date', date_type='received')(soup)
+    assert memo['calls'] == 3
+    assert memo['hits'] == 1
+
+def test_render_plan():
+    "a render plan renders the same results as the description it was compiled from"
+    soup = main.to_soup(join(base.FIXTURES_DIR, 'elife-16695-v1.xml'))
+    ctx = {'version': 1, 'location': 'foo'}
+    with mock.patch('cdn.url_exists', return_value=None):
+        for poa in [True, False]:
+            expected = next(et3.render.render(main.mkdescription(poa), [soup], ctx))
+            actual = main.mkplan(poa).render(soup, ctx)
+            assert expected == actual
+            assert list(expected.keys()) == list(actual.keys())
+
+def test_render_plan__excluded_values():
+    description = OrderedDict([
+        ('a', [1]),
+        ('b', OrderedDict([
+            ('c', [main.EXCLUDE_ME]),
+            ('d', [(lambda v: v + 1, 3), sum]),
+        ])),
+        ('e', OrderedDict()),
+        ('f', [main.getvar('foo')]),
+    ])
+    expected = OrderedDict([('a', 1), ('b', OrderedDict([('d', 4)])), ('e', OrderedDict()), ('f', 'bar')])
+    assert main.RenderPlan(description).render(0, {'foo': 'bar'}) == expected
+
+def test_render_plan__timings():
+    description = OrderedDict([('a', [1]), ('b', OrderedDict([('c', [2])]))])
+    timings = {}
+    main.RenderPlan(description).render(0, timings=timings)
+    assert list(timings.keys()) == ['a', 'b.c']
+
+def test_render_plan__shared_pipelines():
+    "pipelines common to both snippets and articles are compiled once"
+    steps = dict(main.VOR_PLAN.steps)
+    assert steps[('snippet', 'title')] is steps[('article', 'title')]
+    assert steps[('snippet', 'title')] is dict(main.POA_PLAN.steps)[('article', 'title')]
+
+def test_render_single__sections():
+    "just the requested sections are rendered"
+    doc = join(base.FIXTURES_DIR, 'elife-36409-v2.xml')
+    expected = {'snippet': {'id': '36409', 'volume': 7}, 'article': {'title': 'Structure of a TRPM2 channel in complex with Ca<sup>2+</sup> explains unique gating regulation'}}
+    selected = []
+    original_select = main.RenderPlan.select
+
+    def select(plan, sections):
+        selected.append(original_select(plan, sections))
+        return selected[-1]
+
+    with mock.patch('glencoe.metadata') as glencoe_mock:
+        with mock.patch('iiif.basic_info') as iiif_mock:
+            with mock.patch.object(main.RenderPlan, 'select', select):
+                actual = main.render_single(doc, sections=['snippet.id', 'snippet.volume', 'article.title'], version=1)
+    assert expected == actual
+    # expensive sections and enrichment calls are skipped
+    assert not glencoe_mock.called
+    assert not iiif_mock.called
+    assert len(selected) == 1
+    assert [path for path, _ in selected[0].steps] == [
+        ('snippet',), ('snippet', 'id'), ('snippet', 'volume'), ('article',), ('article', 'title')
+    ]
+
+def test_render_single__unknown_section():
+    doc = join(base.FIXTURES_DIR, 'elife-16695-v1.xml')
+    with pytest.raises(ValueError):
+        main.render_single(doc, sections=['article.foo'], version=1)
+
+def test_render_plan__select():
+    description = OrderedDict([('a', [1]), ('b', OrderedDict([('c', [2]), ('d', [3])])), ('e', OrderedDict([('f', [4])]))])
+    plan = main.RenderPlan(description)
+    cases = [
+        (['a'], {'a': 1}),
+        (['b'], {'b': {'c': 2, 'd': 3}}),
+        (['b.d', 'a'], {'a': 1, 'b': {'d': 3}}),
+        (['e.f'], {'e': {'f': 4}}),
+    ]
+    for given, expected in cases:
+        assert plan.select(given).render(0) == expected
+    # original plan is unchanged
+    assert plan.render(0) == {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': {'f': 4}}
+
+def test_render_single__deferred_enrichment():
+    "remote services are called once the article has been rendered, IIIF once all images are known"
+    doc = join(base.FIXTURES_DIR, 'elife-24271-v1.xml')
+    with mock.patch('iiif.basic_info', return_value=(10, 20)) as mock_fn:
+        with mock.patch('cdn.url_exists', side_effect=lambda url, msid: url):
+            actual = main.render_single(doc, version=1)
+    assert actual['article']['figuresPdf'] == 'https://cdn.elifesciences.org/articles/24271/elife-24271-figures-v1.pdf'
+    # each image is only looked up once
+    assert mock_fn.call_count == len(set(call.args for call in mock_fn.call_args_list))
+    assert mock_fn.called
+    assert '"size": {"width": 10, "height": 20}' in json.dumps(actual)
+
+def test_render_single__enrichment_deadline():
+    "an article whose lookups can't be made within its deadline fails with a clear error"
+    doc = join(base.FIXTURES_DIR, 'elife-24271-v1.xml')
+    with mock.patch('cdn.url_exists', side_effect=lambda url, msid: url) as mock_fn:
+        with pytest.raises(RuntimeError, match="enrichment deadline exceeded"):
+            main.render_single(doc, version=1, **{'enrichment-deadline': 1e-9})
+    assert not mock_fn.called
+
+def test_enrichment_lookups():
+    "the lookups an article would make are found without making them"
+    values = {'iiif': (1, 1), 'cdn': None, 'rpp': None, 'glencoe': {}}
+    for fixture in ['elife-24271-v1.xml', 'article-with-reviewed-preprint-relations.xml']:
+        doc = join(base.FIXTURES_DIR, fixture)
+        with mock.patch('enrichment.call', side_effect=lambda key: values[key[0]]) as mock_fn:
+            expected = main.render_single(doc, version=1)
+            assert expected
+            made = set(call.args[0] for call in mock_fn.call_args_list)
+            mock_fn.reset_mock()
+            assert set(main.enrichment_lookups(doc, version=1)) == made
+            assert not mock_fn.called
+
+def test_render_single__concurrent_iiif():
+    "concurrent IIIF lookups render exactly the same article-json as serial lookups, including images IIIF doesn't know"
+    doc = join(base.FIXTURES_DIR, 'elife-24271-v1.xml')
+
+    def requests_get(url, timeout=None, cached=True):
+        body = {'width': len(url), 'height': 100}
+        return mock.Mock(status_code=404 if 'fig2' in url else 200, json=lambda: body)
+
+    def render(max_workers):
+        cache_requests.PAYLOADS.clear()
+        iiif_dimensions.forget('24271')
+        with mock.patch('utils.requests_get', side_effect=requests_get) as mock_fn:
+            with mock.patch('conf.ENRICHMENT_MAX_WORKERS', max_workers), mock.patch.dict(os.environ, {'FORCED_IIIF': '0'}):
+                with mock.patch('cdn.url_exists', return_value=None), mock.patch('rpp.snippet', return_value=None):
+                    return main.render_single(doc, version=1), mock_fn.call_count
+
+    serial, serial_calls = render(1)
+    concurrent, concurrent_calls = render(10)
+    assert serial_calls > 1
+    assert serial_calls == concurrent_calls
+    assert json.dumps(serial) == json.dumps(concurrent)
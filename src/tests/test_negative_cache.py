@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+import pytest
+import negative_cache, glencoe, iiif
+
+@pytest.fixture
+def cache():
+    path = tempfile.mkdtemp()
+    ttls = {'glencoe': 60, 'iiif': 60, 'cdn': 60, 'rpp': 0}
+    stats = {'hits': 0, 'misses': 0, 'stores': 0}
+    with mock.patch('conf.NEGATIVE_CACHE_DB', os.path.join(path, 'negative_cache.sqlite3')), \
+         mock.patch('conf.NEGATIVE_CACHE_TTLS', ttls), \
+         mock.patch.dict(negative_cache.STATS, stats):
+        yield negative_cache.STATS
+    shutil.rmtree(path)
+
+def test_not_found(cache):
+    "'not found' responses are remembered until they expire"
+    assert not negative_cache.is_not_found('iiif', 'https://example.org/a')
+    negative_cache.not_found('iiif', '1234', 'https://example.org/a')
+    assert negative_cache.is_not_found('iiif', 'https://example.org/a')
+    with mock.patch('time.time', return_value=time.time() + 61):
+        assert not negative_cache.is_not_found('iiif', 'https://example.org/a')
+        assert negative_cache.clear_expired() == 1
+    assert cache == {'hits': 1, 'misses': 2, 'stores': 1}
+
+def test_not_found__disabled(cache):
+    "services with a TTL of 0 have nothing remembered"
+    negative_cache.not_found('rpp', '1234', 'https://example.org/a')
+    assert not negative_cache.is_not_found('rpp', 'https://example.org/a')
+    assert cache['stores'] == 0
+
+def test_bust(cache):
+    "everything remembered about an article can be forgotten at once"
+    negative_cache.not_found('iiif', '1234', 'https://example.org/a')
+    negative_cache.not_found('cdn', 1234, 'https://example.org/b')
+    negative_cache.not_found('iiif', '5678', 'https://example.org/c')
+    assert negative_cache.bust('01234') == 2
+    assert not negative_cache.is_not_found('iiif', 'https://example.org/a')
+    assert negative_cache.is_not_found('iiif', 'https://example.org/c')
+
+def test_glencoe(cache):
+    "an article without videos is only asked about once"
+    with mock.patch('utils.requests_get', return_value=mock.Mock(status_code=404)) as mock_get:
+        assert glencoe.metadata('1234') == {}
+        assert glencoe.metadata('1234') == {}
+    assert mock_get.call_count == 1
+
+def test_iiif(cache):
+    "an image IIIF doesn't know of is only asked about once until its cache is cleared"
+    with mock.patch('utils.requests_get', return_value=mock.Mock(status_code=404)) as mock_get:
+        assert iiif.iiif_info('1234', 'a.tif') == {}
+        assert iiif.iiif_info('1234', 'a.tif') == {}
+        assert mock_get.call_count == 1
+        with mock.patch('requests_cache.core.get_cache'):
+            iiif.clear_cache('1234', 'a.tif')
+        assert iiif.iiif_info('1234', 'a.tif') == {}
+        assert mock_get.call_count == 2
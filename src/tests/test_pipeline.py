@@ -0,0 +1,140 @@
+from os.path import join
+import threading
+import time
+from unittest.mock import patch
+from . import base
+import adaptor, conf, fs_adaptor, pipeline
+
+INGEST_DIR = join(base.FIXTURES_DIR, 'dir-ingest', 'v1')
+
+def request(msid, action=conf.INGEST, **overrides):
+    return fs_adaptor.mkreq(join(INGEST_DIR, 'elife-%s-v1.xml' % msid), action=action, **overrides)
+
+def fake_render(request, article_xml):
+    if request['token'] == 'bad-render':
+        raise adaptor.RequestError("failed to render article-json from article-xml: bad", request)
+    if request['token'] == 'slow-render':
+        time.sleep(0.6)
+    return {'article': {'id': request['id']}}
+
+class Pipeline(base.BaseCase):
+    def setUp(self):
+        self.out = fs_adaptor.OutgoingQueue()
+        self.calls = []
+        self.lock = threading.Lock()
+        self.lax_delay = {}
+
+    def call_lax(self, action, msid, version, token, article_json=None, force=False, dry_run=False):
+        with self.lock:
+            self.calls.append(('start', action, msid))
+        time.sleep(self.lax_delay.get((action, msid), 0))
+        if token == 'bad-lax':
+            raise RuntimeError("lax broke")
+        with self.lock:
+            self.calls.append(('end', action, msid))
+        status = conf.PUBLISHED if action == conf.PUBLISH else conf.INGESTED
+        return adaptor.lax_response({'status': status, 'message': None}, action, msid, token, force, dry_run)
+
+    def run_pipeline(self, requests, **kwargs):
+        workers = dict(conf.PIPELINE_WORKERS, **kwargs.pop('workers', {}))
+        pipe = pipeline.Pipeline(self.out, workers, **kwargs)
+        with patch('adaptor.call_lax', self.call_lax), patch('adaptor.render_article_xml', fake_render):
+            pipe.run(requests)
+        return pipe
+
+    def responses(self):
+        return [(response['requested-action'], response['id']) for response in self.out.valids]
+
+    def test_run(self):
+        "ingest requests pass through every stage and publish requests go straight to lax"
+        requests = [request('09560'), request('09561'), request('09560', action=conf.PUBLISH)]
+        pipe = self.run_pipeline(requests)
+        self.assertEqual(sorted(self.responses()), [('ingest', '09560'), ('ingest', '09561'), ('publish', '09560')])
+        metrics = pipe.metrics()
+        self.assertEqual(list(metrics.keys()), pipeline.STAGES)
+        self.assertEqual([metrics[stage]['handled'] for stage in pipeline.STAGES], [2, 2, 2, 3])
+
+    def test_run__article_json(self):
+        "lax is given the rendered article-json"
+        # the article's images aren't looked up
+        with patch('adaptor.call_lax', side_effect=self.call_lax) as call_lax, patch('iiif.iiif_info', return_value={}):
+            pipeline.Pipeline(self.out).run([request('09560')])
+        self.assertEqual(self.responses(), [('ingest', '09560')])
+        self.assertIn('"id": "09560"', call_lax.call_args[1]['article_json'])
+
+    def test_run__ordering(self):
+        "requests about the same article are handled one at a time, in the order they were received"
+        self.lax_delay = {('ingest', '09560'): 0.5}
+        requests = [request('09560'), request('09560', action=conf.PUBLISH), request('09561')]
+        self.run_pipeline(requests, workers={'lax': 2})
+        self.assertEqual(self.responses(), [('ingest', '09561'), ('ingest', '09560'), ('publish', '09560')])
+        article_calls = [call for call in self.calls if call[2] == '09560']
+        self.assertEqual(article_calls, [('start', 'ingest', '09560'), ('end', 'ingest', '09560'),
+                                         ('start', 'publish', '09560'), ('end', 'publish', '09560')])
+
+    def test_run__bad_requests(self):
+        "requests that can't be read or rendered are sent an error response and the rest are handled"
+        requests = ['foo-bar', request('09560', token='bad-render'), request('09561')]
+        self.run_pipeline(requests)
+        self.assertEqual(self.responses(), [('ingest', '09561')])
+        self.assertEqual(len(self.out.errors), 2)
+        self.assertTrue(self.out.errors[0]['message'].startswith("request could not be parsed"))
+        self.assertTrue(self.out.errors[1]['message'].startswith("failed to render article-json"))
+
+    def test_run__lax_fails(self):
+        """requests being handled when lax fails are finished before the error is raised.
+        requests read but not yet handled are sent an error response instead."""
+        self.lax_delay = {('ingest', '09560'): 0.1}
+        def requests():
+            yield request('09560', token='bad-lax')
+            yield request('09560', action=conf.PUBLISH, token='waiting')
+            yield request('09561', token='slow-render')
+            # lax fails while the next request is being read
+            time.sleep(0.3)
+            yield request('09519', token='read-after')
+            yield request('09531', token='not-read')
+        with self.assertRaisesRegex(RuntimeError, "lax broke"):
+            self.run_pipeline(requests(), workers={'lax': 1})
+        # the publish was waiting on the failed ingest and the rendered ingest reaches lax after it failed
+        self.assertEqual(self.calls, [('start', 'ingest', '09560')])
+        self.assertEqual(self.responses(), [])
+        errors = {response['token']: response['message'] for response in self.out.errors}
+        self.assertEqual(sorted(errors.keys()), ['bad-lax', 'read-after', 'slow-render', 'waiting'])
+        self.assertTrue(errors.pop('bad-lax').startswith("lax failed attempting to handle our request"))
+        for message in errors.values():
+            self.assertEqual(message, "request not handled: an earlier request failed: lax broke")
+
+    def test_stage_stop(self):
+        "a stage is stopped without waiting on its workers or for space in its queue"
+        working, finish = threading.Event(), threading.Event()
+        def fn(job):
+            working.set()
+            finish.wait()
+        done = []
+        stage = pipeline.Stage('test', fn, 1, 1, lambda job, response=None: done.append(job), None, lambda: None)
+        stage.start()
+        stage.put('job-1')
+        working.wait()
+        stage.put('job-2')
+        stage.stop()
+        finish.set()
+        time.sleep(pipeline._POLL_INTERVAL * 2)
+        # the job being worked on is finished and the job waiting isn't started
+        self.assertEqual(done, ['job-1'])
+        self.assertEqual(stage.drain(), ['job-2'])
+
+    def test_run__backpressure(self):
+        "a slow stage fills the queue in front of it and the stages before it wait"
+        msids = ['09519', '09531', '09540', '09541', '09556', '09560']
+        self.lax_delay = {('ingest', msid): 0.1 for msid in msids}
+        pipe = self.run_pipeline([request(msid) for msid in msids], queue_size=1)
+        self.assertEqual(len(self.responses()), len(msids))
+        metrics = pipe.metrics()
+        self.assertTrue(all(metrics[stage]['max-depth'] <= 1 for stage in pipeline.STAGES))
+        self.assertGreater(metrics['serialise']['blocked'], 0.1)
+
+    def test_adaptor_do(self):
+        "the adaptor handles requests in stages when the pipeline is enabled"
+        with patch('conf.PIPELINE', True), patch('pipeline.do') as do:
+            adaptor.do([request('09560')], self.out)
+        self.assertEqual(do.call_count, 1)
@@ -0,0 +1,35 @@
+from os.path import join
+from unittest import mock
+import prefetch
+from . import base
+
+def test_lookups():
+    "the lookups an article would make are found, articles that can't be rendered have none"
+    with mock.patch('enrichment.call') as mock_fn:
+        key_list = prefetch.lookups(join(base.FIXTURES_DIR, 'elife-24271-v1.xml'))
+        assert key_list[0] == ('cdn', 'https://cdn.elifesciences.org/articles/24271/elife-24271-figures-v1.pdf', '24271')
+        assert ('iiif', '24271', 'elife-24271-fig1.tif') in key_list
+        assert prefetch.lookups(join(base.FIXTURES_DIR, 'elife-16695-v1.xml.invalid')) == []
+    assert not mock_fn.called
+
+def test_distinct():
+    "lookups found in many articles are made once"
+    key_lists = [[('rpp', '1'), ('iiif', '1', 'a.tif')], [], [('iiif', '1', 'a.tif'), ('rpp', '2')]]
+    assert prefetch.distinct(key_lists) == [('rpp', '1'), ('iiif', '1', 'a.tif'), ('rpp', '2')]
+
+def test_prefetch():
+    "each lookup is made, failures are counted"
+    def basic_info(msid, fname):
+        if fname == 'b.tif':
+            raise ValueError("unhandled status code from IIIF")
+        return (1, 1)
+
+    key_list = [('iiif', '1', 'a.tif'), ('iiif', '1', 'b.tif'), ('rpp', '1')]
+    with mock.patch('iiif.basic_info', side_effect=basic_info) as mock_iiif, \
+         mock.patch('rpp.snippet', return_value=None) as mock_rpp:
+        stats = prefetch.prefetch(key_list, max_workers=2, max_per_host=1)
+    assert mock_iiif.call_count == 2
+    assert mock_rpp.call_count == 1
+    assert stats['iiif'] == {'made': 2, 'failed': 1}
+    assert stats['rpp'] == {'made': 1, 'failed': 0}
+    assert stats['glencoe'] == {'made': 0, 'failed': 0}
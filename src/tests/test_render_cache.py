@@ -0,0 +1,81 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+import pytest
+import render_cache
+
+@pytest.fixture
+def cache_dir():
+    path = tempfile.mkdtemp()
+    with mock.patch('conf.RENDER_CACHE', True), mock.patch('conf.RENDER_CACHE_PATH', path):
+        yield path
+    shutil.rmtree(path)
+
+def test_key():
+    "the same xml and context always have the same key"
+    assert render_cache.key("<article/>", {'version': 1}) == render_cache.key(b"<article/>", {'version': 1})
+
+def test_key__differs():
+    "a change to the xml, the render context or the enrichment configuration results in a different key"
+    key = render_cache.key("<article/>", {'version': 1})
+    assert key != render_cache.key("<article></article>", {'version': 1})
+    assert key != render_cache.key("<article/>", {'version': 2})
+    with mock.patch('conf.IIIF', 'https://example.org/%(padded-msid)s%%2F%(fname)s/info.json'):
+        assert key != render_cache.key("<article/>", {'version': 1})
+    with mock.patch('conf.IIIF_IMAGE_ROOT', '/srv/images'):
+        assert key != render_cache.key("<article/>", {'version': 1})
+
+def test_code_modules():
+    "every module outside of the tests is part of the code version"
+    modules = render_cache.code_modules()
+    for module in ['main.py', 'enrichment.py', 'iiif_dimensions.py', 'image_headers.py', 'snapshot.py', 'conf.py', os.path.join('vendor', 'rfc3339.py')]:
+        assert module in modules
+    assert not [module for module in modules if module.startswith('tests')]
+
+def test_cached(cache_dir):
+    "article-json is rendered once and then read from the cache"
+    fn = mock.Mock(return_value='{"foo": "bar"}')
+    with mock.patch.dict(render_cache.STATS, {'hits': 0, 'misses': 0}):
+        assert render_cache.cached("<article/>", {}, fn) == '{"foo": "bar"}'
+        assert render_cache.cached("<article/>", {}, fn) == '{"foo": "bar"}'
+        assert render_cache.STATS['hits'] == 1
+        assert render_cache.STATS['misses'] == 1
+    assert fn.call_count == 1
+
+def test_cached__disabled(cache_dir):
+    "article-json is always rendered when the cache is disabled"
+    fn = mock.Mock(return_value='{"foo": "bar"}')
+    with mock.patch('conf.RENDER_CACHE', False):
+        render_cache.cached("<article/>", {}, fn)
+        render_cache.cached("<article/>", {}, fn)
+    assert fn.call_count == 2
+    assert os.listdir(cache_dir) == []
+
+def test_evict(cache_dir):
+    "least recently used entries are evicted first"
+    for i in range(3):
+        cache_key = render_cache.key("<article/>", {'version': i})
+        render_cache.put(cache_key, 'x' * 10)
+        os.utime(render_cache.path(cache_key), (i, i))
+    # use the oldest entry
+    render_cache.get(render_cache.key("<article/>", {'version': 0}))
+    assert render_cache.evict(20) == 20
+    assert render_cache.get(render_cache.key("<article/>", {'version': 0})) is not None
+    assert render_cache.get(render_cache.key("<article/>", {'version': 1})) is None
+    assert render_cache.get(render_cache.key("<article/>", {'version': 2})) is not None
+
+def test_put__evicts(cache_dir):
+    "the cache is kept within the maximum size"
+    with mock.patch('conf.RENDER_CACHE_MAX_SIZE', 25):
+        for i in range(5):
+            render_cache.put(render_cache.key("<article/>", {'version': i}), 'x' * 10)
+    assert sum(size for _, size, _ in render_cache.entries()) <= 25
+
+def test_cached__file_like(cache_dir):
+    "file-like objects are never cached"
+    fn = mock.Mock(return_value='{"foo": "bar"}')
+    render_cache.cached(io.StringIO("<article/>"), {}, fn)
+    render_cache.cached(io.StringIO("<article/>"), {}, fn)
+    assert fn.call_count == 2
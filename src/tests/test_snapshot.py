@@ -0,0 +1,85 @@
+from collections import OrderedDict
+import os
+from os.path import join
+import shutil
+import tempfile
+from unittest import mock
+import pytest
+import main, prefetch, snapshot
+from . import base
+
+GC_DATA = OrderedDict([('media1', OrderedDict([
+    ('jpg_href', 'https://example.org/media1.jpg'),
+    ('width', 640),
+    ('height', 480),
+    ('duration', 54.487),
+    ('mp4_href', 'https://example.org/media1.mp4'),
+    ('webm_href', 'https://example.org/media1.webm'),
+    ('ogv_href', 'https://example.org/media1.ogv'),
+]))])
+
+@pytest.fixture
+def tempdir():
+    path = tempfile.mkdtemp()
+    with mock.patch('conf.ENRICHMENT_SNAPSHOT_DB', join(path, 'enrichment_snapshot.sqlite3')):
+        yield path
+    shutil.rmtree(path)
+
+def test_import_snapshot(tempdir):
+    "lookups are resolved from an imported snapshot, keeping only what the scraper uses"
+    pairs = [
+        (('iiif', '1234', 'a.tif'), (10, 20)),
+        (('iiif', '1234', 'b.tif'), (None, None)),
+        (('cdn', 'https://example.org/a.pdf', '1234'), 'https://example.org/a.pdf'),
+        (('cdn', 'https://example.org/b.pdf', '1234'), None),
+        (('rpp', '1234'), OrderedDict([('id', '1234'), ('type', 'reviewed-preprint')])),
+        (('glencoe', '1234'), GC_DATA),
+        (('glencoe', '5678'), {}),
+    ]
+    path = join(tempdir, 'snapshot.jsonl')
+    assert snapshot.write(path, pairs) == 7
+    assert snapshot.import_snapshot(path) == 7
+
+    for key, result in pairs:
+        if key[0] != 'glencoe':
+            assert snapshot.lookup(key) == result
+    assert 'duration' not in snapshot.lookup(('glencoe', '1234'))['media1']
+    assert snapshot.lookup(('glencoe', '1234'))['media1']['mp4_href'] == 'https://example.org/media1.mp4'
+    assert snapshot.lookup(('glencoe', '5678')) == {}
+    with pytest.raises(snapshot.SnapshotMissError):
+        snapshot.lookup(('rpp', '5678'))
+
+    # snapshots are written deterministically
+    exported = join(tempdir, 'exported.jsonl')
+    snapshot.export_snapshot(exported)
+    snapshot.write(path, reversed(pairs))
+    with open(path) as fh1, open(exported) as fh2:
+        assert fh1.read() == fh2.read()
+
+def test_import_snapshot__invalid(tempdir):
+    "a snapshot with an invalid line isn't imported at all"
+    path = join(tempdir, 'snapshot.jsonl')
+    snapshot.write(path, [(('rpp', '1234'), None)])
+    snapshot.import_snapshot(path)
+    with open(path, 'a') as fh:
+        fh.write('{"lookup": ["foo", "1234"], "result": null}\n')
+    with pytest.raises(AssertionError):
+        snapshot.import_snapshot(path)
+    assert snapshot.lookup(('rpp', '1234')) is None
+
+def test_offline(tempdir):
+    "articles rendered offline from a snapshot are identical to articles rendered online"
+    doc = join(base.FIXTURES_DIR, 'elife-24271-v1.xml')
+    path = join(tempdir, 'snapshot.jsonl')
+    with mock.patch('iiif.basic_info', return_value=(10, 20)), mock.patch('cdn.url_exists', side_effect=lambda url, msid: url):
+        online = main.render_single(doc, version=1)
+        stats = prefetch.prefetch(prefetch.lookups(doc), export=path)
+    assert stats['iiif']['made'] > 1
+    snapshot.import_snapshot(path)
+    os.unlink(path)
+
+    with mock.patch('conf.ENRICHMENT_OFFLINE', True), \
+         mock.patch('iiif.basic_info') as mock_iiif, mock.patch('cdn.url_exists') as mock_cdn:
+        offline = main.render_single(doc, version=1)
+    assert not mock_iiif.called and not mock_cdn.called
+    assert offline == online
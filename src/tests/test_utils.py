@@ -3,6 +3,11 @@ from .base import BaseCase
 from unittest.mock import patch, call
 from src import utils
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+import pytest
+import requests_cache
 
 
 class Utils(BaseCase):
@@ -149,6 +154,32 @@ class Utils(BaseCase):
         for given, expected in cases:
             self.assertEqual(utils.json_dumps(expected), utils.json_dumps(utils.sortdict(given)))
 
+def test_rmkeys():
+    given = {'a': None, 'b': 1, 'c': None}
+    expected = {'b': 1, 'c': None}
+    assert utils.rmkeys(given, ['a', 'b'], lambda v: v is None) == expected
+    # original is untouched
+    assert given == {'a': None, 'b': 1, 'c': None}
+
+def test_rmkeys__inplace():
+    given = {'a': None, 'b': 1, 'c': None}
+    actual = utils.rmkeys(given, ['a', 'b'], lambda v: v is None, inplace=True)
+    assert actual is given
+    assert given == {'b': 1, 'c': None}
+
+def test_renkeys():
+    given = {'a': 1, 'b': 2}
+    expected = {'b': 2, 'z': 1}
+    assert utils.renkeys(given, [('a', 'z'), ('y', 'x')]) == expected
+    # original is untouched
+    assert given == {'a': 1, 'b': 2}
+
+def test_renkeys__inplace():
+    given = {'a': 1, 'b': 2}
+    actual = utils.renkeys(given, [('a', 'z')], inplace=True)
+    assert actual is given
+    assert given == {'b': 2, 'z': 1}
+
 def test_msid_from_elife_doi():
     cases = [
         ('10.7554/eLife.09560', '09560'),
@@ -174,3 +205,155 @@ def test_msid_from_elife_doi():
     ]
     for given, expected in cases:
         assert expected == utils.msid_from_elife_doi(given)
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_requests_get__pooled():
+    "connections to a host are kept alive and reused between requests"
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%s/' % server.server_port
+    try:
+        with requests_cache.disabled():
+            before = utils.requests_pool_stats()
+            for _ in range(3):
+                assert utils.requests_get(url).status_code == 200
+            after = utils.requests_pool_stats()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert after['requests'] - before['requests'] == 3
+    assert after['reused'] - before['reused'] == 2
+
+def test_requests_session():
+    "a session is shared by all threads and created for each session class requests_cache installs"
+    with requests_cache.enabled(backend='memory'):
+        session = utils.requests_session()
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(utils.requests_session()))
+        thread.start()
+        thread.join()
+        assert sessions == [session]
+        with requests_cache.disabled():
+            uncached_session = utils.requests_session()
+            assert uncached_session is not session
+            assert not hasattr(uncached_session, 'cache')
+        assert utils.requests_session() is session
+        assert utils.requests_session(cached=False) is uncached_session
+
+def test_circuit_breaker():
+    "a host that keeps failing fails fast until a probe succeeds"
+    breaker = utils.CircuitBreaker('example.org')
+    with patch.object(utils, 'CIRCUIT_FAILURE_THRESHOLD', 2), patch.object(utils, 'CIRCUIT_RESET_TIMEOUT', 30), \
+         patch('time.monotonic', return_value=100):
+        for _ in range(2):
+            breaker.acquire()
+            breaker.failure()
+        assert breaker.state == breaker.OPEN
+        with pytest.raises(utils.CircuitOpenError):
+            breaker.acquire()
+        assert breaker.rejected == 1
+
+    with patch.object(utils, 'CIRCUIT_RESET_TIMEOUT', 30), patch('time.monotonic', return_value=131):
+        # a single probe is let through
+        breaker.acquire()
+        assert breaker.state == breaker.HALF_OPEN
+        with pytest.raises(utils.CircuitOpenError):
+            breaker.acquire()
+        # a failed probe opens the circuit again
+        breaker.failure()
+        assert breaker.state == breaker.OPEN
+
+    with patch.object(utils, 'CIRCUIT_RESET_TIMEOUT', 30), patch('time.monotonic', return_value=162):
+        breaker.acquire()
+        breaker.success()
+        assert breaker.state == breaker.CLOSED
+        assert breaker.failures == 0
+
+class FailingHandler(KeepAliveHandler):
+    def do_GET(self):
+        FailingHandler.count += 1
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+def test_requests_get__circuit_breaker():
+    "requests to a failing host fail fast once its circuit is open"
+    FailingHandler.count = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FailingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%s/' % server.server_port
+    try:
+        with requests_cache.disabled(), patch.object(utils, 'CIRCUIT_FAILURE_THRESHOLD', 2), patch('time.sleep'):
+            with pytest.raises(utils.CircuitOpenError):
+                utils.requests_get(url)
+            with pytest.raises(utils.CircuitOpenError):
+                utils.requests_get(url)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert FailingHandler.count == 2
+    assert utils.circuit_breaker_stats()['127.0.0.1:%s' % server.server_port]['state'] == 'open'
+
+def test_deadline():
+    "the earliest deadline in effect is kept"
+    assert utils.remaining() is None
+    with patch('time.monotonic', return_value=100):
+        with utils.deadline(130):
+            assert utils.remaining() == 30
+            with utils.deadline(160):
+                assert utils.remaining() == 30
+            with utils.deadline(110):
+                assert utils.remaining() == 10
+            with utils.deadline(None):
+                assert utils.remaining() == 30
+        assert utils.remaining() is None
+
+def test_requests_get__deadline():
+    "requests aren't made once the deadline has passed"
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%s/' % server.server_port
+    try:
+        with requests_cache.disabled():
+            with utils.deadline(time.monotonic() + 60):
+                assert utils.requests_get(url).status_code == 200
+            with utils.deadline(time.monotonic() - 1):
+                with pytest.raises(utils.DeadlineExceeded):
+                    utils.requests_get(url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class SlowHandler(KeepAliveHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        super().do_GET()
+
+def test_requests_get__deadline_timeout():
+    "a request timed out by the deadline rather than its own timeout isn't a failure of the host"
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%s/' % server.server_port
+    try:
+        with requests_cache.disabled(), patch.object(utils, 'CIRCUIT_FAILURE_THRESHOLD', 2):
+            for _ in range(3):
+                with utils.deadline(time.monotonic() + 0.1):
+                    with pytest.raises(utils.DeadlineExceeded):
+                        utils.requests_get(url, timeout=5)
+            assert utils.circuit_breaker_stats()['127.0.0.1:%s' % server.server_port]['state'] == 'closed'
+            assert utils.requests_get(url, timeout=5).status_code == 200
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -7,8 +7,11 @@ import json
 import os
 import sqlite3
 import subprocess
+import threading
 import time
 from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse
 import jsonschema
 from jsonschema import validate as validator, ValidationError
 import requests
@@ -91,17 +94,20 @@ def contains_any(ddict, key_list):
 def has_all_keys(ddict, key_list):
     return all([key in ddict for key in key_list])
 
-def rmkeys(ddict, key_list, pred):
-    "immutable. removes all keys from ddict in given key list if pred is true"
-    data = copy.deepcopy(ddict)
+def rmkeys(ddict, key_list, pred, inplace=False):
+    """removes all keys from ddict in given key list if pred is true.
+    immutable unless `inplace` is true, in which case `ddict` is modified and returned."""
+    data = ddict if inplace else copy.deepcopy(ddict)
     for key in key_list:
-        if key in ddict and pred(data[key]):
+        if key in data and pred(data[key]):
             del data[key]
     return data
 
-def renkeys(data, pair_list):
-    "returns a copy of the given data with the list of oldkey->newkey pairs changes made"
-    data = copy.deepcopy(data)
+def renkeys(data, pair_list, inplace=False):
+    """returns a copy of the given data with the list of oldkey->newkey pairs changes made.
+    if `inplace` is true, `data` is modified and returned instead."""
+    if not inplace:
+        data = copy.deepcopy(data)
     for key, replacement in pair_list:
         if key in data:
             data[replacement] = data[key]
@@ -191,12 +197,36 @@ def call_n_times(fn, protect_from, num_attempts=3, initial_waiting_time=0):
                 if type(err) in protect_from:
                     LOG.error("caught error: %s" % err)
                     if waiting_time:
-                        time.sleep(waiting_time)
+                        # never wait beyond the deadline, if any, see `deadline`
+                        time_left = remaining()
+                        time.sleep(waiting_time if time_left is None else max(0, min(waiting_time, time_left)))
                         waiting_time = waiting_time * 2
                     continue
                 raise
     return wrap
 
+class DeadlineExceeded(RuntimeError):
+    pass
+
+_DEADLINE = threading.local()
+
+@contextmanager
+def deadline(at):
+    """requests made by this thread within this scope must be made before `at`, a `time.monotonic` time.
+    an earlier deadline already in effect is kept. `None` for no deadline."""
+    previous = getattr(_DEADLINE, 'at', None)
+    if at is not None and (previous is None or at < previous):
+        _DEADLINE.at = at
+    try:
+        yield
+    finally:
+        _DEADLINE.at = previous
+
+def remaining():
+    "returns the number of seconds left before this thread's deadline, `None` if there is no deadline"
+    at = getattr(_DEADLINE, 'at', None)
+    return None if at is None else at - time.monotonic()
+
 class RemoteResponseTemporaryError(RuntimeError):
     pass
 
@@ -207,12 +237,189 @@ class RemoteResponsePermanentError(RuntimeError):
 def requests_cache_create_key(prepared_request):
     return requests_cache.core.get_cache().create_key(prepared_request)
 
-def requests_get(*args, **kwargs):
+# consecutive failed requests to a host before requests to it fail fast, see `CircuitBreaker`.
+# set from `[enrichment] circuit_failure_threshold` by `conf`.
+CIRCUIT_FAILURE_THRESHOLD = 5
+# seconds requests to a host fail fast for before a request is let through to probe it.
+# set from `[enrichment] circuit_reset_timeout` by `conf`.
+CIRCUIT_RESET_TIMEOUT = 30
+
+class CircuitOpenError(RemoteResponsePermanentError):
+    """raised instead of making a request to a host whose last failure was a 5xx response.
+    the article fails just as it would have once the response had used up its retries."""
+    pass
+
+class CircuitOpenConnectionError(CircuitOpenError, requests.ConnectionError):
+    """raised instead of making a request to a host whose last failure was a failure to connect or a timeout.
+    handled like the failure to connect it stands in for."""
+    pass
+
+class CircuitBreaker:
+    """tracks failed requests to a host.
+
+    closed: requests are made. after `CIRCUIT_FAILURE_THRESHOLD` consecutive failures the circuit opens.
+    open: requests fail immediately with a `CircuitOpenError`. after `CIRCUIT_RESET_TIMEOUT` seconds the circuit is half-open.
+    half-open: a single request is made to probe the host. the circuit closes if it succeeds and opens again if it fails.
+
+    a failure is a failure to connect, a timeout or a 5xx response. requests are rejected with an error like the
+    last failure, see `CircuitOpenError`."""
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, host):
+        self.host = host
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.rejected = 0
+        # the last failure was a failure to connect or a timeout rather than a 5xx response
+        self.unreachable = False
+        self.lock = threading.Lock()
+
+    def transition(self, state):
+        LOG.warning("circuit for %s is %s", self.host, state,
+                    extra={'host': self.host, 'circuit': state, 'previous-circuit': self.state, 'failures': self.failures})
+        self.state = state
+        if state == self.OPEN:
+            self.opened = time.monotonic()
+
+    def acquire(self):
+        "raises a `CircuitOpenError` if a request to the host shouldn't be made"
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened >= CIRCUIT_RESET_TIMEOUT:
+                self.transition(self.HALF_OPEN)
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.probing):
+                self.rejected += 1
+                error = CircuitOpenConnectionError if self.unreachable else CircuitOpenError
+                raise error("circuit for %s is %s after %s failures" % (self.host, self.state, self.failures))
+            if self.state == self.HALF_OPEN:
+                self.probing = True
+
+    def success(self):
+        with self.lock:
+            self.probing = False
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self.transition(self.CLOSED)
+
+    def failure(self, unreachable=False):
+        "a 5xx response, or with `unreachable` a failure to connect or a timeout"
+        with self.lock:
+            self.probing = False
+            self.failures += 1
+            self.unreachable = unreachable
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= CIRCUIT_FAILURE_THRESHOLD):
+                self.transition(self.OPEN)
+
+    def release(self):
+        "the request was neither a success nor a failure, another probe may be made"
+        with self.lock:
+            self.probing = False
+
+# (host, pid) => circuit breaker
+_CIRCUIT_BREAKERS = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+def circuit_breaker(host):
+    "returns the circuit breaker for the given `host`, shared by all threads in this process"
+    key = (host, os.getpid())
+    with _CIRCUIT_BREAKERS_LOCK:
+        if key not in _CIRCUIT_BREAKERS:
+            _CIRCUIT_BREAKERS[key] = CircuitBreaker(host)
+        return _CIRCUIT_BREAKERS[key]
+
+def circuit_breaker_stats():
+    "returns the state, consecutive failures and requests rejected of the circuit for each host requested by this process"
+    with _CIRCUIT_BREAKERS_LOCK:
+        breakers = [breaker for (_, pid), breaker in _CIRCUIT_BREAKERS.items() if pid == os.getpid()]
+    return {breaker.host: {'state': breaker.state, 'failures': breaker.failures, 'rejected': breaker.rejected} for breaker in breakers}
+
+class CircuitBreakerAdapter(requests.adapters.HTTPAdapter):
+    """makes requests through the circuit breaker for their host, within this thread's deadline if any.
+    responses served from the requests cache never reach the adapter and are unaffected by either."""
+
+    def send(self, request, *args, **kwargs):
+        time_left = remaining()
+        # the request's timeout was cut short by the deadline
+        cut_short = False
+        if time_left is not None:
+            if time_left <= 0:
+                raise DeadlineExceeded("deadline passed %.1fs before requesting %s" % (-time_left, request.url))
+            timeout = kwargs.get('timeout')
+            cut_short = timeout is None or time_left < timeout
+            kwargs['timeout'] = time_left if timeout is None else min(timeout, time_left)
+        breaker = circuit_breaker(urlparse(request.url).netloc)
+        breaker.acquire()
+        try:
+            response = super().send(request, *args, **kwargs)
+        except requests.Timeout as err:
+            if cut_short:
+                # the deadline was too close for the host to answer, that's no failure of the host's
+                breaker.release()
+                raise DeadlineExceeded("deadline passed while requesting %s" % request.url) from err
+            breaker.failure(unreachable=True)
+            raise
+        except requests.ConnectionError:
+            breaker.failure(unreachable=True)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        return response
+
+# connections kept alive to each remote host by `requests_session`.
+# requests to a host beyond this many at once wait for a connection to be released.
+REQUESTS_POOL_MAXSIZE = 10
+
+# (session class, pid) => session
+_REQUESTS_SESSIONS = {}
+_REQUESTS_SESSIONS_LOCK = threading.Lock()
+
+def requests_session(cached=True):
+    """returns a session shared by all threads in this process, keeping connections to remote hosts alive between requests.
+    requests_cache replaces `requests.Session` when it's installed and while it's `disabled`, so a session is kept
+    for each session class and the one for the current `requests.Session` is returned.
+    responses to a session that isn't `cached` are never cached, whether requests_cache is installed or not.
+    requests are made through a `CircuitBreakerAdapter`."""
+    session_class = requests.Session if cached else requests_cache.core.OriginalSession
+    key = (session_class, os.getpid())
+    with _REQUESTS_SESSIONS_LOCK:
+        if key not in _REQUESTS_SESSIONS:
+            session = session_class()
+            adapter = CircuitBreakerAdapter(pool_maxsize=REQUESTS_POOL_MAXSIZE, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _REQUESTS_SESSIONS[key] = session
+        return _REQUESTS_SESSIONS[key]
+
+def requests_pool_stats():
+    """returns the number of requests made and connections opened by the sessions in this process.
+    `reused` is the number of requests that were made using a connection kept alive from a previous request."""
+    stats = {'requests': 0, 'connections': 0}
+    with _REQUESTS_SESSIONS_LOCK:
+        session_list = [session for (_, pid), session in _REQUESTS_SESSIONS.items() if pid == os.getpid()]
+    for session in session_list:
+        for adapter in set(session.adapters.values()):
+            for pool_key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(pool_key)
+                if pool:
+                    stats['requests'] += pool.num_requests
+                    stats['connections'] += pool.num_connections
+    stats['reused'] = stats['requests'] - stats['connections']
+    return stats
+
+def requests_get(*args, timeout=None, cached=True, **kwargs):
+    """makes a GET request, retrying temporary errors. `timeout` is the number of seconds to wait for the
+    remote server to respond, by default there is no timeout. the response isn't cached if `cached` is false."""
     def target(*args, **kwargs):
         # https://2.python-requests.org/en/master/user/advanced/#prepared-requests
         request = requests.Request('GET', *args, **kwargs)
         prepared_request = request.prepare()
-        s = requests.Session()
+        s = requests_session(cached)
 
         # if caching enabled, log the key used to cache the response
         if hasattr(s, 'cache'): # test if requests_cache is enabled
@@ -221,7 +428,7 @@ def requests_get(*args, **kwargs):
         else:
             LOG.info("Requesting URL %s", args[0])
 
-        response = s.send(prepared_request)
+        response = s.send(prepared_request, timeout=timeout)
         if response.status_code >= 500:
             raise RemoteResponseTemporaryError("status code was %s" % response.status_code)
         return response